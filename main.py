@@ -1,50 +1,37 @@
 #!/opt/local/bin/python3
+import os
 import sys
-import subprocess
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+from products import Scheduler
+from products import add_products
+from products import select_products
+from readgrib import FieldBroker
 
 fcst_date = "20220515000000"  # UTC
 opt_gsm = True  # GSMも作図する場合（00, 06, 12, 18UTCのみ）
 
-# 水平分布
-stations = ["Japan", "Tokyo"]
-# GSM
-progs_gsm = [
-    "python/readgrib_gsm_mslp_reg.py", "python/readgrib_gsm_rain_sum_reg.py",
-    "python/readgrib_gsm_temp_reg.py",
-    "python/readgrib_gsm_ccover_reg.py"
-]
-# MSM
-progs_msm = [
-    "python/readgrib_msm_mslp_reg.py", "python/readgrib_msm_rain_sum_reg.py",
-    "python/readgrib_msm_temp_reg.py",
-    "python/readgrib_msm_ccover_reg.py", "python/readgrib_msm_ept_reg.py",
-    "python/readgrib_msm_stemp_reg.py", "python/readgrib_msm_temp_reg.py"
-]
+# 同時に実行する処理の数
+jobs = 4
 
-# 時系列図（アメダス地点名）
-stations_tvar = ["Tokyo"]
-progs_tvar = [
-    "python/readgrib_msm_tvar_reg.py", "python/readgrib_gsm_tvar_reg.py"
-]
-times_tvar = ["36", "72"]
+# 読み込んだデータを共有メモリに置き、全ての作図プログラムで共有する場合
+opt_shm = False
 
 if __name__ == '__main__':
-    progs = progs_msm
-    if opt_gsm:
-        progs.extend(progs_gsm)
-    for sta in stations:
-        for p in progs:
-            res = subprocess.run([p, "--fcst_date", fcst_date, "--sta", sta],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            print(res.stdout.decode("utf-8"))
-            print(res.stderr.decode("utf-8"))
-
-    for sta in stations_tvar:
-        for p, t in zip(progs_tvar, times_tvar):
-            res = subprocess.run(
-                [p, "--fcst_date", fcst_date, "--sta", sta, "--fcst_time", t],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
-            print(res.stdout.decode("utf-8"))
-            print(res.stderr.decode("utf-8"))
+    dsets = ["MSM", "GSM"] if opt_gsm else ["MSM"]
+    # 作図するプロダクト（python/products/catalog.pyのproduct_table）
+    names = select_products(fcst_date, dsets)
+    # 取得・変換（複数のプロダクトで共有）と作図の依存関係を作り、並列に実行する
+    sched = Scheduler(jobs=jobs)
+    if opt_shm:
+        # 作図プログラムは、SHMFIELDS_GPVの記述子から共有メモリを読み込む
+        index_file = os.path.abspath("shm_fields.json")
+        os.environ["SHMFIELDS_GPV"] = index_file
+        with FieldBroker(index_file) as broker:
+            add_products(sched, fcst_date, names, broker=broker)
+            sched.run()
+            broker.end_cycle(fcst_date)
+    else:
+        add_products(sched, fcst_date, names)
+        sched.run()
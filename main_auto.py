@@ -1,57 +1,43 @@
 #!/opt/local/bin/python3
+import os
 import sys
 import subprocess
 from datetime import datetime, timedelta
 
-# 水平分布
-stations = ["Japan", "Tokyo"]
-# GSM
-progs_gsm = [
-    "python/readgrib_gsm_mslp_reg.py", "python/readgrib_gsm_rain_sum_reg.py",
-    "python/readgrib_gsm_temp_reg.py",
-    "python/readgrib_gsm_ccover_reg.py"
-]
-# MSM
-progs_msm = [
-    "python/readgrib_msm_mslp_reg.py", "python/readgrib_msm_rain_sum_reg.py",
-    "python/readgrib_msm_temp_reg.py",
-    "python/readgrib_msm_ccover_reg.py", "python/readgrib_msm_ept_reg.py",
-    "python/readgrib_msm_stemp_reg.py", "python/readgrib_msm_temp_reg.py"
-]
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+import readgrib
+from products import Scheduler
+from products import add_products
+from products import select_products
 
-# 時系列図（アメダス地点名）
-stations_tvar = ["Tokyo"]
-progs_tvar = [
-    "python/readgrib_msm_tvar_reg.py", "python/readgrib_gsm_tvar_reg.py"
-]
-times_tvar = ["36", "72"]
+# 同時に実行する処理の数
+jobs = 4
+
+# 作図結果のキャッシュ（入力が変わっていない図は作図せずに再利用する）
+render_cache_dir = os.environ.get('RENDER_CACHE_DIR', "render_cache")
 
 if __name__ == '__main__':
+    os.environ['RENDER_CACHE_DIR'] = render_cache_dir
     # 5時間前に設定
     time = datetime.utcnow() - timedelta(hours=5)
     fcst_date = time.strftime("%Y%m%d%H") + "0000"
     print(fcst_date)
-    hh = time.strftime("%H")
-    opt_gsm = False
-    if hh == "00" or hh == "06" or hh == "12" or hh == "18":
-        opt_gsm = True  # GSMも作図する場合（00, 06, 12, 18UTCのみ）
-    #
-    progs = progs_msm
-    if opt_gsm:
-        progs.extend(progs_gsm)
-    for sta in stations:
-        for p in progs:
-            res = subprocess.run([p, "--fcst_date", fcst_date, "--sta", sta],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            print(res.stdout.decode("utf-8"))
-            print(res.stderr.decode("utf-8"))
-
-    for sta in stations_tvar:
-        for p, t in zip(progs_tvar, times_tvar):
-            res = subprocess.run(
-                [p, "--fcst_date", fcst_date, "--sta", sta, "--fcst_time", t],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
-            print(res.stdout.decode("utf-8"))
-            print(res.stderr.decode("utf-8"))
+    # 次回実行時に使う1時間後の初期時刻のデータを、バックグラウンドで先に取得しておく
+    fcst_date_next = (time + timedelta(hours=1)).strftime("%Y%m%d%H") + "0000"
+    args_prefetch = [
+        "python/prefetch_gpv.py", "--fcst_date", fcst_date_next, "--timeout",
+        "3000", "--interval", "120"
+    ]
+    subprocess.Popen(args_prefetch,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    # 作図するプロダクト（GSMは00, 06, 12, 18UTCのみ）
+    names = select_products(fcst_date, ["MSM", "GSM"])
+    # 取得・変換（複数のプロダクトで共有）と作図の依存関係を作り、並列に実行する
+    # 作図が終わるまで、この初期時刻のファイルはキャッシュから削除しない
+    sched = Scheduler(jobs=jobs)
+    add_products(sched, fcst_date, names)
+    with readgrib.gcache.pinned(fcst_date):
+        sched.run()
@@ -0,0 +1,237 @@
+#!/opt/local/bin/python3
+#
+#  予報時間の区分毎のファイルが公開されたら、すぐにそのファイルの範囲を作図する
+#
+import os
+import sys
+import json
+import time
+import contextlib
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+import readgrib
+from readgrib import check_available
+from readgrib import fetch_segment
+from readgrib import ret_file_names
+from readgrib import segment_table
+from products import Scheduler
+from products import product_table
+from products import ret_command
+from products import run_command
+from products.catalog import cycle_step
+
+# 同時に実行する処理の数のデフォルト
+jobs_default = 4
+
+# 作図済みの予報時間を記録するファイル
+state_file = os.environ.get('WATCH_STATE', "watch_state.json")
+
+# 作図結果のキャッシュ（既に作図した予報時間の図は再利用する）
+render_cache_dir = os.environ.get('RENDER_CACHE_DIR', "render_cache")
+
+
+def _ret_local(file_names):
+    """キャッシュディレクトリかDATADIR_GPVにあるファイルを返す（無い場合はNone）"""
+    for d in (readgrib.cache_dir, readgrib.sys_file_dir):
+        for file_name in file_names:
+            file_dir_name = os.path.join(d, os.path.basename(file_name))
+            if os.path.isfile(file_dir_name):
+                return file_dir_name
+    return None
+
+
+def ret_ready(tsel, dset, lev, opt_fetch=True):
+    """初期時刻tselのファイルが先頭から揃っている最後の予報時間を返す
+
+    Parameters:
+    ----------
+    tsel: str
+        初期時刻（形式：20210819120000）
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    opt_fetch: bool
+        公開済みで未取得の区分を取得するかどうか
+    ----------
+    Returns:
+    ----------
+    int
+        揃っている最後の予報時間（先頭の区分も無い場合は-1）
+    ----------
+    """
+    ready = -1
+    for fcst_flag, _, fcst_end in segment_table[(dset, lev)]:
+        file_name_g2, file_name_nc = ret_file_names(tsel, dset, lev,
+                                                    fcst_flag)
+        # 変換済みのファイル（キャッシュディレクトリかDATADIR_GPV）
+        if _ret_local([file_name_nc]) is None:
+            # grib2ファイルがあれば変換する
+            if not opt_fetch or (_ret_local([file_name_g2]) is None and
+                                 not check_available(tsel, file_name_g2)):
+                break
+            print("fetch:", file_name_g2)
+            try:
+                fetch_segment(tsel, dset, lev, fcst_flag)
+            except OSError as e:
+                print("fetch failed:", file_name_g2, e)
+                break
+        ready = fcst_end
+    return ready
+
+
+def ret_latest_cycle(dset, now, lookback):
+    """先頭の区分が公開されている最新の初期時刻を返す（無い場合はNone）"""
+    for h in range(0, lookback + 1):
+        t = now - timedelta(hours=h)
+        if t.hour % cycle_step[dset] != 0:
+            continue
+        tsel = t.strftime("%Y%m%d%H") + "0000"
+        fcst_flag = segment_table[(dset, "surf")][0][0]
+        file_name_g2, file_name_nc = ret_file_names(tsel, dset, "surf",
+                                                    fcst_flag)
+        if _ret_local([file_name_nc, file_name_g2]) is not None:
+            return tsel
+        if check_available(tsel, file_name_g2):
+            return tsel
+    return None
+
+
+def _load_state():
+    """作図済みの予報時間を読み込む"""
+    if not os.path.isfile(state_file):
+        return dict()
+    with open(state_file, 'rt') as fin:
+        return json.load(fin)
+
+
+def _save_state(state):
+    """作図済みの予報時間を書き出す"""
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, 'wt') as fout:
+        json.dump(state, fout)
+    os.replace(tmp_file, state_file)
+
+
+def watch(dsets, lookback, state, jobs, fcst_date=None):
+    """新しく揃った区分の範囲を作図する
+
+    Parameters:
+    ----------
+    dsets: list(str, ...)
+        監視するデータセット（GSM、MSM）
+    lookback: int
+        何時間前までの初期時刻を確認するか
+    state: dict
+        初期時刻・作図プログラム毎の作図済みの予報時間（更新される）
+    jobs: int
+        同時に実行する作図プログラムの数
+    fcst_date: str
+        監視する初期時刻（Noneの場合は最新の初期時刻）
+    ----------
+    """
+    now = datetime.utcnow()
+    tasks = []
+    for dset in dsets:
+        if fcst_date is not None:
+            tsel = fcst_date
+            if int(tsel[8:10]) % cycle_step[dset] != 0:
+                continue
+        else:
+            tsel = ret_latest_cycle(dset, now, lookback)
+        if tsel is None:
+            continue
+        # 先に取得した区分から作図できるように、面毎に揃っている範囲を求める
+        ready = {lev: ret_ready(tsel, dset, lev) for lev in ("surf", "plev")}
+        for name, p in product_table.items():
+            if p["dset"] != dset:
+                continue
+            fcst_time = min(ready[p["lev"]], p["fcst_time"])
+            if fcst_time < 0 or (not p["partial"]
+                                 and fcst_time < p["fcst_time"]):
+                continue
+            key = tsel + ":" + name
+            if state.get(key, -1) >= fcst_time:
+                continue
+            # 新しく揃った区分の予報時間だけを作図する（それより前の図は
+            # キャッシュから復元してアニメーションにする）
+            fcst_start = None
+            if p["partial"] and key in state:
+                fcst_start = state[key] + 1
+            tasks.append((key, fcst_time,
+                          ret_command(name,
+                                      tsel,
+                                      fcst_time=fcst_time,
+                                      fcst_start=fcst_start)))
+    if not tasks:
+        return
+    # 同じ入力ファイルの取得・変換はreadgribで排他されるため、並列に実行できる
+    sched = Scheduler(jobs=jobs)
+    for key, _, args in tasks:
+        sched.add(key, run_command, (args, ))
+    # 作図が終わるまで、作図する初期時刻のファイルはキャッシュから削除しない
+    tsels = sorted(set(key.split(":")[0] for key, _, _ in tasks))
+    with contextlib.ExitStack() as stack:
+        for tsel in tsels:
+            stack.enter_context(readgrib.gcache.pinned(tsel))
+        results = sched.run()
+    for key, fcst_time, _ in tasks:
+        if not isinstance(results[key], Exception):
+            state[key] = fcst_time
+    # 古い初期時刻の記録を消す
+    if fcst_date is None:
+        tsel_min = (now -
+                    timedelta(hours=lookback + 24)).strftime("%Y%m%d%H")
+        for key in [k for k in state if k[0:10] < tsel_min]:
+            del state[key]
+    _save_state(state)
+
+
+def _construct_parser():
+    """オプションの読み込み"""
+    parser = argparse.ArgumentParser(
+        description='Render products as soon as each forecast segment lands')
+    parser.add_argument('--dset',
+                        type=str,
+                        default="MSM,GSM",
+                        help=('dataset name(s): MSM,GSM (default)'),
+                        metavar='<dset>')
+    parser.add_argument('--fcst_date',
+                        type=str,
+                        help=('forecast date; yyyymmddhhMMss; '
+                              'if not given, the latest cycle is watched'),
+                        metavar='<fcstdate>')
+    parser.add_argument('--lookback',
+                        type=int,
+                        default=6,
+                        help=('hours to look back for recent cycles'),
+                        metavar='<lookback>')
+    parser.add_argument('--interval',
+                        type=int,
+                        default=60,
+                        help=('polling interval in seconds (default: 60)'),
+                        metavar='<interval>')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=jobs_default,
+                        help=('number of products rendered at once'),
+                        metavar='<jobs>')
+    parser.add_argument('--once',
+                        action='store_true',
+                        help=('check once and exit (for crontab)'))
+    return parser
+
+
+if __name__ == '__main__':
+    args = _construct_parser().parse_args(sys.argv[1:])
+    os.environ['RENDER_CACHE_DIR'] = render_cache_dir
+    state = _load_state()
+    while True:
+        watch(args.dset.split(","), args.lookback, state, args.jobs,
+              args.fcst_date)
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,89 @@
+#!/opt/local/bin/python3
+#
+#  モジュールの読み込み時間とプログラムの起動時間を計測する
+#
+#  例：python3 python/bench_import.py --repeat 5
+#
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# 計測するモジュール
+bench_modules = ["utils", "jmaloc", "readgrib", "writenc", "products"]
+
+# 計測するプログラム（--helpで起動し、すぐに終了させる）
+bench_progs = [
+    "grib2nc_2d.py", "grib2nc_3d.py", "prefetch_gpv.py",
+    "readgrib_msm_mslp_reg.py"
+]
+
+# 読み込まれたかを確認する重いモジュール
+heavy_modules = ["matplotlib", "mpl_toolkits.basemap", "pandas"]
+
+# python/のディレクトリ
+top_dir = os.path.dirname(os.path.abspath(__file__))
+
+_script_module = """
+import sys, time, json
+t = time.perf_counter()
+import {name}
+t = time.perf_counter() - t
+print(json.dumps([t, [m for m in {heavy} if m in sys.modules]]))
+"""
+
+
+def bench_module(name):
+    """新しいプロセスでモジュールを読み込み、時間（秒）と読み込まれた重いモジュールを返す"""
+    res = subprocess.run(
+        [sys.executable, "-c",
+         _script_module.format(name=name, heavy=heavy_modules)],
+        cwd=top_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True)
+    return json.loads(res.stdout.decode("utf-8").splitlines()[-1])
+
+
+def bench_prog(prog):
+    """新しいプロセスでプログラムを--helpで起動し、終了までの時間（秒）を返す"""
+    t = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(top_dir, prog), "--help"],
+                   cwd=top_dir,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return time.perf_counter() - t
+
+
+def _median(v):
+    """中央値"""
+    v = sorted(v)
+    return v[len(v) // 2]
+
+
+def _construct_parser():
+    """オプションの読み込み"""
+    parser = argparse.ArgumentParser(
+        description='Measure import and startup time')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help=('number of runs per target (default: 5)'),
+                        metavar='<repeat>')
+    return parser
+
+
+if __name__ == '__main__':
+    args = _construct_parser().parse_args(sys.argv[1:])
+    print("{:<28s} {:>9s}  {}".format("module", "time (s)", "heavy modules"))
+    for name in bench_modules:
+        res = [bench_module(name) for _ in range(args.repeat)]
+        print("{:<28s} {:9.3f}  {}".format(name, _median([r[0] for r in res]),
+                                           ",".join(res[-1][1]) or "-"))
+    print()
+    print("{:<28s} {:>9s}".format("program --help", "time (s)"))
+    for prog in bench_progs:
+        t = _median([bench_prog(prog) for _ in range(args.repeat)])
+        print("{:<28s} {:9.3f}".format(prog, t))
@@ -0,0 +1,106 @@
+#!/opt/local/bin/python3
+#
+#  出力の設定（utils.output_profiles）毎に、1枚の図の作図時間を計測する
+#
+#  例：python3 python/bench_render.py --fcst_date 20220515000000 \
+#          --input_dir retrieve --sta Japan,Tokyo --repeat 3
+#
+import os
+import sys
+import time
+import argparse
+import tempfile
+import matplotlib
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from readgrib import ReadMSM
+from utils import output_profiles
+from utils import parse_fcst_date
+import readgrib_msm_mslp_reg
+
+# 計測する予報時間
+bench_fcst_time = 3
+
+
+def _median(v):
+    """中央値"""
+    v = sorted(v)
+    return v[len(v) // 2]
+
+
+def _construct_parser():
+    """オプションの読み込み"""
+    parser = argparse.ArgumentParser(
+        description='Measure rendering time per output profile')
+    parser.add_argument('--fcst_date',
+                        type=str,
+                        required=True,
+                        help=('forecast date; yyyymmddhhMMss, or ISO date'),
+                        metavar='<fcstdate>')
+    parser.add_argument('--input_dir',
+                        type=str,
+                        default="retrieve",
+                        help=('Directory of input files, or retrieve '
+                              '(default: retrieve)'),
+                        metavar='<input_dir>')
+    parser.add_argument('--sta',
+                        type=str,
+                        default="Japan",
+                        help=('Station name(s), comma separated '
+                              '(default: Japan)'),
+                        metavar='<sta>')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help=('number of runs per profile (default: 3)'),
+                        metavar='<repeat>')
+    return parser
+
+
+if __name__ == '__main__':
+    args = _construct_parser().parse_args(sys.argv[1:])
+    stas = [sta.strip() for sta in args.sta.split(",") if sta.strip()]
+    tsel = parse_fcst_date(args.fcst_date).strftime("%Y%m%d%H%M%S")
+    # 作図するデータ（readgrib_msm_mslp_reg.pyと同じ）
+    msm = ReadMSM(tsel, args.input_dir, "surf")
+    msm.set_fcst_time(bench_fcst_time)
+    lons_1d, lats_1d, lons, lats = msm.readnetcdf()
+    fields = [
+        msm.ret_var("PRMSL_meansealevel", fact=0.01),
+        msm.ret_var("APCP_surface"),
+        msm.ret_var("TMP_1D5maboveground", offset=-273.15),
+        msm.ret_var("UGRD_10maboveground"),
+        msm.ret_var("VGRD_10maboveground")
+    ]
+    msm.close_netcdf()
+    #
+    print("{:<10s} {:<10s} {:>9s} {:>9s} {:>10s}".format(
+        "sta", "profile", "time (s)", "saved (s)", "size (px)"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_filename = os.path.join(tmp_dir, "bench.png")
+        for sta in stas:
+            # 1回目は地図データの読み込みなどを含むため計測しない
+            readgrib_msm_mslp_reg.plotmap(sta, lons_1d, lats_1d, lons, lats,
+                                          *fields, "bench", output_filename)
+            times = dict()
+            for profile in output_profiles:
+                res = []
+                for _ in range(args.repeat):
+                    t = time.perf_counter()
+                    readgrib_msm_mslp_reg.plotmap(sta,
+                                                  lons_1d,
+                                                  lats_1d,
+                                                  lons,
+                                                  lats,
+                                                  *fields,
+                                                  "bench",
+                                                  output_filename,
+                                                  profile=profile)
+                    res.append(time.perf_counter() - t)
+                times[profile] = _median(res)
+                size = plt.imread(output_filename).shape
+                print("{:<10s} {:<10s} {:9.3f} {:9.3f} {:>10s}".format(
+                    sta, profile, times[profile],
+                    times["print"] - times[profile],
+                    str(size[1]) + "x" + str(size[0])))
@@ -1,13 +1,16 @@
 #!/opt/local/bin/python3
-import pandas as pd
+import os
 import numpy as np
-import json
 import sys
-from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from readgrib import ReadGSM, ReadMSM
+from readgrib import fetch_segment
+from readgrib import lead_time_index
 from writenc import WriteNC
-from writenc import count_dind
+from writenc import load_schema
+from writenc import ret_tind
 from utils import parse_command
+from utils import parse_fcst_date
 
 # pressure levels
 plevs = [
@@ -20,8 +23,44 @@ verbose = True
 # verbose = False
 
 
-def readnc(tsel, dset, file_dir, fcst_str, fcst_end, fcst_step):
-    """ NetCDFファイルを読み込みデータを返却
+# 並列に読み込むプロセスの数（1の場合は並列にしない）
+jobs = int(os.environ.get('GRIB2NC_JOBS', os.cpu_count() or 1))
+
+# 書き出す変数（output.jsonのvariable_entryのキー）
+#   キー: (変数名, 読み込む気圧面)
+#   読み込む気圧面がplevsより少ない場合、残りの気圧面は0とする
+var_table = {
+    "tmp": ("TMP", plevs),  # 気温 (K)
+    "rh": ("RH", plevs[0:12]),  # 相対湿度 (%)
+    "uwnd": ("UGRD", plevs),  # 東西風 (m/s)
+    "vwnd": ("VGRD", plevs),  # 南北風 (m/s)
+    "omg": ("VVEL", plevs),  # 鉛直速度 (Pa/s)
+    "hgt": ("HGT", plevs),  # ジオポテンシャル高度 (m)
+}
+
+# 読み込みプロセス毎のReadGSM、ReadMSM
+_readers = dict()
+
+
+def _ret_reader(tsel, dset, file_dir):
+    """ReadGSM、ReadMSMを返す（プロセス毎に1回だけ初期化する）"""
+    key = (tsel, dset, file_dir)
+    if key not in _readers:
+        if dset == "GSM":
+            # ReadGSM初期化
+            _readers[key] = ReadGSM(tsel, file_dir, "plev")
+        elif dset == "MSM":
+            # ReadMSM初期化
+            _readers[key] = ReadMSM(tsel, file_dir, "plev")
+        else:
+            raise ValueError("GSM or MSM")
+    return _readers[key]
+
+
+def read_vars(tsel, dset, file_dir, fcst_time, keys):
+    """ 予報時間fcst_timeの変数を3次元データ（気圧面, 緯度, 経度）で返す
+
+    読み込みプロセスで実行する（ファイルは予報時間毎に1回だけ開く）
 
     Parameters:
     ----------
@@ -29,132 +68,178 @@ def readnc(tsel, dset, file_dir, fcst_str, fcst_end, fcst_step):
         取得する予報時刻（形式：20210819120000）
     dset: str
         GSMかMSMを指定する
-    fcst_str: int
-        取得開始時刻を予報時刻からの時間（h）で与える
-    fcst_end: int
-        取得終了時刻を予報時刻からの時間（h）で与える
-    fcst_step: int
-        取得間隔を時間（h）で与える
+    file_dir: str
+        入力ディレクトリ、またはretrieve
+    fcst_time: int
+        予報時刻からの時間（h）
+    keys: list(str, ...)
+        変数（var_tableのキー）のリスト
+    ----------
     Returns
     ----------
-    dict of keys and ndarray value
-        取り出した3次元データを辞書形式で返却する
+    list(ndarray, ...)
+        keysの順に取り出した3次元データ
     ----------
     """
-    if dset == "GSM":
-        # ReadGSM初期化
-        gpv = ReadGSM(tsel, file_dir, "plev")
-    elif dset == "MSM":
-        # ReadMSM初期化
-        gpv = ReadMSM(tsel, file_dir, "plev")
-    else:
-        raise ValueError("GSM or MSM")
-    #
-    # fcst_timeを変えてデータを取り出す
-    tind = []
-    tmp = []
-    rh = []
-    uwnd = []
-    vwnd = []
-    omg = []
-    hgt = []
-    for fcst_time in np.arange(fcst_str, fcst_end + 1, fcst_step):
-        # fcst_timeを設定
-        gpv.set_fcst_time(fcst_time)
-        # 時刻情報を設定
-        tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
-        days = count_dind(start_year=1970,
-                          start_month=1,
-                          start_day=1,
-                          end_year=tinfo_fcst.year,
-                          end_month=tinfo_fcst.month,
-                          end_day=tinfo_fcst.day)
-        # 時刻(seconds from 1970-01-01)
-        tind.append(days * 86400 + tinfo_fcst.hour * 3600)
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = gpv.readnetcdf()
-        # 変数取り出し
-        # 気温を3次元のndarrayで取り出す
-        tmp.append(gpv.ret_var_3d("TMP", plevs))  # (K)
-        # 相対湿度データを3次元のndarrayで取り出す ()
-        rh_i = np.zeros((len(plevs), len(lats_1d), len(lons_1d)))
-        rh_i[0:12, :, :] = gpv.ret_var_3d("RH", plevs[0:12])
-        rh.append(rh_i)  # (%)
-        # 東西風、南北風を3次元のndarrayで取り出す
-        uwnd.append(gpv.ret_var_3d("UGRD", plevs))  # (m/s)
-        vwnd.append(gpv.ret_var_3d("VGRD", plevs))  # (m/s)
-        # 鉛直速度を3次元のndarrayで取り出す
-        omg.append(gpv.ret_var_3d("VVEL", plevs))  # (Pa/s)
-        # ジオポテンシャル高度を3次元のndarrayで取り出す
-        hgt.append(gpv.ret_var_3d("HGT", plevs))  # (m)
+    gpv = _ret_reader(tsel, dset, file_dir)
+    # fcst_timeを設定
+    gpv.set_fcst_time(fcst_time)
+    # NetCDFデータ読み込み
+    lons_1d, lats_1d, _, _ = gpv.readnetcdf()
+    try:
+        ds = []
+        for k in keys:
+            var_name, var_plevs = var_table[k]
+            d = np.zeros((len(plevs), len(lats_1d), len(lons_1d)))
+            d[0:len(var_plevs), :, :] = gpv.ret_var_3d(var_name, var_plevs)
+            ds.append(d)
+    finally:
         # ファイルを閉じる
         gpv.close_netcdf()
-        #
-    # 4次元配列に変換
-    tmp = np.array(tmp)
-    rh = np.array(rh)
-    uwnd = np.array(uwnd)
-    vwnd = np.array(vwnd)
-    omg = np.array(omg)
-    hgt = np.array(hgt)
-    # データを返却
-    return {
-        "longitude": lons_1d,
-        "latitude": lats_1d,
-        "level": plevs,
-        "time": tind,
-        "tmp": tmp,
-        "rh": rh,
-        "uwnd": uwnd,
-        "vwnd": vwnd,
-        "omg": omg,
-        "hgt": hgt
-    }
+    return ds
+
 
+def prefetch(tsel, dset, file_dir, fcst_times):
+    """ 予報時間の区分のファイルを先に取得し、読み込みプロセスの入力を返す
 
-def writenc(d, info_json_path="output.json", output_nc_path="test.nc"):
-    """ NetCDFファイルとして書き出す
+    読み込みプロセスが同じファイルを同時に取得しないように、必要な区分の
+    ファイルは最初に1回だけ取得する
 
     Parameters:
     ----------
-    d: dict of keys and ndarray value
-        書き出すデータを変数名をキー、ndarrayを値とした辞書で与える
+    tsel: str
+        取得する予報時刻（形式：20210819120000）
+    dset: str
+        GSMかMSMを指定する
+    file_dir: str
+        入力ディレクトリ、またはretrieve、force_retrieve
+    fcst_times: list(int, ...)
+        予報時刻からの時間（h）
+    ----------
+    Returns
+    ----------
+    str
+        読み込みプロセスの入力ディレクトリ（取得した場合はretrieve）
+    ----------
+    """
+    if file_dir not in ("retrieve", "force_retrieve"):
+        return file_dir
+    index = lead_time_index[(dset, "plev")]
+    fcst_flags = []
+    for fcst_time in fcst_times:
+        fcst_flag, _ = index.floor(fcst_time)
+        if fcst_flag not in fcst_flags:
+            fcst_flags.append(fcst_flag)
+    for fcst_flag in fcst_flags:
+        fetch_segment(tsel,
+                      dset,
+                      "plev",
+                      fcst_flag,
+                      force=(file_dir == "force_retrieve"))
+    return "retrieve"
+
+
+def write_rec(nc, schema, keys, rec, ds):
+    """ 予報時間のレコードrecに、読み込んだ変数を書き出す"""
+    for k, d in zip(keys, ds):
+        nc.write_rec(schema.variables[k].out_name, rec, d)
+        if verbose:
+            print("write: ", k, "rec =", rec)
+
+
+def convert(tsel,
+            dset,
+            file_dir,
+            fcst_str,
+            fcst_end,
+            fcst_step,
+            info_json_path="output.json",
+            output_nc_path="test.nc",
+            jobs=1):
+    """ NetCDFファイルを読み込み、1つのNetCDFファイルとして書き出す
+
+    予報時間毎に全ての変数の3次元データをjobs個のプロセスで並列に読み込み
+    （入力ファイルは予報時間毎に1回だけ開く）、このプロセスがあらかじめ
+    定義した変数のその時間のレコードに書き出す（書き出す場所は重ならない）。
+    読み込み中・書き出し待ちの予報時間はjobsの2倍までとし、使うメモリは
+    予報時間の数によらない
+
+    Parameters:
+    ----------
+    tsel: str
+        取得する予報時刻（形式：20210819120000）
+    dset: str
+        GSMかMSMを指定する
+    file_dir: str
+        入力ディレクトリ、またはretrieve、force_retrieve
+    fcst_str: int
+        取得開始時刻を予報時刻からの時間（h）で与える
+    fcst_end: int
+        取得終了時刻を予報時刻からの時間（h）で与える
+    fcst_step: int
+        取得間隔を時間（h）で与える
     info_json_path: str
         書き出すデータの情報を記述したJSONファイルのパス
     output_nc_path: str
         書き出すNetCDFファイルのパス
+    jobs: int
+        並列に読み込むプロセスの数（1の場合は並列にしない）
     ----------
     """
-    # JSONデータ読み込み
-    with open(info_json_path, 'rt') as fin:
-        data = fin.read()
+    # JSONデータ読み込み（プロセス内で1回だけ変換する）
+    schema = load_schema(info_json_path)
+    for k in schema.variables:
+        if k not in var_table:
+            raise ValueError("unknown variable in " + info_json_path + ": " +
+                             k)
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    file_dir = prefetch(tsel, dset, file_dir, fcst_times)
+    # 軸のデータ
+    gpv = _ret_reader(tsel, dset, file_dir)
+    gpv.set_fcst_time(fcst_times[0])
+    lons_1d, lats_1d, _, _ = gpv.readnetcdf()
+    gpv.close_netcdf()
+    axes = {
+        "longitude": lons_1d,
+        "latitude": lats_1d,
+        "level": plevs,
+        "time": ret_tind(parse_fcst_date(tsel), fcst_times)
+    }
     # NetCDFデータ作成
     nc = WriteNC(output_nc_path, force=True)
-    # ヘッダ情報を辞書に格納
-    header = dict(json.loads(data)["Header"])
     # ヘッダ情報をNetCDFファイルに追加
-    nc.set_gattr(**header)
-    # 複数の軸情報をDataFrameにする
-    df = pd.DataFrame(json.loads(data)["axis_entry"]).fillna("NaN")
-    for k in df.columns:  # DataFrameの列をキーに
-        # 読み込んだGPVデータから軸のデータを取り出す
-        dat = np.array(d[k])
-        # DataFrameから軸に対応する辞書を取り出し
-        # 軸情報をNetCDFファイルに追加
-        nc.create_axis(dat, **df.loc[:, k])
-        if verbose:
-            print("write: ", k, dat.shape)
-
-    # 変数の情報をDataFrameにする
-    df = pd.DataFrame(json.loads(data)["variable_entry"])
-    for k in df.columns:  # DataFrameの列をキーに
-        # 読み込んだGPVデータから軸のデータを取り出す
-        dat = np.array(d[k])
-        # DataFrameから変数に対応する辞書を取り出し
-        # 変数情報をNetCDFファイルに追加
-        nc.create_var(dat, **df.loc[:, k])
+    nc.set_gattr(**schema.header)
+    # 軸情報をNetCDFファイルに追加
+    for k, spec in schema.axes.items():
+        dat = np.array(axes[k])
+        nc.add_axis(dat, spec)
         if verbose:
             print("write: ", k, dat.shape)
+    # 変数を定義
+    for spec in schema.variables.values():
+        nc.add_var(spec)
+    #
+    # 予報時間毎に全ての変数を読み込み、書き出す
+    keys = list(schema.variables)
+    tasks = list(enumerate(fcst_times))
+    if jobs <= 1:
+        for rec, fcst_time in tasks:
+            write_rec(nc, schema, keys, rec,
+                      read_vars(tsel, dset, file_dir, fcst_time, keys))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            pending = dict()
+            tasks.reverse()
+            while tasks or pending:
+                while tasks and len(pending) < jobs * 2:
+                    rec, fcst_time = tasks.pop()
+                    future = executor.submit(read_vars, tsel, dset, file_dir,
+                                             int(fcst_time), keys)
+                    pending[future] = rec
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rec = pending.pop(future)
+                    write_rec(nc, schema, keys, rec, future.result())
     # ファイルを閉じる
     nc.close_netcdf()
 
@@ -172,12 +257,17 @@ if __name__ == '__main__':
     fcst_str = 0  # 開始時刻
     fcst_step = 3  # 作図する間隔
     # datetimeに変換
-    tinfo = pd.to_datetime(fcst_date)
+    tinfo = parse_fcst_date(fcst_date)
     tsel = tinfo.strftime("%Y%m%d%H%M%S")
     #
-    # NetCDFデータ読み込み(変数名をキーとした辞書型で格納)
-    d = readnc(tsel, dset, file_dir, fcst_str, fcst_end, fcst_step)
-
-    # NetCDFデータ書き出し
+    # NetCDFデータ読み込み・書き出し
     output_filename = "Z__C_RJTD_" + tsel + "_" + dset + "_GPV_Rjp_L-pall.nc"
-    writenc(d, info_json_path="output.json", output_nc_path=output_filename)
+    convert(tsel,
+            dset,
+            file_dir,
+            fcst_str,
+            fcst_end,
+            fcst_step,
+            info_json_path="output.json",
+            output_nc_path=output_filename,
+            jobs=jobs)
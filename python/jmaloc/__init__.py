@@ -2,13 +2,25 @@
 #  2018/06/21 Yamashita: first ver. (MapRegion)
 #  2021/06/13 Yamashita: add AmedasStation
 #
-
+import importlib
 from .radar import MapRegion
-from .amedas import AmedasStation
+from .radar import ret_regions
 
 __all__ = [
-   "MapRegion"
+   "MapRegion",
+   "ret_regions",
    "AmedasStation"
 ]
 
+# AmedasStationは使う時に読み込む（pandasの読み込みに時間がかかるため）
+_lazy_imports = {"AmedasStation": ".amedas"}
+
 
+def __getattr__(name):
+    """AmedasStationを初めて参照した時にモジュールを読み込む"""
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name], __name__),
+                        name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
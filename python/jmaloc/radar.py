@@ -2,6 +2,118 @@
 #  2018/06/21 Yamashita
 #  レーダー・ナウキャストの区分で作図範囲を返す
 #
+import math
+
+# 作図範囲のテーブル
+#   地域名: (lon_step, lon_min, lon_max, lat_step, lat_min, lat_max)
+region_table = {
+    # 日本周辺
+    "Japan": (5, 120.0, 150.0, 5, 22.4, 47.5),
+    # 北海道（北西部）
+    "Rumoi": (1, 139.0, 146.0, 1, 41.0, 46.0),
+    # 北海道（東部）
+    "Abashiri": (1, 141.0, 148.0, 1, 41.0, 46.0),
+    # 北海道（南西部）
+    "Sapporo": (1, 138.0, 145.0, 1, 40.0, 45.0),
+    # 東北地方（北部）
+    "Akita": (1, 138.0, 145.0, 1, 37.0, 42.0),
+    # 東北地方（南部）
+    "Sendai": (1, 137.0, 144.0, 1, 35.0, 40.0),
+    # 関東地方
+    "Tokyo": (1, 136.0, 143.0, 1, 33.0, 38.0),
+    # 甲信地方
+    "Kofu": (1, 135.0, 142.0, 1, 34.0, 39.0),
+    # 北陸地方（東部）
+    "Niigata": (1, 135.0, 142.0, 1, 35.0, 40.0),
+    # 北陸地方（西部）
+    "Kanazawa": (1, 134.0, 141.0, 1, 34.0, 39.0),
+    # 東海地方
+    "Nagoya": (1, 135.0, 143.0, 1, 32.0, 37.0),
+    # 近畿地方
+    "Osaka": (1, 132.0, 139.0, 1, 32.0, 37.0),
+    # 中国地方
+    "Okayama": (1, 130.0, 137.0, 1, 33.0, 38.0),
+    # 四国地方
+    "Kochi": (1, 130.0, 137.0, 1, 31.0, 36.0),
+    # 九州地方（北部）
+    "Fukuoka": (1, 127.0, 134.0, 1, 31.0, 36.0),
+    # 九州地方（南部）
+    "Kagoshima": (1, 127.0, 134.0, 1, 29.0, 34.0),
+    # 奄美地方
+    "Naze": (1, 126.0, 133.0, 1, 26.0, 31.0),
+    # 沖縄本島地方
+    "Naha": (1, 124.0, 131.0, 1, 24.0, 29.0),
+    # 大東島地方
+    "Daitojima": (1, 126.0, 133.0, 1, 24.0, 29.0),
+    # 宮古・八重山地方
+    "Miyakojima": (1, 121.0, 128.0, 1, 22.0, 27.0),
+}
+
+# 地域名の別名
+region_alias = {
+    "Morioka": "Akita",
+    "Fukushima": "Sendai",
+    "Yamagata": "Sendai",
+    "Kanto": "Tokyo",
+    "Kousin": "Kofu",
+    "Fukui": "Kanazawa",
+    "Toyama": "Kanazawa",
+    "Shizuoka": "Nagoya",
+    "Tokai": "Nagoya",
+    "Kinki": "Osaka",
+    "Hiroshima": "Okayama",
+    "Tyugoku": "Okayama",
+    "Shikoku": "Kochi",
+    "Amami": "Naze",
+    "Okinawa": "Naha",
+}
+
+# データ全域を作図する地域（インデックス範囲は格子全体）
+region_full = ["Japan"]
+
+# 格子情報のテーブル（wgrib2 -netcdfで変換した場合、緯度は南から北）
+#   (データセット, 面): (lon_min, lon_inc, lon_num, lat_min, lat_inc, lat_num)
+grid_table = {
+    ("MSM", "surf"): (120.0, 0.0625, 481, 22.4, 0.05, 505),
+    ("MSM", "plev"): (120.0, 0.125, 241, 22.4, 0.1, 253),
+    ("GSM", "surf"): (120.0, 0.125, 241, 20.0, 0.1, 301),
+    ("GSM", "plev"): (120.0, 0.125, 241, 20.0, 0.1, 301),
+}
+
+# インデックス範囲のキャッシュ（地域名, データセット, 面）: (i0, i1, j0, j1)
+_window_cache = dict()
+
+
+def _ret_index(x_min, x_inc, x_num, x0, x1, margin):
+    """等間隔格子で範囲[x0, x1]を含むインデックス範囲を返す"""
+    i0 = math.floor((x0 - x_min) / x_inc + 1.0e-6) - margin
+    i1 = math.ceil((x1 - x_min) / x_inc - 1.0e-6) + 1 + margin
+    return max(i0, 0), min(i1, x_num)
+
+
+def ret_regions(lon, lat):
+    """指定した地点を含む地域名のリストを返す
+
+    Parameters:
+    ----------
+    lon: float
+        地点の経度
+    lat: float
+        地点の緯度
+    ----------
+    Returns:
+    ----------
+    list(str, str, ...)
+        地点を含む地域名のリスト（region_tableの順）
+    ----------
+    """
+    return [
+        sta for sta, (_, lon_min, lon_max, _, lat_min, lat_max)
+        in region_table.items()
+        if lon_min <= lon <= lon_max and lat_min <= lat <= lat_max
+    ]
+
+
 class MapRegion():
     """レーダー・ナウキャストの区分で作図範囲を返す"""
 
@@ -22,163 +134,69 @@ class MapRegion():
         self.lat_min = None
         self.lat_max = None
         # 作図範囲の指定
-        # 日本周辺
-        if sta == "Japan":
-            self.lon_step = 5
-            self.lon_min = 120.0
-            self.lon_max = 150.0
-            self.lat_step = 5
-            self.lat_min = 22.4
-            self.lat_max = 47.5
-        # 北海道（北西部）
-        if sta == "Rumoi":
-            self.lon_step = 1
-            self.lon_min = 139.0
-            self.lon_max = 146.0
-            self.lat_step = 1
-            self.lat_min = 41.0
-            self.lat_max = 46.0
-        # 北海道（東部）
-        if sta == "Abashiri":
-            self.lon_step = 1
-            self.lon_min = 141.0
-            self.lon_max = 148.0
-            self.lat_step = 1
-            self.lat_min = 41.0
-            self.lat_max = 46.0
-        # 北海道（南西部）
-        if sta == "Sapporo":
-            self.lon_step = 1
-            self.lon_min = 138.0
-            self.lon_max = 145.0
-            self.lat_step = 1
-            self.lat_min = 40.0
-            self.lat_max = 45.0
-        # 東北地方（北部）
-        if sta == "Akita" or sta == "Morioka":
-            self.lon_step = 1
-            self.lon_min = 138.0
-            self.lon_max = 145.0
-            self.lat_step = 1
-            self.lat_min = 37.0
-            self.lat_max = 42.0
-        # 東北地方（南部）
-        if sta == "Sendai" or sta == "Fukushima" or sta == "Yamagata":
-            self.lon_step = 1
-            self.lon_min = 137.0
-            self.lon_max = 144.0
-            self.lat_step = 1
-            self.lat_min = 35.0
-            self.lat_max = 40.0
-        # 関東地方
-        if sta == "Tokyo" or sta == "Kanto":
-            self.lon_step = 1
-            self.lon_min = 136.0
-            self.lon_max = 143.0
-            self.lat_step = 1
-            self.lat_min = 33.0
-            self.lat_max = 38.0
-        # 甲信地方
-        if sta == "Kofu" or sta == "Kousin":
-            self.lon_step = 1
-            self.lon_min = 135.0
-            self.lon_max = 142.0
-            self.lat_step = 1
-            self.lat_min = 34.0
-            self.lat_max = 39.0
-        # 北陸地方（東部）
-        if sta == "Niigata":
-            self.lon_step = 1
-            self.lon_min = 135.0
-            self.lon_max = 142.0
-            self.lat_step = 1
-            self.lat_min = 35.0
-            self.lat_max = 40.0
-        # 北陸地方（西部）
-        if sta == "Kanazawa" or sta == "Fukui" or sta == "Toyama":
-            self.lon_step = 1
-            self.lon_min = 134.0
-            self.lon_max = 141.0
-            self.lat_step = 1
-            self.lat_min = 34.0
-            self.lat_max = 39.0
-        # 東海地方
-        if sta == "Nagoya" or sta == "Shizuoka" or sta == "Tokai":
-            self.lon_step = 1
-            self.lon_min = 135.0
-            self.lon_max = 143.0
-            self.lat_step = 1
-            self.lat_min = 32.0
-            self.lat_max = 37.0
-        # 近畿地方
-        if sta == "Osaka" or sta == "Kinki":
-            self.lon_step = 1
-            self.lon_min = 132.0
-            self.lon_max = 139.0
-            self.lat_step = 1
-            self.lat_min = 32.0
-            self.lat_max = 37.0
-        # 中国地方
-        if sta == "Okayama" or sta == "Hiroshima" or sta == "Tyugoku":
-            self.lon_step = 1
-            self.lon_min = 130.0
-            self.lon_max = 137.0
-            self.lat_step = 1
-            self.lat_min = 33.0
-            self.lat_max = 38.0
-        # 四国地方
-        if sta == "Kochi" or sta == "Shikoku":
-            self.lon_step = 1
-            self.lon_min = 130.0
-            self.lon_max = 137.0
-            self.lat_step = 1
-            self.lat_min = 31.0
-            self.lat_max = 36.0
-        # 九州地方（北部）
-        if sta == "Fukuoka":
-            self.lon_step = 1
-            self.lon_min = 127.0
-            self.lon_max = 134.0
-            self.lat_step = 1
-            self.lat_min = 31.0
-            self.lat_max = 36.0
-        # 九州地方（南部）
-        if sta == "Kagoshima":
-            self.lon_step = 1
-            self.lon_min = 127.0
-            self.lon_max = 134.0
-            self.lat_step = 1
-            self.lat_min = 29.0
-            self.lat_max = 34.0
-        # 奄美地方
-        if sta == "Naze" or sta == "Amami":
-            self.lon_step = 1
-            self.lon_min = 126.0
-            self.lon_max = 133.0
-            self.lat_step = 1
-            self.lat_min = 26.0
-            self.lat_max = 31.0
-        # 沖縄本島地方
-        if sta == "Naha" or sta == "Okinawa":
-            self.lon_step = 1
-            self.lon_min = 124.0
-            self.lon_max = 131.0
-            self.lat_step = 1
-            self.lat_min = 24.0
-            self.lat_max = 29.0
-        #  大東島地方
-        if sta == "Daitojima":
-            self.lon_step = 1
-            self.lon_min = 126.0
-            self.lon_max = 133.0
-            self.lat_step = 1
-            self.lat_min = 24.0
-            self.lat_max = 29.0
-        # 宮古・八重山地方
-        if sta == "Miyakojima":
-            self.lon_step = 1
-            self.lon_min = 121.0
-            self.lon_max = 128.0
-            self.lat_step = 1
-            self.lat_min = 22.0
-            self.lat_max = 27.0
+        name = region_alias.get(sta, sta)
+        if name in region_table:
+            (self.lon_step, self.lon_min, self.lon_max, self.lat_step,
+             self.lat_min, self.lat_max) = region_table[name]
+        self.name = name
+
+    def get_window(self, dset="MSM", lev="surf", margin=1):
+        """作図範囲に対応する格子のインデックス範囲を返す
+
+        Parameters:
+        ----------
+        dset: str
+            GSMかMSMを指定する
+        lev: str
+            <surf/plev>：surfなら表面データ、plevなら気圧面データ
+        margin: int
+            作図範囲の外側に加える格子数
+        ----------
+        Returns:
+        ----------
+        i0, i1, j0, j1: int
+            経度方向i0:i1、緯度方向j0:j1のインデックス範囲
+        ----------
+        """
+        key = (self.name, dset, lev, margin)
+        if key in _window_cache:
+            return _window_cache[key]
+        if (dset, lev) not in grid_table:
+            raise ValueError("invalid dset or lev: " + str(dset) + ", " +
+                             str(lev))
+        if self.lon_min is None:
+            raise ValueError("invalid sta: " + str(self.sta))
+        lon_min, lon_inc, lon_num, lat_min, lat_inc, lat_num = grid_table[(
+            dset, lev)]
+        if self.name in region_full:
+            i0, i1, j0, j1 = 0, lon_num, 0, lat_num
+        else:
+            i0, i1 = _ret_index(lon_min, lon_inc, lon_num, self.lon_min,
+                                self.lon_max, margin)
+            j0, j1 = _ret_index(lat_min, lat_inc, lat_num, self.lat_min,
+                                self.lat_max, margin)
+        _window_cache[key] = (i0, i1, j0, j1)
+        return i0, i1, j0, j1
+
+    def get_slices(self, dset="MSM", lev="surf", margin=1):
+        """作図範囲に対応する配列のスライス（緯度、経度の順）を返す
+
+        d[..., js, is_]のように使うと、作図範囲のデータをコピーせずに取り出せる
+
+        Parameters:
+        ----------
+        dset: str
+            GSMかMSMを指定する
+        lev: str
+            <surf/plev>：surfなら表面データ、plevなら気圧面データ
+        margin: int
+            作図範囲の外側に加える格子数
+        ----------
+        Returns:
+        ----------
+        js, is_: slice
+            緯度方向、経度方向のスライス
+        ----------
+        """
+        i0, i1, j0, j1 = self.get_window(dset, lev, margin)
+        return slice(j0, j1), slice(i0, i1)
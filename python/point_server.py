@@ -0,0 +1,453 @@
+#!/opt/local/bin/python3
+#
+#  地点の予報時系列をJSONで返すHTTPサーバ
+#
+#  例：curl 'http://localhost:8080/point?sta=Tokyo&var=TMP_1D5maboveground'
+#      curl 'http://localhost:8080/point?lat=35.69&lon=139.75&dset=GSM'
+#
+import sys
+import json
+import time
+import argparse
+import threading
+import functools
+import contextlib
+import traceback
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import netCDF4
+import numpy as np
+import readgrib
+from readgrib import ret_latest
+from readgrib import ret_segment_files
+from jmaloc import AmedasStation
+from utils import get_gridlocs
+
+# 変数名を指定しない場合に返す変数（データセット毎）
+var_default = {
+    "MSM": [
+        "PRMSL_meansealevel", "APCP_surface", "TMP_1D5maboveground",
+        "RH_1D5maboveground", "UGRD_10maboveground", "VGRD_10maboveground",
+        "TCDC_surface"
+    ],
+    "GSM": [
+        "PRMSL_meansealevel", "APCP_surface", "TMP_2maboveground",
+        "RH_2maboveground", "UGRD_10maboveground", "VGRD_10maboveground",
+        "TCDC_surface"
+    ],
+}
+
+# 最新の初期時刻を確認する間隔（秒）
+reload_interval = 60
+
+# 問い合わせ結果のキャッシュ数
+query_cache_size = 4096
+
+
+class PointStore():
+    """初期時刻の全予報時間のファイルを開いておき、地点の時系列を取り出す
+
+    FIELDSTORE_GPVが設定されている場合は、変数毎に最初の問い合わせで全レコードを
+    .npyファイルに保存し（readgrib.fstore）、以降はメモリマップから取り出す
+    """
+
+    def __init__(self, tsel, dset, in_dir="retrieve"):
+        """ファイルを開く
+
+        Parameters:
+        ----------
+        tsel: str
+            取得する時刻（形式：20210819120000）
+        dset: str
+            GSMかMSMを指定する
+        in_dir: str
+            入力ディレクトリ、またはretrieve、force_retrieve
+        ----------
+        """
+        self.tsel = tsel
+        self.dset = dset
+        # netCDF4は複数のスレッドから同時に読めないため、読み出しを排他する
+        self.lock = threading.Lock()
+        # 問い合わせ中の数（入れ替え後、問い合わせが無くなってから閉じる）
+        self.ref_lock = threading.Lock()
+        self.users = 0
+        self.retired = False
+        self.ncs = []
+        self.file_dir_names = []
+        times = []
+        for _, _, _, file_dir_name in ret_segment_files(
+                tsel, dset, "surf", in_dir):
+            nc = netCDF4.Dataset(file_dir_name, 'r')
+            self.ncs.append(nc)
+            self.file_dir_names.append(file_dir_name)
+            times.append(nc.variables["time"][:])
+        self.var_names = [
+            v for v in self.ncs[0].variables
+            if self.ncs[0].variables[v].ndim == 3
+        ]
+        # 変数名 -> 全レコードの2次元データ（メモリマップ）のリスト
+        self.fields = dict()
+        self.lons_1d = np.array(self.ncs[0].variables["longitude"][:])
+        self.lats_1d = np.array(self.ncs[0].variables["latitude"][:])
+        times = np.concatenate(times)
+        self.times = [
+            datetime.utcfromtimestamp(float(t)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            for t in times
+        ]
+        # 降水量の積算時間（h）：前のデータの予報時間からの時間、+0hは0
+        hours = np.round((times - times[0]) / 3600.0).astype(int)
+        self.periods = [0] + [int(h) for h in np.diff(hours)]
+        # 初期時刻毎に問い合わせ結果をキャッシュする
+        self.ret_series = functools.lru_cache(
+            maxsize=query_cache_size)(self._ret_series)
+
+    def variables(self):
+        """取り出せる変数名のリストを返す"""
+        return list(self.var_names)
+
+    def locate(self, lons, lats):
+        """経度・緯度のリストから近傍の格子番号を返す
+
+        Parameters:
+        ----------
+        lons: list(float, ...)
+            経度のリスト
+        lats: list(float, ...)
+            緯度のリスト
+        ----------
+        Returns:
+        ----------
+        ilon, ilat: numpy.ndarray
+            経度方向、緯度方向の格子番号
+        ----------
+        """
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        if (lons.min() < self.lons_1d.min() or lons.max() > self.lons_1d.max()
+                or lats.min() < self.lats_1d.min()
+                or lats.max() > self.lats_1d.max()):
+            raise ValueError("point is out of the " + self.dset + " domain")
+        return get_gridlocs(self.lons_1d, lons), get_gridlocs(
+            self.lats_1d, lats)
+
+    def _ret_series(self, var_name, ilat, ilon):
+        """格子点(ilat, ilon)の時系列を返す（欠損値はNone）"""
+        if var_name not in self.var_names:
+            raise KeyError("unknown variable: " + var_name)
+        d = []
+        with self.lock:
+            units = getattr(self.ncs[0].variables[var_name], "units", "")
+            if readgrib.fstore is None:
+                for nc in self.ncs:
+                    d.append(np.ma.masked_invalid(
+                        nc.variables[var_name][:, ilat, ilon]))
+            else:
+                fields = self._ret_fields(var_name)
+        if readgrib.fstore is None:
+            d = np.ma.concatenate(d)
+        else:
+            # メモリマップから格子点の値を取り出す（排他しない）
+            d = np.ma.masked_invalid(
+                np.ma.masked_array(
+                    [np.ma.getdata(f)[ilat, ilon] for f in fields],
+                    mask=[
+                        np.ma.getmask(f) is not np.ma.nomask
+                        and bool(np.ma.getmask(f)[ilat, ilon])
+                        for f in fields
+                    ]))
+        if var_name == "APCP_surface":
+            d = self._ret_rain(d)
+        return units, tuple(None if v is np.ma.masked else float(v)
+                            for v in d)
+
+    def _ret_fields(self, var_name):
+        """変数の全レコードの2次元データ（メモリマップ）のリストを返す
+
+        保存されていないレコードはNetCDFファイルから読み込んで保存する
+        （self.lockを取って呼ぶ）
+        """
+        if var_name not in self.fields:
+            self.fields[var_name] = [
+                readgrib.fstore.ret_rec(nc, file_dir_name, var_name, rec_num)
+                for nc, file_dir_name in zip(self.ncs, self.file_dir_names)
+                for rec_num in range(len(nc.variables["time"]))
+            ]
+        return self.fields[var_name]
+
+    def _ret_rain(self, d):
+        """降水量をReadMSM、ReadGSMのret_varと同じ値にする
+
+        +0hはデータがないため0。GSMのファイルの値は初期時刻からの累積値のため、
+        +2h以降は前のデータ（区分の最初のデータは前の区分の最後のデータ）との
+        差にする（84時間より後は3時間降水量、periodsを参照）
+        """
+        d = d.astype(np.float64)
+        if self.dset == "GSM" and len(d) > 2:
+            d[2:] = d[2:] - d[1:-1]
+        d[0] = 0.0
+        return d
+
+    def query(self, lon, lat, var_names):
+        """地点の時系列を返す
+
+        Parameters:
+        ----------
+        lon: float
+            地点の経度
+        lat: float
+            地点の緯度
+        var_names: list(str, ...)
+            取り出す変数名のリスト
+        ----------
+        Returns:
+        ----------
+        dict
+            初期時刻、格子点の経度・緯度、時刻、変数毎の単位と値、
+            降水量の値毎の積算時間
+        ----------
+        """
+        ilon, ilat = self.locate([lon], [lat])
+        ilon, ilat = int(ilon[0]), int(ilat[0])
+        res = {
+            "dset": self.dset,
+            "tsel": self.tsel,
+            "lon": lon,
+            "lat": lat,
+            "grid_lon": float(self.lons_1d[ilon]),
+            "grid_lat": float(self.lats_1d[ilat]),
+            "time": self.times,
+            "units": {},
+            "values": {},
+            "periods": {},
+        }
+        for var_name in var_names:
+            units, d = self.ret_series(var_name, ilat, ilon)
+            res["units"][var_name] = units
+            res["values"][var_name] = list(d)
+            if var_name == "APCP_surface":
+                # 値毎の積算時間（h）
+                res["periods"][var_name] = self.periods
+        return res
+
+    def acquire(self):
+        """問い合わせを始める（入れ替え済みで使えない場合はFalse）"""
+        with self.ref_lock:
+            if self.retired:
+                return False
+            self.users += 1
+            return True
+
+    def release(self):
+        """問い合わせを終える（入れ替え済みで最後の問い合わせなら閉じる）"""
+        with self.ref_lock:
+            self.users -= 1
+            opt_close = self.retired and self.users == 0
+        if opt_close:
+            self.close()
+
+    def retire(self):
+        """新しい初期時刻と入れ替える（問い合わせが無くなったら閉じる）"""
+        with self.ref_lock:
+            self.retired = True
+            opt_close = self.users == 0
+        if opt_close:
+            self.close()
+
+    def close(self):
+        """ファイルを閉じる"""
+        with self.lock:
+            self.fields.clear()
+            for nc in self.ncs:
+                nc.close()
+            self.ncs = []
+
+
+class PointService():
+    """データセット毎に最新の初期時刻のPointStoreを保持する"""
+
+    def __init__(self, in_dir="retrieve", tsel=None):
+        """設定
+
+        Parameters:
+        ----------
+        in_dir: str
+            入力ディレクトリ、またはretrieve、force_retrieve
+        tsel: str
+            初期時刻（Noneの場合はキャッシュディレクトリにある最新の初期時刻）
+        ----------
+        """
+        self.in_dir = in_dir
+        self.tsel = tsel
+        self.stores = dict()
+        self.checked = dict()
+        self.lock = threading.Lock()
+        # データセット毎に、PointStoreを開くスレッドを1つにする
+        self.open_locks = dict()
+        # アメダス地点表の読み込み（ダウンロード）の排他
+        self.amedas_lock = threading.Lock()
+        self._amedas = None
+
+    def get_store(self, dset):
+        """データセットのPointStoreを返す（新しい初期時刻があれば開き直す）
+
+        ファイルの確認・取得・オープンは時間がかかるため、全体の排他の外で
+        データセット毎に1つのスレッドだけが行う。開き直している間、
+        他のスレッドは前のPointStoreを使う
+        """
+        with self.lock:
+            now = time.time()
+            store = self.stores.get(dset)
+            if store is not None and (self.tsel is not None or
+                                      now - self.checked[dset] <
+                                      reload_interval):
+                return store
+            self.checked[dset] = now
+            open_lock = self.open_locks.setdefault(dset, threading.Lock())
+        if not open_lock.acquire(blocking=store is None):
+            # 他のスレッドが開き直している
+            return store
+        try:
+            with self.lock:
+                if self.stores.get(dset) is not store:
+                    # 待っている間に他のスレッドが開いた
+                    return self.stores[dset]
+            tsel = self.tsel if self.tsel is not None else ret_latest(
+                dset, in_dir=self.in_dir)
+            if tsel is None:
+                raise FileNotFoundError("no " + dset + " data found")
+            if store is None or store.tsel != tsel:
+                print("open:", dset, tsel)
+                old_store = store
+                store = PointStore(tsel, dset, self.in_dir)
+                with self.lock:
+                    self.stores[dset] = store
+                # 古いファイルは問い合わせが終わってから閉じる
+                if old_store is not None:
+                    old_store.retire()
+            return store
+        finally:
+            open_lock.release()
+
+    @contextlib.contextmanager
+    def use_store(self, dset):
+        """問い合わせの間、入れ替えで閉じられないPointStoreを返す"""
+        store = self.get_store(dset)
+        # 取得した直後に入れ替えられた場合は、新しいPointStoreを使う
+        while not store.acquire():
+            store = self.get_store(dset)
+        try:
+            yield store
+        finally:
+            store.release()
+
+    def staloc(self, sta):
+        """アメダス地点名（英語）から経度・緯度を返す"""
+        with self.amedas_lock:
+            if self._amedas is None:
+                self._amedas = AmedasStation()
+            try:
+                return self._amedas.get_staloc(en_name=sta)
+            except IndexError:
+                raise KeyError("unknown station: " + sta)
+
+
+class PointHandler(BaseHTTPRequestHandler):
+    """/point、/varsへのGETリクエストを処理する"""
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == "/point":
+                res = self._point(query)
+            elif url.path == "/vars":
+                dset = query.get("dset", "MSM").upper()
+                with self.service.use_store(dset) as store:
+                    res = {"variables": store.variables()}
+            else:
+                self._send(404, {"error": "not found: " + url.path})
+                return
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": str(e).strip("'")})
+            return
+        except OSError as e:
+            self._send(503, {"error": str(e)})
+            return
+        except Exception:
+            # 想定外のエラーは記録し、接続を切らずに500を返す
+            self.log_error("%s", traceback.format_exc())
+            self._send(500, {"error": "internal server error"})
+            return
+        self._send(200, res)
+
+    def _point(self, query):
+        """地点の時系列を返す"""
+        dset = query.get("dset", "MSM").upper()
+        if dset not in ("MSM", "GSM"):
+            raise ValueError("dset must be MSM or GSM")
+        if "sta" in query:
+            lon, lat = self.service.staloc(query["sta"])
+        elif "lat" in query and "lon" in query:
+            lon, lat = float(query["lon"]), float(query["lat"])
+        else:
+            raise ValueError("either sta or lat and lon is needed")
+        var_names = query.get("var")
+        if var_names is None:
+            var_names = var_default[dset]
+        else:
+            var_names = var_names.split(",")
+        with self.service.use_store(dset) as store:
+            return store.query(lon, lat, var_names)
+
+    def _send(self, code, res):
+        """JSONを返す"""
+        body = json.dumps(res).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _construct_parser():
+    """オプションの読み込み"""
+    parser = argparse.ArgumentParser(
+        description='Point forecast server for MSM/GSM data')
+    parser.add_argument('--fcst_date',
+                        type=str,
+                        help=('forecast date; yyyymmddhhMMss; if not given, '
+                              'the latest cycle in the cache is used'),
+                        metavar='<fcstdate>')
+    parser.add_argument('--input_dir',
+                        type=str,
+                        default="retrieve",
+                        help=('input directory, retrieve (default) or '
+                              'force_retrieve'),
+                        metavar='<input_dir>')
+    parser.add_argument('--host',
+                        type=str,
+                        default="127.0.0.1",
+                        help=('host name (default: 127.0.0.1)'),
+                        metavar='<host>')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8080,
+                        help=('port number (default: 8080)'),
+                        metavar='<port>')
+    return parser
+
+
+if __name__ == '__main__':
+    # オプションの読み込み
+    args = _construct_parser().parse_args(sys.argv[1:])
+    PointHandler.service = PointService(args.input_dir, args.fcst_date)
+    server = ThreadingHTTPServer((args.host, args.port), PointHandler)
+    print("serving on", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,138 @@
+#!/opt/local/bin/python3
+#
+#  公開されたGPVデータを先に取得し、NetCDFファイルに変換しておく
+#
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+import readgrib
+from readgrib import check_available
+from readgrib import fetch_segment
+from readgrib import ret_file_names
+from readgrib import segment_table
+from products.catalog import cycle_step
+
+
+def ret_cycles(dset, now, lookback):
+    """now以前lookback時間以内の初期時刻を新しい順に返す"""
+    step = cycle_step[dset]
+    tsels = []
+    for h in range(0, lookback + 1):
+        t = now - timedelta(hours=h)
+        if t.hour % step == 0:
+            tsels.append(t.strftime("%Y%m%d%H") + "0000")
+    return tsels
+
+
+def prefetch(tsel, dsets, levs, out_dir):
+    """初期時刻tselのデータのうち、公開済みで未取得のものを取得する
+
+    Parameters:
+    ----------
+    tsel: str
+        取得する時刻（形式：20210819120000）
+    dsets: list(str, ...)
+        取得するデータセット（GSM、MSM）
+    levs: list(str, ...)
+        取得する面（surf、plev）
+    out_dir: str
+        取得したファイルを置くディレクトリ
+    ----------
+    Returns
+    ----------
+    bool
+        全てのファイルが揃っている場合はTrue
+    ----------
+    """
+    complete = True
+    for dset in dsets:
+        if int(tsel[8:10]) % cycle_step[dset] != 0:
+            continue
+        for lev in levs:
+            for fcst_flag, _, _ in segment_table[(dset, lev)]:
+                file_name_g2, file_name_nc = ret_file_names(
+                    tsel, dset, lev, fcst_flag)
+                if os.path.isfile(os.path.join(out_dir, file_name_nc)):
+                    continue
+                if not check_available(tsel, file_name_g2):
+                    complete = False
+                    continue
+                print("prefetch:", file_name_g2)
+                try:
+                    fetch_segment(tsel, dset, lev, fcst_flag, out_dir=out_dir)
+                except OSError as e:
+                    print("prefetch failed:", file_name_g2, e)
+                    complete = False
+    return complete
+
+
+def _construct_parser():
+    """オプションの読み込み"""
+    parser = argparse.ArgumentParser(
+        description='Prefetch GPV data from RISH server')
+    parser.add_argument('--fcst_date',
+                        type=str,
+                        help=('forecast date; yyyymmddhhMMss; '
+                              'if not given, recent cycles are checked'),
+                        metavar='<fcstdate>')
+    parser.add_argument('--dset',
+                        type=str,
+                        default="MSM,GSM",
+                        help=('dataset name(s): MSM,GSM (default)'),
+                        metavar='<dset>')
+    parser.add_argument('--lev',
+                        type=str,
+                        default="surf,plev",
+                        help=('level type(s): surf,plev (default)'),
+                        metavar='<lev>')
+    parser.add_argument('--output_dir',
+                        type=str,
+                        default=readgrib.cache_dir,
+                        help=('output directory (default: CACHEDIR_GPV)'),
+                        metavar='<output_dir>')
+    parser.add_argument('--lookback',
+                        type=int,
+                        default=6,
+                        help=('hours to look back for recent cycles'),
+                        metavar='<lookback>')
+    parser.add_argument('--daemon',
+                        action='store_true',
+                        help=('keep polling the server'))
+    parser.add_argument('--interval',
+                        type=int,
+                        default=300,
+                        help=('polling interval in seconds (default: 300)'),
+                        metavar='<interval>')
+    parser.add_argument('--timeout',
+                        type=int,
+                        default=0,
+                        help=('with --fcst_date, keep polling until all files '
+                              'are fetched or timeout (seconds) expires'),
+                        metavar='<timeout>')
+    return parser
+
+
+if __name__ == '__main__':
+    # オプションの読み込み
+    args = _construct_parser().parse_args(sys.argv[1:])
+    dsets = args.dset.split(",")
+    levs = args.lev.split(",")
+    out_dir = args.output_dir
+    time_end = time.time() + args.timeout
+    while True:
+        if args.fcst_date is not None:
+            # 指定した初期時刻のみ
+            complete = prefetch(args.fcst_date, dsets, levs, out_dir)
+            if complete or time.time() >= time_end:
+                break
+        else:
+            # 最近の初期時刻（新しい順）
+            now = datetime.utcnow()
+            for dset in dsets:
+                for tsel in ret_cycles(dset, now, args.lookback):
+                    prefetch(tsel, [dset], levs, out_dir)
+            if not args.daemon:
+                break
+        time.sleep(args.interval)
@@ -0,0 +1,16 @@
+#
+#  作図プロダクトの一覧と、取得・変換・作図の実行
+#
+
+from .catalog import product_table
+from .catalog import select_products
+from .catalog import ret_command
+from .scheduler import Scheduler
+from .scheduler import add_products
+from .scheduler import run_command
+from .scheduler import run_shared
+
+__all__ = [
+    "product_table", "select_products", "ret_command", "Scheduler",
+    "add_products", "run_command", "run_shared"
+]
@@ -0,0 +1,229 @@
+#
+#  作図プロダクトの一覧
+#
+#  プロダクト毎に作図プログラムと、必要な入力（データセット、面、変数、
+#  予報時間、地域）を記述する
+#
+
+# 水平分布を作図する地域
+stations = ["Japan", "Tokyo"]
+
+# 時系列図を作図する地点（アメダス地点名）
+stations_tvar = ["Tokyo"]
+
+# 初期時刻の間隔（時間）
+cycle_step = {"MSM": 3, "GSM": 6}
+
+# プロダクトのテーブル
+#   prog: 作図プログラム
+#   dset: データセット（MSM、GSM）
+#   lev: 面（surf、plev）
+#   vars: 読み込む変数（NetCDFファイルの変数名、気圧面の変数は気圧面付き）
+#   level: 作図する気圧面（hPa、--levelで作図プログラムに渡す）
+#   fcst_time: 作図する最後の予報時間
+#   fcst_step: 作図する予報時間の間隔
+#   stations: 作図する地域・地点
+#   partial: 予報時間の区分が揃う毎に、途中まで作図するかどうか
+#            （積算降水量、時系列図は最後の予報時間まで揃ってから作図する）
+#   render: 陰影の描き方（contour：contourf、raster：imshowで速い）
+#           （陰影の無い時系列図には指定しない）
+product_table = {
+    # MSM
+    "msm_surf": {
+        # 海面気圧（mslp）、地上気温（stemp）、雲量（ccover）をまとめて作図
+        "prog": "python/readgrib_msm_surf_reg.py",
+        "dset": "MSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "APCP_surface", "TMP_1D5maboveground",
+                 "UGRD_10maboveground", "VGRD_10maboveground",
+                 "LCDC_surface", "MCDC_surface", "HCDC_surface"],
+        "fcst_time": 36,
+        "fcst_step": 1,
+        "stations": stations,
+        "render": "contour",
+        "partial": True,
+    },
+    "msm_rain_sum": {
+        "prog": "python/readgrib_msm_rain_sum_reg.py",
+        "dset": "MSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "APCP_surface"],
+        "fcst_time": 36,
+        "fcst_step": 1,
+        "stations": stations,
+        "render": "contour",
+        "partial": False,
+    },
+    "msm_temp": {
+        "prog": "python/readgrib_msm_temp_reg.py",
+        "dset": "MSM",
+        "lev": "plev",
+        "vars": ["TMP_850mb", "RH_850mb", "UGRD_850mb", "VGRD_850mb"],
+        "level": 850,
+        "fcst_time": 36,
+        "fcst_step": 3,
+        "stations": stations,
+        "render": "contour",
+        "partial": True,
+    },
+    "msm_ept": {
+        "prog": "python/readgrib_msm_ept_reg.py",
+        "dset": "MSM",
+        "lev": "plev",
+        "vars": ["HGT_500mb", "TMP_500mb", "RH_500mb", "TMP_850mb",
+                 "RH_850mb"],
+        "fcst_time": 36,
+        "fcst_step": 3,
+        "stations": stations,
+        "render": "contour",
+        "partial": True,
+    },
+    "msm_tvar": {
+        "prog": "python/readgrib_msm_tvar_reg.py",
+        "dset": "MSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "APCP_surface", "TMP_1D5maboveground",
+                 "UGRD_10maboveground", "VGRD_10maboveground",
+                 "RH_1D5maboveground", "LCDC_surface", "MCDC_surface",
+                 "HCDC_surface", "TCDC_surface"],
+        "fcst_time": 36,
+        "fcst_step": 1,
+        "stations": stations_tvar,
+        "partial": False,
+    },
+    # GSM
+    "gsm_mslp": {
+        "prog": "python/readgrib_gsm_mslp_reg.py",
+        "dset": "GSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "APCP_surface", "TMP_2maboveground",
+                 "UGRD_10maboveground", "VGRD_10maboveground"],
+        "fcst_time": 36,
+        "fcst_step": 1,
+        "stations": stations,
+        "render": "contour",
+        "partial": True,
+    },
+    "gsm_rain_sum": {
+        "prog": "python/readgrib_gsm_rain_sum_reg.py",
+        "dset": "GSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "APCP_surface"],
+        "fcst_time": 36,
+        "fcst_step": 1,
+        "stations": stations,
+        "render": "contour",
+        "partial": False,
+    },
+    "gsm_temp": {
+        "prog": "python/readgrib_gsm_temp_reg.py",
+        "dset": "GSM",
+        "lev": "plev",
+        "vars": ["TMP_850mb", "RH_850mb", "UGRD_850mb", "VGRD_850mb"],
+        "level": 850,
+        "fcst_time": 36,
+        "fcst_step": 3,
+        "stations": stations,
+        "render": "contour",
+        "partial": True,
+    },
+    "gsm_ccover": {
+        "prog": "python/readgrib_gsm_ccover_reg.py",
+        "dset": "GSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "LCDC_surface", "MCDC_surface",
+                 "HCDC_surface"],
+        "fcst_time": 36,
+        "fcst_step": 1,
+        "stations": stations,
+        "render": "contour",
+        "partial": True,
+    },
+    "gsm_tvar": {
+        "prog": "python/readgrib_gsm_tvar_reg.py",
+        "dset": "GSM",
+        "lev": "surf",
+        "vars": ["PRMSL_meansealevel", "APCP_surface", "TMP_2maboveground",
+                 "UGRD_10maboveground", "VGRD_10maboveground",
+                 "RH_2maboveground", "LCDC_surface", "MCDC_surface",
+                 "HCDC_surface", "TCDC_surface"],
+        "fcst_time": 72,
+        "fcst_step": 1,
+        "stations": stations_tvar,
+        "partial": False,
+    },
+}
+
+
+def select_products(tsel, dsets=("MSM", "GSM")):
+    """初期時刻tselに作図するプロダクト名のリストを返す
+
+    Parameters:
+    ----------
+    tsel: str
+        初期時刻（形式：20210819120000）
+    dsets: list(str, ...)
+        作図するデータセット（GSMは00、06、12、18UTCのみ）
+    ----------
+    Returns:
+    ----------
+    list(str, ...)
+        プロダクト名のリスト（product_tableの順）
+    ----------
+    """
+    hh = int(tsel[8:10])
+    return [
+        name for name, p in product_table.items()
+        if p["dset"] in dsets and hh % cycle_step[p["dset"]] == 0
+    ]
+
+
+def ret_command(name,
+                tsel,
+                fcst_time=None,
+                in_dir=None,
+                fcst_start=None,
+                frames_only=False):
+    """作図プログラムを実行するコマンドを返す
+
+    Parameters:
+    ----------
+    name: str
+        プロダクト名
+    tsel: str
+        初期時刻（形式：20210819120000）
+    fcst_time: int
+        作図する最後の予報時間（Noneの場合はproduct_tableの値）
+    in_dir: str
+        入力ディレクトリ（Noneの場合は作図プログラムのデフォルト）
+    fcst_start: int
+        作図する最初の予報時間（それより前の図はキャッシュから復元するだけ、
+        Noneの場合は先頭から作図する）
+    frames_only: bool
+        作図結果のキャッシュに図を置くだけで、アニメーションを作らないかどうか
+    ----------
+    Returns:
+    ----------
+    list(str, ...)
+        コマンドと引数のリスト
+    ----------
+    """
+    p = product_table[name]
+    if fcst_time is None:
+        fcst_time = p["fcst_time"]
+    args = [
+        p["prog"], "--fcst_date", tsel, "--sta", ",".join(p["stations"]),
+        "--fcst_time",
+        str(fcst_time)
+    ]
+    if in_dir is not None:
+        args.extend(["--input_dir", in_dir])
+    if fcst_start is not None:
+        args.extend(["--fcst_start", str(fcst_start)])
+    if frames_only:
+        args.append("--frames_only")
+    if "level" in p:
+        args.extend(["--level", str(p["level"])])
+    if "render" in p:
+        args.extend(["--render", p["render"]])
+    return args
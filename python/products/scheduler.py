@@ -0,0 +1,278 @@
+#
+#  依存関係のある処理を並列に実行する
+#
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from readgrib import fetch_segment
+from readgrib import segment_table
+from .catalog import product_table
+from .catalog import ret_command
+
+
+class Scheduler():
+    """処理の依存関係グラフを作り、依存する処理が終わったものから並列に実行する
+
+    同じキーの処理は1回だけ登録され、複数の処理から共有される
+    """
+
+    def __init__(self, jobs=4):
+        """設定
+
+        Parameters:
+        ----------
+        jobs: int
+            同時に実行する処理の数
+        ----------
+        """
+        self.jobs = jobs
+        self.nodes = dict()
+
+    def add(self, key, func, args=(), deps=()):
+        """処理を登録する（同じキーの処理が登録済みの場合は何もしない）
+
+        Parameters:
+        ----------
+        key: tuple or str
+            処理のキー
+        func: function
+            実行する関数
+        args: tuple
+            関数の引数
+        deps: list(key, ...)
+            先に終わっている必要のある処理のキー
+        ----------
+        Returns:
+        ----------
+        key: tuple or str
+            処理のキー
+        ----------
+        """
+        if key not in self.nodes:
+            self.nodes[key] = (func, tuple(args), tuple(deps))
+        return key
+
+    def run(self):
+        """登録した処理を実行する
+
+        失敗した処理に依存する処理は実行しない
+
+        Returns:
+        ----------
+        dict
+            処理のキー毎の結果（失敗した場合は例外、実行しなかった場合はNone）
+        ----------
+        """
+        for key, (_, _, deps) in self.nodes.items():
+            for dep in deps:
+                if dep not in self.nodes:
+                    raise ValueError("unknown dependency: " + str(dep))
+        results = dict()
+        failed = set()
+        waiting = dict(self.nodes)
+        running = dict()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while waiting or running:
+                # 依存する処理が失敗したものは実行しない（その処理に依存するものも）
+                skipped = True
+                while skipped:
+                    skipped = False
+                    for key, (_, _, deps) in list(waiting.items()):
+                        if any(dep in failed for dep in deps):
+                            print("skip:", key)
+                            results[key] = None
+                            failed.add(key)
+                            del waiting[key]
+                            skipped = True
+                # 依存する処理が全て終わったものを実行する
+                for key, (func, args, deps) in list(waiting.items()):
+                    if all(dep in results for dep in deps):
+                        running[executor.submit(func, *args)] = key
+                        del waiting[key]
+                if not running:
+                    # 循環した依存関係
+                    for key in waiting:
+                        print("skip:", key)
+                        results[key] = None
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        results[key] = future.result()
+                    except Exception as e:
+                        print("failed:", key, e)
+                        results[key] = e
+                        failed.add(key)
+        return results
+
+
+def run_command(args):
+    """コマンドを実行し、失敗した場合は例外を発生させる"""
+    res = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    print(res.stdout.decode("utf-8"))
+    print(res.stderr.decode("utf-8"))
+    if res.returncode != 0:
+        raise RuntimeError(" ".join(args) + " returned " +
+                           str(res.returncode))
+    return res.returncode
+
+
+def run_shared(broker, segs, args):
+    """共有メモリの参照数を増やしてコマンドを実行し、終わったら減らす
+
+    Parameters:
+    ----------
+    broker: readgrib.FieldBroker
+        共有メモリを管理するFieldBroker
+    segs: list((str, str, str, str), ...)
+        初期時刻、データセット、面、区分名のリスト
+    args: list(str, ...)
+        コマンドと引数のリスト
+    ----------
+    """
+    descs = []
+    for seg in segs:
+        descs.extend(broker.segment_descs(*seg))
+    broker.acquire(descs)
+    try:
+        return run_command(args)
+    finally:
+        broker.release(descs)
+
+
+def _ret_func(broker, segs, args):
+    """作図プログラムを実行する関数と引数を返す"""
+    if broker is not None:
+        return run_shared, (broker, segs, args)
+    return run_command, (args, )
+
+
+def add_products(sched,
+                 tsel,
+                 names,
+                 in_dir="retrieve",
+                 fcst_times=None,
+                 broker=None):
+    """プロダクトの取得・変換と作図の処理を登録する
+
+    取得・変換（予報時間の区分毎）は、複数のプロダクトで共有する
+    brokerを指定した場合は、区分毎に読み込む変数を共有メモリに置き
+    （変数はそのデータセット・面のプロダクトの変数を合わせたもの）、
+    作図プログラムは共有メモリから読み込む
+    作図結果のキャッシュ（RENDER_CACHE_DIR）を使う場合は、アニメーションの
+    プロダクトを区分毎の作図（--frames_only）とアニメーションの作成に分け、
+    図はキャッシュを通して受け渡す。区分毎の作図は、その区分（と内挿に使う
+    前後の区分）の読み込みが終われば始める
+
+    Parameters:
+    ----------
+    sched: Scheduler
+        処理を登録するScheduler
+    tsel: str
+        初期時刻（形式：20210819120000）
+    names: list(str, ...)
+        プロダクト名のリスト
+    in_dir: str
+        入力ディレクトリ、またはretrieve、force_retrieve
+    fcst_times: dict
+        プロダクト毎の作図する最後の予報時間（Noneの場合はproduct_tableの値）
+    broker: readgrib.FieldBroker
+        2次元データを共有メモリに置くFieldBroker（Noneの場合は使わない）
+    ----------
+    Returns:
+    ----------
+    list(key, ...)
+        プロダクト毎の最後の処理（作図、またはアニメーションの作成）のキー
+    ----------
+    """
+    opt_retrieve = in_dir in ("retrieve", "force_retrieve")
+    # 取得済みのファイルを使うため、作図プログラムにはretrieve（デフォルト）を渡す
+    prog_in_dir = None if opt_retrieve else in_dir
+    opt_frames = os.environ.get('RENDER_CACHE_DIR') is not None
+    # データセット・面毎に、共有メモリに置く変数
+    share_vars = dict()
+    for name in names:
+        p = product_table[name]
+        v = share_vars.setdefault((p["dset"], p["lev"]), [])
+        v.extend(var for var in p["vars"] if var not in v)
+    keys = []
+    for name in names:
+        p = product_table[name]
+        fcst_time = p["fcst_time"]
+        if fcst_times is not None:
+            fcst_time = fcst_times.get(name, fcst_time)
+        # 区分毎の開始・終了時間、読み込み（取得・変換、共有メモリ）のキー、
+        # 共有メモリの区分
+        seg_nodes = []
+        for fcst_flag, fcst_str, fcst_end in segment_table[(p["dset"],
+                                                            p["lev"])]:
+            if fcst_str > fcst_time:
+                break
+            deps = []
+            if opt_retrieve:
+                deps.append(
+                    sched.add(("fetch", tsel, p["dset"], p["lev"], fcst_flag),
+                              fetch_segment,
+                              (tsel, p["dset"], p["lev"], fcst_flag,
+                               in_dir == "force_retrieve")))
+            segs = []
+            if broker is not None:
+                seg = (tsel, p["dset"], p["lev"], fcst_flag)
+                segs.append(seg)
+                deps = [
+                    sched.add(("share", ) + seg,
+                              broker.share_segment,
+                              seg + (share_vars[(p["dset"], p["lev"])],
+                                     in_dir),
+                              deps=deps)
+                ]
+            seg_nodes.append((fcst_str, fcst_end, deps, segs))
+        if not opt_frames or not p["partial"]:
+            # 1つの作図プログラムで全ての予報時間を作図する
+            args = ret_command(name,
+                               tsel,
+                               fcst_time=fcst_time,
+                               in_dir=prog_in_dir)
+            func, func_args = _ret_func(
+                broker, [seg for _, _, _, s in seg_nodes for seg in s], args)
+            keys.append(
+                sched.add(("render", tsel, name, fcst_time),
+                          func,
+                          func_args,
+                          deps=[d for _, _, ds, _ in seg_nodes for d in ds]))
+            continue
+        # 区分毎に作図する（次の区分の開始時間の前まで）
+        render_keys = []
+        for k, (fcst_str, fcst_end, _, _) in enumerate(seg_nodes):
+            last = fcst_time
+            if k + 1 < len(seg_nodes):
+                last = min(seg_nodes[k + 1][0] - 1, fcst_time)
+            # 前の区分（GSMの降水量の差）と、区分の後のデータの無い予報時間の
+            # 内挿に使う次の区分も読み込む
+            n = k + 2 if last > fcst_end else k + 1
+            nodes = seg_nodes[max(k - 1, 0):n]
+            args = ret_command(name,
+                               tsel,
+                               fcst_time=last,
+                               in_dir=prog_in_dir,
+                               fcst_start=fcst_str,
+                               frames_only=True)
+            func, func_args = _ret_func(
+                broker, [seg for _, _, _, s in nodes for seg in s], args)
+            render_keys.append(
+                sched.add(("render", tsel, name, fcst_str, last),
+                          func,
+                          func_args,
+                          deps=[d for _, _, ds, _ in nodes for d in ds]))
+        # 全ての図をキャッシュから復元して、アニメーションを作る
+        args = ret_command(name,
+                           tsel,
+                           fcst_time=fcst_time,
+                           in_dir=prog_in_dir,
+                           fcst_start=fcst_time + 1)
+        keys.append(
+            sched.add(("animate", tsel, name, fcst_time),
+                      run_command, (args, ),
+                      deps=render_keys))
+    return keys
@@ -3,11 +3,19 @@
 #
 import sys
 import os
+import re
+import time
 import subprocess
 import urllib.request
+import urllib.error
 import netCDF4
 import numpy as np
 import ssl
+from .gcache import GribCache
+from .fstore import FieldStore
+from .ltindex import LeadTimeIndex
+from .shmbroker import FieldBroker
+from . import shmbroker
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
@@ -18,14 +26,155 @@ verbose = False
 # 入力する気象庁GPVデータのファイルを置いたディレクトリ
 sys_file_dir = os.environ.get('DATADIR_GPV', '/data')
 
-# URL
-url = "https://database3.rish.kyoto-u.ac.jp/arch/jmadata/data/gpv/original"
+# ダウンロード・変換したファイルを置くキャッシュディレクトリ
+#   環境変数CACHEDIR_GPV、未設定ならgpv_cache
+#   （DATADIR_GPVのファイルは利用者のデータのため、キャッシュとして管理しない）
+cache_dir = os.environ.get('CACHEDIR_GPV', 'gpv_cache')
+
+# キャッシュの上限サイズ（環境変数CACHESIZE_GPV、例：20G）
+gcache = GribCache(cache_dir, os.environ.get('CACHESIZE_GPV'))
+
+# 取り出した2次元データを.npyファイルで保存するディレクトリ
+#   環境変数FIELDSTORE_GPV（未設定の場合は保存せず、毎回NetCDFファイルから読み込む）
+fstore_dir = os.environ.get('FIELDSTORE_GPV')
+fstore = FieldStore(fstore_dir) if fstore_dir is not None else None
+
+# URL（環境変数URL_GPVでローカルのミラー等に変更可能）
+url = os.environ.get(
+    'URL_GPV',
+    "https://database3.rish.kyoto-u.ac.jp/arch/jmadata/data/gpv/original")
 #url = "http://database.rish.kyoto-u.ac.jp/arch/jmadata/data/gpv/original"
 
+# ファイルの分割（予報時間の区分）
+#   (データセット, 面): [(区分名, 開始時間, 終了時間), ...]
+segment_table = {
+    ("MSM", "surf"): [("00-15", 0, 15), ("16-33", 16, 33), ("34-39", 34, 39)],
+    ("MSM", "plev"): [("00-15", 0, 15), ("18-33", 18, 33), ("36-39", 36, 39)],
+    ("GSM", "surf"): [("0000-0312", 0, 84), ("0315-0512", 87, 132),
+                      ("0515-1100", 135, 264)],
+    ("GSM", "plev"): [("0000-0312", 0, 84), ("0318-0512", 90, 132),
+                      ("0518-1100", 138, 264)],
+}
+
+# 予報時間の区分毎のデータの時間間隔（時間）
+#   (データセット, 面): [区分毎の時間間隔, ...]（segment_tableの区分の順）
+record_step_table = {
+    ("MSM", "surf"): [1, 1, 1],
+    ("MSM", "plev"): [3, 3, 3],
+    ("GSM", "surf"): [1, 3, 3],
+    ("GSM", "plev"): [3, 6, 6],
+}
+
+# ファイル名の区分名より前の部分
+file_prefix_table = {
+    ("MSM", "surf"): "_MSM_GPV_Rjp_Lsurf_FH",
+    ("MSM", "plev"): "_MSM_GPV_Rjp_L-pall_FH",
+    ("GSM", "surf"): "_GSM_GPV_Rjp_Lsurf_FD",
+    ("GSM", "plev"): "_GSM_GPV_Rjp_L-pall_FD",
+}
+
+# force_retrieveで再取得したファイル
+#   (初期時刻, データセット, 面, 区分名)の集合
+_forced = set()
+
+# 予報時間 -> (区分名, データ番号)の索引
+#   (データセット, 面): LeadTimeIndex
+lead_time_index = {
+    key: LeadTimeIndex(segment_table[key], record_step_table[key])
+    for key in segment_table
+}
+
 ### utils ###
 
 
-def _ret_grib(tsel, file_name_g2, file_name_nc, force=False):
+def ret_file_names(tsel, dset, lev, fcst_flag):
+    """grib2ファイル名とNetCDFファイル名を返す
+
+    Parameters:
+    ----------
+    tsel: str
+        取得する時刻（形式：20210819120000）
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    fcst_flag: str
+        予報時間の区分名（例：00-15）
+    ----------
+    Returns
+    ----------
+    file_name_g2, file_name_nc: str
+        grib2ファイル名、NetCDFファイル名
+    ----------
+    """
+    file_name = "Z__C_RJTD_" + str(tsel) + file_prefix_table[(
+        dset, lev)] + str(fcst_flag) + "_grib2"
+    return file_name + ".bin", file_name + ".nc"
+
+
+def _ret_url(tsel, file_name_g2):
+    """grib2ファイルのURLを返す"""
+    return url + "/" + tsel[0:4] + "/" + tsel[4:6] + "/" + tsel[
+        6:8] + "/" + file_name_g2
+
+
+def check_available(tsel, file_name_g2):
+    """grib2ファイルがサーバで公開されているかどうかを返す
+
+    Parameters:
+    ----------
+    tsel: str
+        取得する時刻（形式：20210819120000）
+    file_name_g2: str
+        grib2ファイル名
+    ----------
+    Returns
+    ----------
+    bool
+        公開されている場合はTrue
+    ----------
+    """
+    req = urllib.request.Request(_ret_url(tsel, file_name_g2), method="HEAD")
+    try:
+        with urllib.request.urlopen(req, timeout=60):
+            return True
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def _tmp_name(file_name):
+    """書き込み途中のファイル名を返す（他のプロセスから見えないようにする）"""
+    head, tail = os.path.split(file_name)
+    return os.path.join(head, "." + tail + "." + str(os.getpid()) + ".tmp")
+
+
+def _search_grib(file_dir_names, file_dir_convs):
+    """既存のファイルを探し、取得・変換が必要かどうかを返す
+
+    Parameters:
+    ----------
+    file_dir_names: list(str, ...)
+        探すファイル名（優先順）
+    file_dir_convs: list(bool, ...)
+        見つかった場合に変換が必要かどうか
+    ----------
+    Returns
+    ----------
+    file_dir_name: str
+        見つかったファイル名（見つからない場合はNone）
+    opt_retrieve: bool
+        取得が必要かどうか
+    opt_convert: bool
+        変換が必要かどうか
+    ----------
+    """
+    for file_dir_name, file_dir_conv in zip(file_dir_names, file_dir_convs):
+        if os.path.isfile(file_dir_name):
+            return file_dir_name, False, file_dir_conv
+    return None, True, True
+
+
+def _ret_grib(tsel, file_name_g2, file_name_nc, force=False, out_dir=None):
     """ grib2ファイルをダウンロードし、NetCDFファイルに変換する
 
     Parameters:
@@ -38,6 +187,9 @@ def _ret_grib(tsel, file_name_g2, file_name_nc, force=False):
         NetCDFファイル名
     force: bool
        ファイルが存在しても再取得するかどうか
+    out_dir: str
+       ダウンロード・変換したファイルを置くディレクトリ
+       （Noneの場合はキャッシュディレクトリ）
     ----------
     Returns 
     ----------    
@@ -45,220 +197,214 @@ def _ret_grib(tsel, file_name_g2, file_name_nc, force=False):
         変換したNetCDFファイル名
     ----------
     """
+    if out_dir is None:
+        out_dir = cache_dir
+    # キャッシュディレクトリに置いたファイルは索引に登録する
+    opt_cache = os.path.abspath(out_dir) == os.path.abspath(cache_dir)
+    file_name_g2 = os.path.join(out_dir, os.path.basename(file_name_g2))
+    file_name_nc = os.path.join(out_dir, os.path.basename(file_name_nc))
     # files for search
-    file_dir_names = [
-        file_name_nc, file_name_g2,
-        os.path.join(sys_file_dir, file_name_nc),
-        os.path.join(sys_file_dir, file_name_g2)
-    ]
-    file_dir_convs = [False, True, False, True]
-    opt_retrieve = True
-    opt_convert = True
+    file_dir_names = [file_name_nc, file_name_g2]
+    file_dir_convs = [False, True]
+    if os.path.abspath(sys_file_dir) != os.path.abspath(out_dir):
+        file_dir_names += [
+            os.path.join(sys_file_dir, os.path.basename(file_name_nc)),
+            os.path.join(sys_file_dir, os.path.basename(file_name_g2))
+        ]
+        file_dir_convs += [False, True]
+    # 変換済みのファイルがあればロックせずに使う（ファイルの置き換えは不可分）
     if not force:
-        for file_dir_name, file_dir_conv in zip(file_dir_names,
-                                                file_dir_convs):
-            if os.path.isfile(file_dir_name):
-                opt_retrieve = False
-                opt_convert = file_dir_conv
-                break
-    # retrieve
-    if opt_retrieve:
-        url_dir_file = url + "/" + tsel[0:4] + "/" + tsel[4:6] + "/" + tsel[
-            6:8] + "/" + file_name_g2
-        urllib.request.urlretrieve(url_dir_file, file_name_g2)
-        file_dir_name = file_name_g2
-        if not os.path.isfile(file_name_g2):
-            raise FileNotFoundError("Download failed, " + file_name_g2)
-    #
-    # convert
-    if opt_convert:
-        res = subprocess.run(
-            ["wgrib2", file_dir_name, "-netcdf", file_name_nc],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        if verbose:
-            print(res.stdout.decode("utf-8"))
-        file_dir_name = file_name_nc
-        if not os.path.isfile(file_name_nc):
-            raise FileNotFoundError("Convert failed, " + file_name_nc)
+        file_dir_name, opt_retrieve, opt_convert = _search_grib(
+            file_dir_names, file_dir_convs)
+        if not opt_retrieve and not opt_convert:
+            if opt_cache and os.path.dirname(file_dir_name) == out_dir:
+                gcache.touch(file_dir_name)
+            return file_dir_name
+    os.makedirs(out_dir, exist_ok=True)
+    # 同じファイルの取得・変換は1つのプロセスだけが行い、他のプロセスは完了を待つ
+    time_start = time.time()
+    with gcache.lock(file_name_nc):
+        # 待っている間に他のプロセスが再取得した場合は、そのファイルを使う
+        if force and os.path.isfile(file_name_nc) and os.path.getmtime(
+                file_name_nc) >= time_start:
+            force = False
+        if force:
+            file_dir_name, opt_retrieve, opt_convert = None, True, True
+        else:
+            file_dir_name, opt_retrieve, opt_convert = _search_grib(
+                file_dir_names, file_dir_convs)
+        if opt_cache and not opt_retrieve and os.path.dirname(
+                file_dir_name) == out_dir:
+            gcache.touch(file_dir_name)
+        # retrieve
+        # 書き込み途中のファイルを読まないように、一時ファイルに書き出してから置き換える
+        if opt_retrieve:
+            tmp_file = _tmp_name(file_name_g2)
+            try:
+                urllib.request.urlretrieve(
+                    _ret_url(tsel, os.path.basename(file_name_g2)), tmp_file)
+                if os.path.isfile(tmp_file):
+                    os.replace(tmp_file, file_name_g2)
+            finally:
+                if os.path.isfile(tmp_file):
+                    os.remove(tmp_file)
+            file_dir_name = file_name_g2
+            if not os.path.isfile(file_name_g2):
+                raise FileNotFoundError("Download failed, " + file_name_g2)
+            if opt_cache:
+                gcache.add(file_name_g2)
+        #
+        # convert
+        if opt_convert:
+            tmp_file = _tmp_name(file_name_nc)
+            try:
+                res = subprocess.run(
+                    ["wgrib2", file_dir_name, "-netcdf", tmp_file],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE)
+                if verbose:
+                    print(res.stdout.decode("utf-8"))
+                if os.path.isfile(tmp_file):
+                    os.replace(tmp_file, file_name_nc)
+            finally:
+                if os.path.isfile(tmp_file):
+                    os.remove(tmp_file)
+            file_dir_name = file_name_nc
+            if not os.path.isfile(file_name_nc):
+                raise FileNotFoundError("Convert failed, " + file_name_nc)
+            if opt_cache:
+                gcache.add(file_name_nc)
+            # 削除・更新されたNetCDFファイルの.npyファイルを消す
+            if fstore is not None:
+                fstore.prune()
     return file_dir_name
 
 
-def _netcdf_msm_surf(msm_dir, fcst_time, tsel):
-    """netCDFファイルを読み込む(MSM、surf)
+def fetch_segment(tsel, dset, lev, fcst_flag, force=False, out_dir=None):
+    """予報時間の区分毎にgrib2ファイルを取得し、NetCDFファイルに変換する
 
     Parameters:
     ----------
-    msm_dir: str
-        MSMデータを置いたディレクトリ、またはretrieve、force_retrieve
-        retrieve：データ取得を行う。既に存在している場合は取得しない。
-        force_retrieve：データ取得を行う。既に存在している場合にも再取得する。
-        ディレクトリ名：新たにデータ取得は行わず、指定ディレクトリにあるNetCDFファイル名を返す
-    fcst_time: int
-        予報時刻
     tsel: str
-        ファイル名に含まれる時刻部分
+        取得する時刻（形式：20210819120000）
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    fcst_flag: str
+        予報時間の区分名（例：00-15）
+    force: bool
+       ファイルが存在しても再取得するかどうか
+    out_dir: str
+       ダウンロード・変換したファイルを置くディレクトリ
+       （Noneの場合はキャッシュディレクトリ）
+    ----------
+    Returns
     ----------
-    Returns 
-    ----------    
-    rec_num: int
-        予報時刻に相当するデータ番号
     file_dir_name: str
         変換したNetCDFファイル名
     ----------
     """
-    if fcst_time <= 15:
-        fcst_flag = "00-15"
-        rec_num = fcst_time
-    elif fcst_time <= 33:
-        fcst_flag = "16-33"
-        rec_num = fcst_time - 16
-    else:
-        fcst_flag = "34-39"
-        rec_num = fcst_time - 34
-    # ファイル名
-    file_name_g2 = "Z__C_RJTD_" + str(tsel) + "_MSM_GPV_Rjp_Lsurf_FH" + str(
-        fcst_flag) + "_grib2.bin"
-    file_name_nc = "Z__C_RJTD_" + str(tsel) + "_MSM_GPV_Rjp_Lsurf_FH" + str(
-        fcst_flag) + "_grib2.nc"
-    #
-    if msm_dir == "retrieve":
-        file_dir_name = _ret_grib(tsel,
-                                  file_name_g2,
-                                  file_name_nc,
-                                  force=False)
-    elif msm_dir == "force_retrieve":
-        file_dir_name = _ret_grib(tsel, file_name_g2, file_name_nc, force=True)
-        msm_dir = "retrieve"
-    else:
-        file_dir_name = os.path.join(msm_dir, file_name_nc)
-    if not os.path.isfile(file_dir_name):
-        raise FileNotFoundError(file_dir_name)
-    return rec_num, file_dir_name
+    file_name_g2, file_name_nc = ret_file_names(tsel, dset, lev, fcst_flag)
+    return _ret_grib(tsel,
+                     file_name_g2,
+                     file_name_nc,
+                     force=force,
+                     out_dir=out_dir)
 
 
-#
-def _netcdf_msm_plev(msm_dir, fcst_time, tsel):
-    """netCDFファイルを読み込む(MSM、pres)
+def ret_segment_files(tsel, dset, lev, in_dir="retrieve"):
+    """予報時間の区分毎のNetCDFファイル名を返す
 
     Parameters:
     ----------
-    msm_dir: str
-        MSMデータを置いたディレクトリ、またはretrieve、force_retrieve
-        retrieve：データ取得を行う。既に存在している場合は取得しない。
-        force_retrieve：データ取得を行う。既に存在している場合にも再取得する。
-        ディレクトリ名：新たにデータ取得は行わず、指定ディレクトリにあるNetCDFファイル名を返す
-    fcst_time: int
-        予報時刻
     tsel: str
-        ファイル名に含まれる時刻部分
+        取得する時刻（形式：20210819120000）
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    in_dir: str
+        入力ディレクトリ、またはretrieve、force_retrieve
+        （retrieveの場合は必要に応じて取得・変換する）
     ----------
-    Returns 
-    ----------    
-    rec_num: int
-        予報時刻に相当するデータ番号
-    file_dir_name: str
-        変換したNetCDFファイル名
+    Returns
+    ----------
+    list((str, int, int, str), ...)
+        区分名、開始時間、終了時間、NetCDFファイル名のリスト
     ----------
     """
-    if fcst_time <= 15:
-        fcst_flag = "00-15"
-        rec_num = fcst_time // 3
-    elif fcst_time <= 33:
-        fcst_flag = "18-33"
-        rec_num = (fcst_time - 18) // 3
-    else:
-        fcst_flag = "36-39"
-        rec_num = (fcst_time - 36) // 3
-    # ファイル名
-    file_name_g2 = "Z__C_RJTD_" + str(tsel) + "_MSM_GPV_Rjp_L-pall_FH" + str(
-        fcst_flag) + "_grib2.bin"
-    file_name_nc = "Z__C_RJTD_" + str(tsel) + "_MSM_GPV_Rjp_L-pall_FH" + str(
-        fcst_flag) + "_grib2.nc"
-    #
-    if msm_dir == "retrieve":
-        file_dir_name = _ret_grib(tsel,
-                                  file_name_g2,
-                                  file_name_nc,
-                                  force=False)
-    elif msm_dir == "force_retrieve":
-        file_dir_name = _ret_grib(tsel, file_name_g2, file_name_nc, force=True)
-        msm_dir = "retrieve"
-    else:
-        file_dir_name = os.path.join(msm_dir, file_name_nc)
-    if not os.path.isfile(file_dir_name):
-        raise FileNotFoundError(file_dir_name)
-    return rec_num, file_dir_name
+    files = []
+    for fcst_flag, fcst_str, fcst_end in segment_table[(dset, lev)]:
+        if in_dir in ("retrieve", "force_retrieve"):
+            file_dir_name = fetch_segment(tsel,
+                                          dset,
+                                          lev,
+                                          fcst_flag,
+                                          force=(in_dir == "force_retrieve"))
+        else:
+            _, file_name_nc = ret_file_names(tsel, dset, lev, fcst_flag)
+            file_dir_name = os.path.join(in_dir, file_name_nc)
+        if not os.path.isfile(file_dir_name):
+            raise FileNotFoundError(file_dir_name)
+        files.append((fcst_flag, fcst_str, fcst_end, file_dir_name))
+    return files
 
 
-#
-def _netcdf_gsm_surf(gsm_dir, fcst_time, tsel):
-    """netCDFファイルを読み込む(GSM、surf)
+def ret_latest(dset, lev="surf", in_dir="retrieve"):
+    """入力ディレクトリにある最新の初期時刻を返す
 
     Parameters:
     ----------
-    msm_dir: str
-        GSMデータを置いたディレクトリ、またはretrieve、force_retrieve
-        retrieve：データ取得を行う。既に存在している場合は取得しない。
-        force_retrieve：データ取得を行う。既に存在している場合にも再取得する。
-        ディレクトリ名：新たにデータ取得は行わず、指定ディレクトリにあるNetCDFファイル名を返す
-    fcst_time: int
-        予報時刻
-    tsel: str
-        ファイル名に含まれる時刻部分
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    in_dir: str
+        入力ディレクトリ（retrieve、force_retrieveの場合は
+        キャッシュディレクトリとDATADIR_GPV）
     ----------
-    Returns 
-    ----------    
-    rec_num: int
-        予報時刻に相当するデータ番号
-    file_dir_name: str
-        変換したNetCDFファイル名
+    Returns
+    ----------
+    tsel: str
+        最新の初期時刻（形式：20210819120000、見つからない場合はNone）
     ----------
     """
-    """netCDFファイルを読み込む(GSM、surf)"""
-    if fcst_time <= 84:  # 1h毎
-        fcst_flag = "0000-0312"
-        rec_num = fcst_time
-    elif fcst_time <= 132:  # 3h毎
-        fcst_flag = "0315-0512"
-        rec_num = (fcst_time - 87) // 3
-    else:
-        fcst_flag = "0515-1100"
-        rec_num = (fcst_time - 135) // 3
-    # ファイル名
-    file_name_g2 = "Z__C_RJTD_" + str(tsel) + "_GSM_GPV_Rjp_Lsurf_FD" + str(
-        fcst_flag) + "_grib2.bin"
-    file_name_nc = "Z__C_RJTD_" + str(tsel) + "_GSM_GPV_Rjp_Lsurf_FD" + str(
-        fcst_flag) + "_grib2.nc"
-    #
-    if gsm_dir == "retrieve":
-        file_dir_name = _ret_grib(tsel,
-                                  file_name_g2,
-                                  file_name_nc,
-                                  force=False)
-    elif gsm_dir == "force_retrieve":
-        file_dir_name = _ret_grib(tsel, file_name_g2, file_name_nc, force=True)
-        gsm_dir = "retrieve"
-    else:
-        file_dir_name = os.path.join(gsm_dir, file_name_nc)
-    if not os.path.isfile(file_dir_name):
-        raise FileNotFoundError(file_dir_name)
-    return rec_num, file_dir_name
+    pat = re.compile(r"^Z__C_RJTD_(\d{14})" +
+                     re.escape(file_prefix_table[(dset, lev)]) +
+                     r".*_grib2\.nc$")
+    dirs = [cache_dir, sys_file_dir]
+    if in_dir not in ("retrieve", "force_retrieve"):
+        dirs = [in_dir]
+    tsels = []
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        for f in os.listdir(d):
+            m = pat.match(f)
+            if m is not None:
+                tsels.append(m.group(1))
+    if not tsels:
+        return None
+    return max(tsels)
 
 
-#
-def _netcdf_gsm_plev(gsm_dir, fcst_time, tsel):
-    """netCDFファイルを読み込む(GSM、pres)
+def _ret_netcdf(dset, lev, in_dir, fcst_time, tsel):
+    """予報時間に対応するデータ番号とNetCDFファイル名を返す
 
     Parameters:
     ----------
-    msm_dir: str
-        GSMデータを置いたディレクトリ、またはretrieve、force_retrieve
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    in_dir: str
+        データを置いたディレクトリ、またはretrieve、force_retrieve
         retrieve：データ取得を行う。既に存在している場合は取得しない。
         force_retrieve：データ取得を行う。既に存在している場合にも再取得する。
         ディレクトリ名：新たにデータ取得は行わず、指定ディレクトリにあるNetCDFファイル名を返す
     fcst_time: int
-        予報時刻
+        予報時刻（データの無い予報時間の場合は、その前のデータ）
     tsel: str
         ファイル名に含まれる時刻部分
     ----------
@@ -270,36 +416,172 @@ def _netcdf_gsm_plev(gsm_dir, fcst_time, tsel):
         変換したNetCDFファイル名
     ----------
     """
-    if fcst_time <= 84:
-        fcst_flag = "0000-0312"
-        rec_num = fcst_time // 3
-    elif fcst_time <= 132:
-        fcst_flag = "0318-0512"
-        rec_num = (fcst_time - 90) // 3
-    else:
-        fcst_flag = "0518-1100"
-        rec_num = (fcst_time - 138) // 3
-    # ファイル名
-    file_name_g2 = "Z__C_RJTD_" + str(tsel) + "_GSM_GPV_Rjp_L-pall_FD" + str(
-        fcst_flag) + "_grib2.bin"
-    file_name_nc = "Z__C_RJTD_" + str(tsel) + "_GSM_GPV_Rjp_L-pall_FD" + str(
-        fcst_flag) + "_grib2.nc"
-    #
-    if gsm_dir == "retrieve":
-        file_dir_name = _ret_grib(tsel,
-                                  file_name_g2,
-                                  file_name_nc,
-                                  force=False)
-    elif gsm_dir == "force_retrieve":
-        file_dir_name = _ret_grib(tsel, file_name_g2, file_name_nc, force=True)
-        gsm_dir = "retrieve"
+    fcst_flag, rec_num = lead_time_index[(dset, lev)].floor(fcst_time)
+    if in_dir in ("retrieve", "force_retrieve"):
+        # 再取得は同じファイルについてプロセス内で1回だけ行う
+        force = (in_dir == "force_retrieve"
+                 and (tsel, dset, lev, fcst_flag) not in _forced)
+        file_dir_name = fetch_segment(tsel, dset, lev, fcst_flag, force=force)
+        if force:
+            _forced.add((tsel, dset, lev, fcst_flag))
     else:
-        file_dir_name = os.path.join(gsm_dir, file_name_nc)
+        _, file_name_nc = ret_file_names(tsel, dset, lev, fcst_flag)
+        file_dir_name = os.path.join(in_dir, file_name_nc)
     if not os.path.isfile(file_dir_name):
         raise FileNotFoundError(file_dir_name)
     return rec_num, file_dir_name
 
 
+def _ret_input_files(reader, dset, lev, in_dir, fcst_times, var_names):
+    """予報時間fcst_timesのデータを作るのに使うNetCDFファイル名のリストを返す
+
+    データの無い予報時間は前後のデータ、GSMの降水量（APCP_surface）は
+    差を取る前のデータのファイルも含める（ファイルの中身は読み込まない）
+    """
+    index = lead_time_index[(dset, lev)]
+    fcst_times = [int(t) for t in fcst_times]
+    if dset == "GSM" and "APCP_surface" in var_names:
+        # 前のデータ（データの無い予報時間は1時間前）との差を取る
+        fcst_times += [
+            index.previous(t)[0] if t in index else t - 1 for t in fcst_times
+            if t > 0
+        ]
+    i0, i1, _ = index.weights(fcst_times)
+    need = index.times[np.unique(np.concatenate([i0, i1]))]
+    file_dir_names = []
+    for _, fcst_str, _, _ in index.group(need):
+        _, file_dir_name = _ret_netcdf(dset, lev, in_dir, fcst_str,
+                                       reader.tsel)
+        file_dir_names.append(file_dir_name)
+    return file_dir_names
+
+
+def ret_record_times(dset, lev):
+    """全ての区分のデータの予報時間と、区分名・データ番号を返す
+
+    Parameters:
+    ----------
+    dset: str
+        GSMかMSMを指定する
+    lev: str
+        <surf/plev>：surfなら表面データ、plevなら気圧面データ
+    ----------
+    Returns:
+    ----------
+    times: ndarray(int)
+        データの予報時間（昇順）
+    recs: list((str, int), ...)
+        区分名、区分内のデータ番号のリスト（timesの順）
+    ----------
+    """
+    index = lead_time_index[(dset, lev)]
+    return index.times, index.recs
+
+
+def ret_time_weights(dset, lev, fcst_times):
+    """予報時間の前後のデータの番号と、時間内挿の重みを返す
+
+    （LeadTimeIndex.weightsを参照）
+    """
+    return lead_time_index[(dset, lev)].weights(fcst_times)
+
+
+def is_record_time(dset, lev, fcst_time):
+    """予報時間fcst_timeのデータがファイルにあるかどうか"""
+    return fcst_time in lead_time_index[(dset, lev)]
+
+
+def _ret_field(nc, file_dir_name, var_name, rec_num):
+    """変数var_nameのレコードrec_numの2次元データを返す
+
+    FieldBrokerの共有メモリにある場合（SHMFIELDS_GPV）は共有メモリから、
+    FIELDSTORE_GPVが設定されている場合は、.npyファイルをメモリマップで読み込む
+    """
+    d = shmbroker.ret_shared(file_dir_name, var_name, rec_num)
+    if d is None:
+        if fstore is None:
+            d = nc.variables[var_name][rec_num]
+        else:
+            d = fstore.ret_rec(nc, file_dir_name, var_name, rec_num)
+    return d
+
+
+def _ret_recs(file_dir_name, var_name, rec_nums):
+    """変数var_nameのレコードrec_nums（昇順）の2次元データのリストを返す
+
+    等間隔のレコードは1回のスライスで読み込む
+    """
+    with netCDF4.Dataset(file_dir_name, 'r') as nc:
+        if shmbroker.index_file is not None or fstore is not None:
+            return [
+                _ret_field(nc, file_dir_name, var_name, rec_num)
+                for rec_num in rec_nums
+            ]
+        return list(nc.variables[var_name][_ret_rec_sel(rec_nums)])
+
+
+def _ret_rec_sel(rec_nums):
+    """レコードrec_nums（昇順）を読み込むインデックスを返す
+
+    等間隔の場合はスライス（1回の読み込みになる）、それ以外はリスト
+    """
+    steps = np.unique(np.diff(rec_nums))
+    if len(steps) <= 1:
+        step = int(steps[0]) if len(steps) == 1 else 1
+        return slice(int(rec_nums[0]), int(rec_nums[-1]) + 1, step)
+    return [int(r) for r in rec_nums]
+
+
+def _ret_var_times(reader, dset, lev, in_dir, var_name, fcst_times, fact,
+                   offset):
+    """予報時間fcst_times毎の2次元データを3次元データで返す
+
+    必要なレコードだけを区分毎にまとめて読み込み、データの無い予報時間は
+    前後のデータから線形内挿する（ReadMSM、ReadGSMのret_var_times）
+    """
+    index = lead_time_index[(dset, lev)]
+    i0, i1, w = index.weights(fcst_times)
+    # 必要なデータの予報時間 -> 2次元データ
+    fields = dict()
+    need = index.times[np.unique(np.concatenate([i0, i1]))]
+    for _, fcst_str, rec_nums, times in index.group(need):
+        _, file_dir_name = _ret_netcdf(dset, lev, in_dir, fcst_str,
+                                       reader.tsel)
+        fields.update(zip(times, _ret_recs(file_dir_name, var_name,
+                                           rec_nums)))
+    d = np.ma.stack([fields[t] for t in index.times[i0]])
+    # データの無い予報時間だけを内挿する（データのある予報時間はファイルの値、
+    # 型のまま）
+    k = np.nonzero(w)[0]
+    if len(k) > 0:
+        wk = w[k, np.newaxis, np.newaxis]
+        d[k] = d[k] * (1.0 - wk) + np.ma.stack(
+            [fields[t] for t in index.times[i1[k]]]) * wk
+    if var_name == "APCP_surface":
+        # +0hの降水量はデータがないため0
+        d[np.asarray(fcst_times) == 0] = 0.0
+    if fact == 1.0 and offset == 0.0:
+        return d
+    return d * fact + offset
+
+
+def _ret_rec(reader, var_name, rec_num, fact=1.0, offset=0.0):
+    """変数var_nameのレコードrec_numの2次元データにfactを掛けoffsetを足して返す
+
+    （fact=1.0、offset=0.0の場合は共有メモリ・.npyファイルのデータを
+    コピーせずに読み込み専用のまま返す）
+    """
+    return _scale(_ret_field(reader.nc, reader.file_dir_name, var_name,
+                             rec_num), fact, offset)
+
+
+def _scale(d, fact=1.0, offset=0.0):
+    """データdにfactを掛けoffsetを足して返す（1.0、0.0の場合はそのまま返す）"""
+    if fact == 1.0 and offset == 0.0:
+        return d
+    return d * fact + offset
+
+
 ### utils ###
 
 ##############################################################################
@@ -326,6 +608,7 @@ class ReadMSM():
         self.msm_lev = msm_lev
         self.fcst_time = -1
         self.rec_num = -1
+        self.file_dir_name = None
         self.nc = None
         # 入力チェック
         if tsel is None:
@@ -361,11 +644,10 @@ class ReadMSM():
         fcst_time = self.fcst_time
         # fcst_timeに対応した表面(surf)か気圧面(plev)データ名取得
         # 必要ならgribからNetcdfへの変換を行う
-        if msm_lev == "surf":
-            rec_num, file_dir_name = _netcdf_msm_surf(msm_dir, fcst_time, tsel)
-        elif msm_lev == "plev":
-            rec_num, file_dir_name = _netcdf_msm_plev(msm_dir, fcst_time, tsel)
+        rec_num, file_dir_name = _ret_netcdf("MSM", msm_lev, msm_dir,
+                                             fcst_time, tsel)
         self.rec_num = rec_num
+        self.file_dir_name = file_dir_name
         #
         # NetCDFデータの読み込み
         nc = netCDF4.Dataset(file_dir_name, 'r')
@@ -407,7 +689,6 @@ class ReadMSM():
         """
         fcst_time = self.fcst_time
         rec_num = self.rec_num
-        nc = self.nc
         # 降水量の場合 (mm/h)
         if var_name == "APCP_surface":
             # データを取り出し、factを掛けoffsetを足す
@@ -415,19 +696,92 @@ class ReadMSM():
                 # データがないため、+0hのみ後１時間降水量(kg/m2) (1000mm->1000kg/m2)
                 #d = nc.variables[var_name][1] * fact + offset
                 # データがないため、+0hのみ0 (kg/m2) (1000mm->1000kg/m2)
-                d = nc.variables[var_name][1] * 0.0
+                d = _ret_rec(self, var_name, 1) * 0.0
             else:
                 # 前１時間降水量(kg/m2) (1000mm->1000kg/m2)
-                d = nc.variables[var_name][rec_num] * fact + offset
+                d = _ret_rec(self, var_name, rec_num, fact, offset)
+        # データの無い予報時間の場合は、前後のデータから内挿する
+        elif not is_record_time("MSM", self.msm_lev, fcst_time):
+            d = self.ret_var_times(var_name, [fcst_time], fact, offset)[0]
         # 他のデータの場合
         else:
             # データを取り出し、factを掛けoffsetを足す
-            d = nc.variables[var_name][rec_num] * fact + offset
+            d = _ret_rec(self, var_name, rec_num, fact, offset)
         #
         if verbose:
             print("read: ", var_name, d.shape)
         return d
 
+    #
+    def ret_var_times(self, var_name, fcst_times, fact=1.0, offset=0.0):
+        """複数の予報時間のデータを三次元のndarrayで取り出す
+
+        必要なレコードだけを区分毎にまとめて（等間隔なら1回のスライスで）読み込み、
+        データの無い予報時間は前後のデータから線形内挿する。
+        readnetcdfを呼ぶ必要はない。降水量はファイルの値（前1時間値）のまま返す
+
+        Parameters:
+        ----------
+        var_name: str
+            変数名
+        fcst_times: list(int, ...) or ndarray
+            予報時間（例：np.arange(0, 37, 6)）
+        fact: float
+            データに掛けるスケールファクター
+        offset: float
+            データに足すオフセット値
+        ----------
+        Returns 
+        ----------
+        d: ndarray
+            取り出した3次元データ（予報時間, 緯度, 経度）
+        ----------
+        """
+        return _ret_var_times(self, "MSM", self.msm_lev, self.msm_dir,
+                              var_name, fcst_times, fact, offset)
+
+    #
+    def ret_input_files(self, fcst_times, var_names=()):
+        """予報時間fcst_timesのデータを作るのに使うNetCDFファイル名のリストを返す
+
+        ファイルは読み込まない（必要なら取得・変換する）。作図結果の
+        キャッシュのキー（utils.RenderCache.ret_key）に使う
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間
+        var_names: list(str, ...)
+            読み込む変数名（ファイルの選択には影響しない）
+        ----------
+        Returns 
+        ----------
+        file_dir_names: list(str, ...)
+            NetCDFファイル名のリスト（予報時間の順）
+        ----------
+        """
+        return _ret_input_files(self, "MSM", self.msm_lev, self.msm_dir,
+                                fcst_times, var_names)
+
+    #
+    def split_times(self, fcst_times):
+        """予報時間を、ファイル（予報時間の区分）毎に分ける
+
+        区分毎にret_var_timesを呼ぶと、各ファイルを1回ずつ開いて読み込める
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間
+        ----------
+        Returns 
+        ----------
+        list(list(int, ...), ...)
+            区分毎の予報時間のリスト（予報時間の順）
+        ----------
+        """
+        return lead_time_index[("MSM", self.msm_lev)].split(fcst_times)
+
     #
     def ret_var_3d(self, var_name, plevs, fact=1.0, offset=0.0):
         """netCDFファイルに含まれているデータを三次元のndarrayで返す
@@ -491,7 +845,11 @@ class ReadGSM():
         self.gsm_lev = gsm_lev
         self.fcst_time = -1
         self.rec_num = -1
+        self.file_dir_name = None
         self.nc = None
+        # 最後に読み込んだ累積降水量（1つだけ保持する）
+        #   ((変数名, ファイル名, データ番号), 2次元データ)
+        self._cum_rec = None
         # 入力チェック
         if tsel is None:
             raise ValueError("tsel is needed")
@@ -527,11 +885,10 @@ class ReadGSM():
         fcst_time = self.fcst_time
         # fcst_timeに対応した表面(surf)か気圧面(plev)データ名取得
         # 必要ならgribからNetcdfへの変換を行う
-        if gsm_lev == "surf":
-            rec_num, file_dir_name = _netcdf_gsm_surf(gsm_dir, fcst_time, tsel)
-        elif gsm_lev == "plev":
-            rec_num, file_dir_name = _netcdf_gsm_plev(gsm_dir, fcst_time, tsel)
+        rec_num, file_dir_name = _ret_netcdf("GSM", gsm_lev, gsm_dir,
+                                             fcst_time, tsel)
         self.rec_num = rec_num
+        self.file_dir_name = file_dir_name
         #
         # NetCDFデータの読み込み
         nc = netCDF4.Dataset(file_dir_name, 'r')
@@ -563,6 +920,8 @@ class ReadGSM():
             データに足すオフセット値
         cum_rain: bool
             降水量データを累積値で返す場合はTrue、前1時間値で返す場合はFalse
+            （Falseの場合、84時間より後のデータのある予報時間は前のデータからの
+            3時間降水量、データの無い予報時間はその3時間を等分した値）
         ----------
         Returns 
         ----------
@@ -572,7 +931,6 @@ class ReadGSM():
         """
         fcst_time = self.fcst_time
         rec_num = self.rec_num
-        nc = self.nc
         # 降水量の場合 (mm/h)
         if var_name == "APCP_surface":
             # データを取り出し、factを掛けoffsetを足す
@@ -580,29 +938,172 @@ class ReadGSM():
                 # データがないため、+0hのみ後１時間降水量(kg/m2) (1000mm->1000kg/m2)
                 #d = nc.variables[var_name][1] * fact + offset
                 # データがないため、+0hのみ0 (kg/m2) (1000mm->1000kg/m2)
-                d = nc.variables[var_name][1] * 0.0
-            elif fcst_time == 1:
+                d = _ret_rec(self, var_name, 1) * 0.0
+            elif not is_record_time("GSM", self.gsm_lev, fcst_time):
+                # データの無い予報時間（85、86時間など）は、前後のデータから
+                # 内挿した累積降水量（ret_var_timesと同じ）、または
+                # その1時間前との差（前後のデータの間の降水量を等分した値）
+                if cum_rain:
+                    d = self.ret_var_times(var_name, [fcst_time], fact,
+                                           offset)[0]
+                else:
+                    d = self.ret_var_times(var_name,
+                                           [fcst_time - 1, fcst_time], fact,
+                                           offset)
+                    d = d[1] - d[0]
+            elif fcst_time == 1 or cum_rain:
+                # 前１時間降水量、または累積降水量(kg/m2) (1000mm->1000kg/m2)
+                d = self._ret_cum(var_name, self.file_dir_name, rec_num)
+                if fact == 1.0 and offset == 0.0:
+                    # 保持しているレコードは返さない（呼び出し側が変更してもよい）
+                    d = d.copy()
+                else:
+                    d = _scale(d, fact, offset)
+            else:  # 前１時間降水量
+                # 1つ前のデータ（区分の最初のデータの場合は前の区分のファイル）
+                index = lead_time_index[("GSM", self.gsm_lev)]
+                time0, fcst_flag0, rec_num0 = index.previous(fcst_time)
+                if fcst_flag0 == index.floor(fcst_time)[0]:
+                    file_dir_name0 = self.file_dir_name
+                else:
+                    _, file_dir_name0 = _ret_netcdf("GSM", self.gsm_lev,
+                                                    self.gsm_dir, time0,
+                                                    self.tsel)
+                # d0、d1には累積降水量(kg/m2)が入っている
+                # （保持しているレコードを先に使い、もう一方を読み込んで保持する）
+                key1 = (var_name, self.file_dir_name, rec_num)
+                if self._cum_rec is not None and self._cum_rec[0] == key1:
+                    d1 = self._ret_cum(*key1)
+                    d0 = self._ret_cum(var_name, file_dir_name0, rec_num0)
+                else:
+                    d0 = self._ret_cum(var_name, file_dir_name0, rec_num0)
+                    d1 = self._ret_cum(*key1)
+                d0 = _scale(d0, fact, offset)
+                d1 = _scale(d1, fact, offset)
                 # 前１時間降水量(kg/m2) (1000mm->1000kg/m2)
-                d = nc.variables[var_name][rec_num] * fact + offset
-            else:
-                if cum_rain:  # 累積降水量
-                    # 累積降水量(kg/m2) (1000mm->1000kg/m2)
-                    d = nc.variables[var_name][rec_num] * fact + offset
-                else:  # 前１時間降水量
-                    # d0、d1には累積降水量(kg/m2)が入っている
-                    d0 = nc.variables[var_name][rec_num - 1] * fact + offset
-                    d1 = nc.variables[var_name][rec_num] * fact + offset
-                    # 前１時間降水量(kg/m2) (1000mm->1000kg/m2)
-                    d = d1 - d0
+                # （84時間より後は前のデータからの3時間降水量）
+                d = d1 - d0
         #
+        # データの無い予報時間の場合は、前後のデータから内挿する
+        elif not is_record_time("GSM", self.gsm_lev, fcst_time):
+            d = self.ret_var_times(var_name, [fcst_time], fact, offset)[0]
         # 他のデータの場合
         else:
             # データを取り出し、factを掛けoffsetを足す
-            d = nc.variables[var_name][rec_num] * fact + offset
+            d = _ret_rec(self, var_name, rec_num, fact, offset)
         #
         print(var_name, d.shape)
         return d
 
+    def _ret_cum(self, var_name, file_dir_name, rec_num):
+        """ファイルfile_dir_nameのレコードrec_numの累積降水量を返す
+
+        最後に読み込んだレコードを1つ保持し、同じレコードは読み込み直さない
+        （予報時間の順に呼ぶと、各レコードの読み込みは1回になる）。
+        返す配列は保持しているものなので、変更しないこと
+        """
+        key = (var_name, file_dir_name, rec_num)
+        if self._cum_rec is not None and self._cum_rec[0] == key:
+            return self._cum_rec[1]
+        if file_dir_name == self.file_dir_name:
+            d = _ret_field(self.nc, file_dir_name, var_name, rec_num)
+        else:
+            d = _ret_recs(file_dir_name, var_name, [rec_num])[0]
+        self._cum_rec = (key, d)
+        return d
+
+    #
+    def ret_var_times(self,
+                      var_name,
+                      fcst_times,
+                      fact=1.0,
+                      offset=0.0,
+                      cum_rain=True):
+        """複数の予報時間のデータを三次元のndarrayで取り出す
+
+        必要なレコードだけを区分毎にまとめて（等間隔なら1回のスライスで）読み込み、
+        データの無い予報時間は前後のデータから線形内挿する。
+        readnetcdfを呼ぶ必要はない
+
+        Parameters:
+        ----------
+        var_name: str
+            変数名
+        fcst_times: list(int, ...) or ndarray
+            予報時間（例：np.arange(0, 37, 6)）
+        fact: float
+            データに掛けるスケールファクター
+        offset: float
+            データに足すオフセット値
+        cum_rain: bool
+            降水量データを累積値（ファイルの値）で返す場合はTrue、
+            前1時間値（ret_var(cum_rain=False)と同じ値）で返す場合はFalse
+        ----------
+        Returns 
+        ----------
+        d: ndarray
+            取り出した3次元データ（予報時間, 緯度, 経度）
+        ----------
+        """
+        if var_name != "APCP_surface" or cum_rain:
+            return _ret_var_times(self, "GSM", self.gsm_lev, self.gsm_dir,
+                                  var_name, fcst_times, fact, offset)
+        # 前のデータ（データの無い予報時間は1時間前）との差
+        index = lead_time_index[("GSM", self.gsm_lev)]
+        fcst_times = [int(t) for t in fcst_times]
+        times0 = [
+            index.previous(t)[0] if t in index and t > 0 else max(t - 1, 0)
+            for t in fcst_times
+        ]
+        d = _ret_var_times(self, "GSM", self.gsm_lev, self.gsm_dir,
+                           var_name, fcst_times + times0, fact, 0.0)
+        d = d[:len(fcst_times)] - d[len(fcst_times):]
+        # +1hは累積値にoffsetを足した値（ret_varと同じ）
+        d[np.asarray(fcst_times) == 1] += offset
+        return d
+
+    #
+    def ret_input_files(self, fcst_times, var_names=()):
+        """予報時間fcst_timesのデータを作るのに使うNetCDFファイル名のリストを返す
+
+        ファイルは読み込まない（必要なら取得・変換する）。作図結果の
+        キャッシュのキー（utils.RenderCache.ret_key）に使う
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間
+        var_names: list(str, ...)
+            読み込む変数名（降水量は前のデータのファイルも含める）
+        ----------
+        Returns 
+        ----------
+        file_dir_names: list(str, ...)
+            NetCDFファイル名のリスト（予報時間の順）
+        ----------
+        """
+        return _ret_input_files(self, "GSM", self.gsm_lev, self.gsm_dir,
+                                fcst_times, var_names)
+
+    #
+    def split_times(self, fcst_times):
+        """予報時間を、ファイル（予報時間の区分）毎に分ける
+
+        区分毎にret_var_timesを呼ぶと、各ファイルを1回ずつ開いて読み込める
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間
+        ----------
+        Returns 
+        ----------
+        list(list(int, ...), ...)
+            区分毎の予報時間のリスト（予報時間の順）
+        ----------
+        """
+        return lead_time_index[("GSM", self.gsm_lev)].split(fcst_times)
+
     #
     def ret_var_3d(self, var_name, plevs, fact=1.0, offset=0.0):
         """netCDFファイルに含まれているデータを三次元のndarrayで返す
@@ -0,0 +1,110 @@
+#
+#  NetCDFファイルから取り出した2次元データを.npyファイルで保存し、
+#  次回からはメモリマップで読み込む
+#
+import os
+import shutil
+import numpy as np
+
+
+class FieldStore():
+    """NetCDFファイルの変数・レコード毎の2次元データを.npyファイルで保存する
+
+    store_dir/<NetCDFファイル名>_<サイズ>_<更新時刻>/<変数名>/<レコード番号>.npy
+    に保存し、np.load(mmap_mode='r')で読み込む。同じホストで動く複数のプロセスは
+    ページキャッシュ上の同じデータを共有する。
+    欠損値がある場合は、<レコード番号>.mask.npyにマスクを保存する。
+    元のNetCDFファイル名はsourceに記録し、pruneで不要になったデータを削除する
+    """
+
+    def __init__(self, store_dir):
+        """保存先の設定
+
+        Parameters:
+        ----------
+        store_dir: str
+            .npyファイルを置くディレクトリ
+        ----------
+        """
+        self.store_dir = store_dir
+        self._dirs = dict()
+
+    def _file_dir(self, file_dir_name):
+        """NetCDFファイルに対応するディレクトリ名を返す（ファイルが更新されれば別の名前）"""
+        st = os.stat(file_dir_name)
+        key = (file_dir_name, st.st_size, st.st_mtime_ns)
+        if key not in self._dirs:
+            self._dirs[key] = os.path.join(
+                self.store_dir,
+                os.path.basename(file_dir_name) + "_" + str(st.st_size) +
+                "_" + format(st.st_mtime_ns, "x"))
+        return self._dirs[key]
+
+    def ret_rec(self, nc, file_dir_name, var_name, rec_num):
+        """変数var_nameのレコードrec_numを返す（保存されていなければ保存する）
+
+        Parameters:
+        ----------
+        nc: netCDF4.Dataset
+            開いているNetCDFファイル
+        file_dir_name: str
+            NetCDFファイル名
+        var_name: str
+            変数名
+        rec_num: int
+            レコード番号
+        ----------
+        Returns:
+        ----------
+        d: numpy.ndarray or numpy.ma.MaskedArray
+            2次元データ（読み込み専用のメモリマップ）
+        ----------
+        """
+        file_dir = self._file_dir(file_dir_name)
+        var_dir = os.path.join(file_dir, var_name)
+        data_file = os.path.join(var_dir, str(rec_num) + ".npy")
+        mask_file = os.path.join(var_dir, str(rec_num) + ".mask.npy")
+        if not os.path.isfile(data_file):
+            self._store(nc.variables[var_name][rec_num], data_file, mask_file)
+            # 元のNetCDFファイル名を記録する（prune用）
+            source_file = os.path.join(file_dir, "source")
+            if not os.path.isfile(source_file):
+                with open(source_file, 'wt') as fout:
+                    fout.write(os.path.abspath(file_dir_name) + "\n")
+        d = np.load(data_file, mmap_mode='r')
+        if os.path.isfile(mask_file):
+            d = np.ma.masked_array(d, mask=np.load(mask_file, mmap_mode='r'))
+        return d
+
+    def _store(self, d, data_file, mask_file):
+        """2次元データをリトルエンディアンの.npyファイルで保存する"""
+        os.makedirs(os.path.dirname(data_file), exist_ok=True)
+        mask = np.ma.getmaskarray(d)
+        data = np.ma.getdata(d)
+        data = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<'))
+        # 書き込み途中のファイルを読まないように、一時ファイルから置き換える
+        # （マスクを先に置き、データファイルの有無で保存済みかを判断する）
+        suffix = "." + str(os.getpid()) + ".tmp.npy"
+        if mask.any():
+            np.save(mask_file + suffix, mask)
+            os.replace(mask_file + suffix, mask_file)
+        np.save(data_file + suffix, data)
+        os.replace(data_file + suffix, data_file)
+
+    def prune(self):
+        """元のNetCDFファイルが無くなった、または更新されたデータを削除する"""
+        if not os.path.isdir(self.store_dir):
+            return
+        for f in os.listdir(self.store_dir):
+            file_dir = os.path.join(self.store_dir, f)
+            source_file = os.path.join(file_dir, "source")
+            if not os.path.isfile(source_file):
+                continue
+            with open(source_file, 'rt') as fin:
+                file_dir_name = fin.read().strip()
+            try:
+                if self._file_dir(file_dir_name) == file_dir:
+                    continue
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(file_dir, ignore_errors=True)
@@ -0,0 +1,286 @@
+#
+#  ダウンロード・変換したファイルのキャッシュ
+#
+import os
+import re
+import json
+import time
+import zlib
+import fcntl
+from contextlib import contextmanager
+
+# キャッシュの上限サイズのデフォルト（バイト）
+cache_size_default = 20 * 1024**3
+
+# 最終利用時刻を更新する間隔（秒）
+touch_interval = 60.0
+
+# ファイルの取得・変換を排他するロックファイルの数
+lock_slots = 64
+
+# 初期時刻の取り出し
+_re_tsel = re.compile(r"^Z__C_RJTD_(\d{14})_")
+
+
+def _parse_size(s):
+    """サイズの文字列（例：20G、500M、1000000）をバイト数に変換する"""
+    if s is None:
+        return cache_size_default
+    s = str(s).strip()
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    if s[-1:].upper() in units:
+        return int(float(s[:-1]) * units[s[-1:].upper()])
+    return int(s)
+
+
+def _ret_tsel(file_name):
+    """ファイル名から初期時刻を取り出す（該当しない場合はNone）"""
+    m = _re_tsel.match(os.path.basename(file_name))
+    if m is None:
+        return None
+    return m.group(1)
+
+
+def _is_alive(pid):
+    """プロセスpidが実行中かどうか"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def file_lock(lock_file):
+    """ロックファイルで排他する（他のプロセスが保持している間は待つ）
+
+    Parameters:
+    ----------
+    lock_file: str
+        ロックファイル名
+    ----------
+    """
+    with open(lock_file, 'a') as flock:
+        fcntl.flock(flock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(flock, fcntl.LOCK_UN)
+
+
+class GribCache():
+    """ダウンロードしたgrib2ファイルと変換したNetCDFファイルのキャッシュ
+
+    addで登録した（このキャッシュがダウンロード・変換した）ファイルだけを
+    index.jsonにサイズ、最終利用時刻、初期時刻と共に記録し、
+    合計サイズが上限を超えた場合には最終利用時刻の古いものから削除する。
+    固定（pin）した初期時刻と、最新の初期時刻のファイルは削除しない。
+    index.jsonの更新はindex.lockのファイルロックで排他し、
+    複数のプロセスから同じディレクトリを共有できる。
+    ファイルの取得・変換の排他にはlocks/のロックファイルを使う
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        """キャッシュの設定
+
+        Parameters:
+        ----------
+        cache_dir: str
+            キャッシュを置くディレクトリ
+        max_size: int or str
+            キャッシュの上限サイズ（バイト、または20Gのような文字列）
+        ----------
+        """
+        self.cache_dir = cache_dir
+        self.max_size = _parse_size(max_size)
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.lock_file = os.path.join(cache_dir, "index.lock")
+        self.lock_dir = os.path.join(cache_dir, "locks")
+        self._touched = dict()
+
+    def path(self, file_name):
+        """キャッシュ内のファイルのパスを返す"""
+        return os.path.join(self.cache_dir, os.path.basename(file_name))
+
+    def lock(self, file_name):
+        """ファイルfile_nameの取得・変換を排他する（with文で使う）
+
+        ロックファイルはファイル毎には作らず、パスのハッシュでlocks/の
+        lock_slots個のファイルから選ぶ（ロックファイルが増え続けない。
+        同じロックファイルになった別のファイルの取得・変換は順に行う）
+
+        Parameters:
+        ----------
+        file_name: str
+            取得・変換するファイル名
+        ----------
+        """
+        slot = zlib.crc32(os.path.abspath(file_name).encode("utf-8"))
+        os.makedirs(self.lock_dir, exist_ok=True)
+        return file_lock(
+            os.path.join(self.lock_dir,
+                         "{:02d}.lock".format(slot % lock_slots)))
+
+    @contextmanager
+    def _locked(self):
+        """index.jsonを排他的に読み書きする"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(self.lock_file):
+            index = self._load()
+            yield index
+            self._save(index)
+
+    def _load(self):
+        """index.jsonを読み込む"""
+        if not os.path.isfile(self.index_file):
+            return {"files": {}, "pinned": []}
+        with open(self.index_file, 'rt') as fin:
+            try:
+                index = json.load(fin)
+            except ValueError:
+                index = {}
+        index.setdefault("files", {})
+        index.setdefault("pinned", [])
+        return index
+
+    def _save(self, index):
+        """index.jsonを書き出す（一時ファイルから置き換える）"""
+        tmp_file = self.index_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, 'wt') as fout:
+            json.dump(index, fout)
+        os.replace(tmp_file, self.index_file)
+
+    def lookup(self, file_name):
+        """キャッシュにファイルがあればパスを返す（最終利用時刻も更新する）
+
+        Parameters:
+        ----------
+        file_name: str
+            ファイル名
+        ----------
+        Returns:
+        ----------
+        str or None
+            キャッシュ内のファイルのパス（存在しない場合はNone）
+        ----------
+        """
+        path = self.path(file_name)
+        if not os.path.isfile(path):
+            return None
+        self.touch(file_name)
+        return path
+
+    def touch(self, file_name):
+        """最終利用時刻を更新する（touch_interval秒以内の更新は省略）
+
+        addで登録したファイルのみ更新し、登録されていないファイルは
+        登録しない（キャッシュディレクトリに置かれた他のファイルは削除しない）
+        """
+        name = os.path.basename(file_name)
+        now = time.time()
+        if now - self._touched.get(name, 0.0) < touch_interval:
+            return
+        self._touched[name] = now
+        if not os.path.isfile(self.index_file):
+            return
+        with self._locked() as index:
+            if name in index["files"]:
+                index["files"][name]["atime"] = now
+
+    def add(self, file_name):
+        """キャッシュにファイルを登録し、必要なら古いファイルを削除する
+
+        Parameters:
+        ----------
+        file_name: str
+            キャッシュディレクトリに置いたファイル名
+        ----------
+        """
+        name = os.path.basename(file_name)
+        now = time.time()
+        self._touched[name] = now
+        with self._locked() as index:
+            self._register(index, name, now)
+            self._evict(index)
+
+    def _register(self, index, name, now):
+        """index.jsonにファイルを追加する"""
+        path = self.path(name)
+        if not os.path.isfile(path):
+            return
+        index["files"][name] = {
+            "size": os.path.getsize(path),
+            "atime": now,
+            "tsel": _ret_tsel(name),
+        }
+
+    def pin(self, tsel):
+        """初期時刻tselのファイルを削除対象から外す
+
+        固定はプロセス毎に記録し、固定したプロセスが終了している場合は
+        無効になる（複数のプロセスが同じ初期時刻を固定できる）
+        """
+        with self._locked() as index:
+            entry = [tsel, os.getpid()]
+            if entry not in index["pinned"]:
+                index["pinned"].append(entry)
+
+    def unpin(self, tsel):
+        """このプロセスによる初期時刻tselの固定を解除する"""
+        with self._locked() as index:
+            entry = [tsel, os.getpid()]
+            if entry in index["pinned"]:
+                index["pinned"].remove(entry)
+
+    @contextmanager
+    def pinned(self, tsel):
+        """処理の間、初期時刻tselのファイルを削除対象から外す
+
+        Parameters:
+        ----------
+        tsel: str
+            初期時刻（形式：20210819120000）
+        ----------
+        """
+        self.pin(tsel)
+        try:
+            yield
+        finally:
+            self.unpin(tsel)
+
+    def evict(self):
+        """合計サイズが上限を超えていれば古いファイルを削除する"""
+        with self._locked() as index:
+            self._evict(index)
+
+    def _evict(self, index):
+        """最終利用時刻の古いファイルから削除する（index.jsonはロック済み）"""
+        files = index["files"]
+        # 既に無くなったファイルを索引から除く
+        for name in [n for n in files if not os.path.isfile(self.path(n))]:
+            del files[name]
+        total = sum(v["size"] for v in files.values())
+        if total <= self.max_size:
+            return
+        # 固定した初期時刻（終了したプロセスの固定は除く）と最新の初期時刻
+        index["pinned"] = [
+            entry for entry in index["pinned"] if _is_alive(entry[1])
+        ]
+        pinned = set(tsel for tsel, _ in index["pinned"])
+        tsels = [v["tsel"] for v in files.values() if v["tsel"] is not None]
+        if tsels:
+            pinned.add(max(tsels))
+        names = [n for n, v in files.items() if v["tsel"] not in pinned]
+        names.sort(key=lambda n: files[n]["atime"])
+        for name in names:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            total -= files[name]["size"]
+            del files[name]
+            print("cache evicted:", name)
@@ -0,0 +1,162 @@
+#
+#  予報時間から、ファイル（予報時間の区分）とデータ番号を引く索引
+#
+import numpy as np
+
+
+class LeadTimeIndex():
+    """予報時間 -> (区分名, データ番号)の索引
+
+    データセット・面毎に、区分の一覧（segment_table）とデータの時間間隔
+    （record_step_table）から全てのデータの予報時間を作っておき、
+    辞書で引く（O(1)）
+    """
+
+    def __init__(self, segments, steps):
+        """索引の作成
+
+        Parameters:
+        ----------
+        segments: list((str, int, int), ...)
+            区分名、開始時間、終了時間のリスト（予報時間の順）
+        steps: list(int, ...)
+            区分毎のデータの時間間隔（時間）
+        ----------
+        """
+        if len(segments) != len(steps):
+            raise ValueError("segments and steps must have the same length")
+        fcst_prev = -1
+        for (fcst_flag, fcst_str, fcst_end), step in zip(segments, steps):
+            if step <= 0 or (fcst_end - fcst_str) % step != 0:
+                raise ValueError("invalid step for " + fcst_flag)
+            if fcst_str <= fcst_prev:
+                raise ValueError("overlapping segment " + fcst_flag)
+            fcst_prev = fcst_end
+        self.segments = list(segments)
+        self.steps = list(steps)
+        times = []
+        self.recs = []
+        for (fcst_flag, fcst_str, fcst_end), step in zip(segments, steps):
+            for rec_num, t in enumerate(range(fcst_str, fcst_end + 1, step)):
+                times.append(t)
+                self.recs.append((fcst_flag, rec_num))
+        # データの予報時間（昇順）
+        self.times = np.array(times)
+        self._exact = {t: i for i, t in enumerate(times)}
+        # 毎時の予報時間 -> その時間以前の最後のデータの番号
+        self._floor = np.searchsorted(
+            self.times, np.arange(times[-1] + 1), side="right") - 1
+        # 区分名 -> 区分の開始時間
+        self._fcst_str = {s[0]: s[1] for s in segments}
+
+    def __contains__(self, fcst_time):
+        """予報時間fcst_timeのデータがあるかどうか"""
+        return fcst_time in self._exact
+
+    def _check(self, fcst_time):
+        """予報時間が範囲内の整数かを確認する"""
+        if fcst_time != int(fcst_time) or not (0 <= fcst_time <=
+                                               self.times[-1]):
+            raise ValueError("fcst_time out of range: " + str(fcst_time))
+        return int(fcst_time)
+
+    def lookup(self, fcst_time):
+        """予報時間fcst_timeの区分名、データ番号を返す
+
+        データの無い予報時間の場合はValueErrorを発生させる
+        """
+        i = self._exact.get(fcst_time)
+        if i is None:
+            raise ValueError("no record for fcst_time " + str(fcst_time))
+        return self.recs[i]
+
+    def floor(self, fcst_time):
+        """予報時間fcst_time以前の最後のデータの区分名、データ番号を返す"""
+        return self.recs[self._floor[self._check(fcst_time)]]
+
+    def previous(self, fcst_time):
+        """予報時間fcst_time以前の最後のデータの、1つ前のデータを返す
+
+        区分の最初のデータの場合は、前の区分の最後のデータになる
+
+        Returns:
+        ----------
+        tuple(int, str, int) or None
+            予報時間、区分名、データ番号（最初のデータの場合はNone）
+        ----------
+        """
+        i = self._floor[self._check(fcst_time)] - 1
+        if i < 0:
+            return None
+        return (int(self.times[i]), ) + self.recs[i]
+
+    def weights(self, fcst_times):
+        """予報時間の前後のデータの番号と、時間内挿の重みを返す
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間
+        ----------
+        Returns:
+        ----------
+        i0, i1: ndarray(int)
+            前後のデータの番号（timesの順、データがある時間は同じ番号）
+        w: ndarray(float)
+            後のデータの重み（前のデータの重みは1 - w）
+        ----------
+        """
+        times = self.times
+        fcst_times = np.asarray(fcst_times, dtype=np.float64)
+        if np.any(fcst_times < times[0]) or np.any(fcst_times > times[-1]):
+            raise ValueError("fcst_time out of range: " + str(fcst_times))
+        i0 = np.searchsorted(times, fcst_times, side="right") - 1
+        i1 = np.minimum(i0 + 1, len(times) - 1)
+        dt = times[i1] - times[i0]
+        w = np.where(dt > 0, (fcst_times - times[i0]) / np.maximum(dt, 1),
+                     0.0)
+        i1 = np.where(w > 0, i1, i0)
+        return i0, i1, w
+
+    def group(self, fcst_times):
+        """予報時間を区分毎にまとめる
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間（データの無い予報時間の場合はValueErrorを発生させる）
+        ----------
+        Returns:
+        ----------
+        list((str, int, list(int, ...), list(int, ...)), ...)
+            区分名、区分の開始時間、データ番号（昇順）、予報時間のリスト
+            （区分の順）
+        ----------
+        """
+        groups = dict()
+        for t in sorted(set(int(t) for t in fcst_times)):
+            fcst_flag, rec_num = self.lookup(t)
+            g = groups.setdefault(fcst_flag, ([], []))
+            g[0].append(rec_num)
+            g[1].append(t)
+        return [(fcst_flag, self._fcst_str[fcst_flag], rec_nums, times)
+                for fcst_flag, (rec_nums, times) in groups.items()]
+
+    def split(self, fcst_times):
+        """予報時間を、その時間以前の最後のデータの区分毎に分ける
+
+        Parameters:
+        ----------
+        fcst_times: list(int, ...) or ndarray
+            予報時間（データの無い予報時間を含んでもよい）
+        ----------
+        Returns:
+        ----------
+        list(list(int, ...), ...)
+            区分毎の予報時間のリスト（区分の順、区分内は予報時間の順）
+        ----------
+        """
+        groups = dict()
+        for t in sorted(set(int(t) for t in fcst_times)):
+            groups.setdefault(self.floor(t)[0], []).append(t)
+        return list(groups.values())
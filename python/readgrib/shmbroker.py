@@ -0,0 +1,328 @@
+#
+#  NetCDFファイルから取り出した2次元データを共有メモリに置き、
+#  複数の作図プロセスで共有する
+#
+import os
+import json
+import threading
+import numpy as np
+import netCDF4
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+# 作図プロセスが読む記述子のファイル（FieldBrokerが書き出す）
+index_file = os.environ.get('SHMFIELDS_GPV')
+
+# 作図プロセスで開いている共有メモリ
+#   (NetCDFファイル名, 変数名, レコード番号): (記述子, データ, 共有メモリ)
+_attached = dict()
+_index_mtime = None
+_index = dict()
+
+
+def _ret_key(desc):
+    """記述子のキー（NetCDFファイル名, 変数名, レコード番号）を返す"""
+    return (desc["file"], desc["var"], desc["rec"])
+
+
+def _open_shm(name, untrack):
+    """名前nameの共有メモリを開く
+
+    untrack=Trueの場合は、このプロセスの終了時に共有メモリが削除されないように、
+    resource_trackerの管理から外す（削除はFieldBrokerが行う）
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=not untrack)
+    except TypeError:  # Python 3.12以前
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def attach(desc, untrack=False):
+    """記述子descの共有メモリを開き、コピーせずに2次元データを返す
+
+    Parameters:
+    ----------
+    desc: dict
+        FieldBrokerが返す記述子（name、shape、dtype、mask）
+    untrack: bool
+        FieldBrokerと別に起動したプロセス（subprocess）から開く場合はTrue
+        （multiprocessingの子プロセスから開く場合はFalse）
+    ----------
+    Returns:
+    ----------
+    d: numpy.ndarray or numpy.ma.MaskedArray
+        2次元データ（読み込み専用）
+    ----------
+    """
+    key = _ret_key(desc)
+    if key in _attached and _attached[key][0]["name"] == desc["name"]:
+        return _attached[key][1]
+    shms = [_open_shm(desc["name"], untrack)]
+    d = np.ndarray(desc["shape"], dtype=desc["dtype"], buffer=shms[0].buf)
+    d.flags.writeable = False
+    if desc["mask"] is not None:
+        shms.append(_open_shm(desc["mask"], untrack))
+        mask = np.ndarray(desc["shape"], dtype=bool, buffer=shms[1].buf)
+        mask.flags.writeable = False
+        d = np.ma.masked_array(d, mask=mask)
+    _attached[key] = (desc, d, shms)
+    return d
+
+
+def _load_index():
+    """記述子のファイルが更新されていれば読み直す"""
+    global _index_mtime, _index
+    try:
+        mtime = os.stat(index_file).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if mtime == _index_mtime:
+        return
+    with open(index_file, 'rt') as fin:
+        descs = json.load(fin)
+    _index = {_ret_key(desc): desc for desc in descs}
+    _index_mtime = mtime
+
+
+def ret_shared(file_dir_name, var_name, rec_num):
+    """SHMFIELDS_GPVの記述子から共有メモリの2次元データを返す
+
+    Parameters:
+    ----------
+    file_dir_name: str
+        NetCDFファイル名
+    var_name: str
+        変数名
+    rec_num: int
+        レコード番号
+    ----------
+    Returns:
+    ----------
+    d: numpy.ndarray or numpy.ma.MaskedArray
+        2次元データ（共有メモリに無い場合はNone）
+    ----------
+    """
+    if index_file is None:
+        return None
+    _load_index()
+    desc = _index.get((os.path.basename(file_dir_name), var_name, rec_num))
+    if desc is None:
+        return None
+    try:
+        return attach(desc, untrack=True)
+    except FileNotFoundError:  # 初期時刻の終了で削除された
+        return None
+
+
+class FieldBroker():
+    """NetCDFファイルの変数・レコード毎の2次元データを共有メモリに置く
+
+    2次元データは1回だけ読み込み、作図プロセスには記述子（共有メモリ名、
+    形状、型）を渡す。作図プロセスはattach、またはSHMFIELDS_GPVに書き出した
+    記述子から読み込む（readgrib.ReadMSM、ReadGSMのret_varは自動的に使う）。
+    acquire、releaseで参照数を数え、end_cycleで初期時刻の終了を伝えると、
+    参照されていない共有メモリを削除する
+    """
+
+    def __init__(self, index_file=None):
+        """設定
+
+        Parameters:
+        ----------
+        index_file: str
+            記述子を書き出すファイル（Noneの場合は書き出さない）
+        ----------
+        """
+        self.index_file = index_file
+        # (NetCDFファイル名, 変数名, レコード番号): (初期時刻, 記述子, 共有メモリ)
+        self._fields = dict()
+        # (初期時刻, データセット, 面, 区分名): 記述子のリスト
+        self._segments = dict()
+        self._refs = dict()
+        self._ended = set()
+        self._lock = threading.Lock()
+
+    def _create(self, d):
+        """2次元データを共有メモリに置き、記述子と共有メモリのリストを返す"""
+        mask = np.ma.getmaskarray(d)
+        data = np.ascontiguousarray(np.ma.getdata(d))
+        shms = [shared_memory.SharedMemory(create=True, size=data.nbytes)]
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shms[0].buf)[:] = data
+        desc = {
+            "name": shms[0].name,
+            "shape": list(data.shape),
+            "dtype": data.dtype.str,
+            "mask": None
+        }
+        if mask.any():
+            shms.append(shared_memory.SharedMemory(create=True,
+                                                   size=mask.nbytes))
+            np.ndarray(mask.shape, dtype=bool, buffer=shms[1].buf)[:] = mask
+            desc["mask"] = shms[1].name
+        return desc, shms
+
+    def share_file(self, tsel, file_dir_name, var_names):
+        """NetCDFファイルの変数を、レコード毎に共有メモリに置く
+
+        Parameters:
+        ----------
+        tsel: str
+            初期時刻（形式：20210819120000）
+        file_dir_name: str
+            NetCDFファイル名
+        var_names: list(str, ...)
+            変数名（ファイルに無い変数は警告を出して共有しない、
+            作図プログラムはファイルから読み込む）
+        ----------
+        Returns:
+        ----------
+        list(dict, ...)
+            記述子のリスト
+        ----------
+        """
+        file_name = os.path.basename(file_dir_name)
+        descs = []
+        with netCDF4.Dataset(file_dir_name, 'r') as nc:
+            num_rec = len(nc.dimensions['time'])
+            for var_name in var_names:
+                if var_name not in nc.variables:
+                    print("share: unknown variable", var_name, "in",
+                          file_name)
+                    continue
+                for rec_num in range(num_rec):
+                    key = (file_name, var_name, rec_num)
+                    with self._lock:
+                        if key in self._fields:
+                            descs.append(self._fields[key][1])
+                            continue
+                    desc, shms = self._create(nc.variables[var_name][rec_num])
+                    desc.update(file=file_name, var=var_name, rec=rec_num)
+                    with self._lock:
+                        self._fields[key] = (tsel, desc, shms)
+                    descs.append(desc)
+        self._write_index()
+        return descs
+
+    def share_segment(self, tsel, dset, lev, fcst_flag, var_names,
+                      in_dir="retrieve"):
+        """予報時間の区分のNetCDFファイルの変数を共有メモリに置く
+
+        Parameters:
+        ----------
+        tsel: str
+            初期時刻（形式：20210819120000）
+        dset: str
+            GSMかMSMを指定する
+        lev: str
+            <surf/plev>：surfなら表面データ、plevなら気圧面データ
+        fcst_flag: str
+            予報時間の区分名（例：00-15）
+        var_names: list(str, ...)
+            変数名
+        in_dir: str
+            入力ディレクトリ、またはretrieve、force_retrieve
+        ----------
+        Returns:
+        ----------
+        list(dict, ...)
+            記述子のリスト
+        ----------
+        """
+        from . import fetch_segment
+        from . import ret_file_names
+        seg = (tsel, dset, lev, fcst_flag)
+        with self._lock:
+            if seg in self._segments:
+                return self._segments[seg]
+        if in_dir in ("retrieve", "force_retrieve"):
+            # 取得済みのファイルを使う
+            file_dir_name = fetch_segment(tsel, dset, lev, fcst_flag)
+        else:
+            _, file_name_nc = ret_file_names(tsel, dset, lev, fcst_flag)
+            file_dir_name = os.path.join(in_dir, file_name_nc)
+        descs = self.share_file(tsel, file_dir_name, var_names)
+        with self._lock:
+            self._segments[seg] = descs
+        return descs
+
+    def segment_descs(self, tsel, dset, lev, fcst_flag):
+        """share_segmentで共有メモリに置いた区分の記述子のリストを返す"""
+        with self._lock:
+            return self._segments.get((tsel, dset, lev, fcst_flag), [])
+
+    def acquire(self, descs):
+        """記述子descsの共有メモリの参照数を増やす"""
+        with self._lock:
+            for desc in descs:
+                key = _ret_key(desc)
+                self._refs[key] = self._refs.get(key, 0) + 1
+
+    def release(self, descs):
+        """記述子descsの共有メモリの参照数を減らす
+
+        終了した初期時刻の共有メモリは、参照数が0になると削除する
+        """
+        with self._lock:
+            for desc in descs:
+                key = _ret_key(desc)
+                self._refs[key] -= 1
+                if self._refs[key] == 0:
+                    del self._refs[key]
+                    if key in self._fields and self._fields[key][0] in \
+                            self._ended:
+                        self._unlink(key)
+        self._write_index()
+
+    def end_cycle(self, tsel):
+        """初期時刻tselの終了：参照されていない共有メモリを削除する"""
+        with self._lock:
+            self._ended.add(tsel)
+            for key in [k for k, v in self._fields.items() if v[0] == tsel]:
+                if key not in self._refs:
+                    self._unlink(key)
+            for seg in [seg for seg in self._segments if seg[0] == tsel]:
+                del self._segments[seg]
+        self._write_index()
+
+    def close(self):
+        """全ての共有メモリを削除する"""
+        with self._lock:
+            for key in list(self._fields):
+                self._unlink(key)
+            self._segments.clear()
+            self._refs.clear()
+        if self.index_file is not None and os.path.isfile(self.index_file):
+            os.remove(self.index_file)
+
+    def _unlink(self, key):
+        """共有メモリを削除する（_lockを取ってから呼ぶ）"""
+        _, _, shms = self._fields.pop(key)
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    def nbytes(self):
+        """共有メモリの合計サイズ（バイト）"""
+        with self._lock:
+            return sum(shm.size for _, _, shms in self._fields.values()
+                       for shm in shms)
+
+    def _write_index(self):
+        """記述子をindex_fileに書き出す（一時ファイルから置き換える）"""
+        if self.index_file is None:
+            return
+        with self._lock:
+            descs = [desc for _, desc, _ in self._fields.values()]
+            tmp_file = self.index_file + "." + str(os.getpid()) + ".tmp"
+            with open(tmp_file, 'wt') as fout:
+                json.dump(descs, fout)
+            os.replace(tmp_file, self.index_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -5,18 +5,22 @@ import math
 import sys
 from datetime import timedelta
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from jmaloc import MapRegion
 from readgrib import ReadGSM
 from utils import val2col
+from utils import shade
+from utils import savefig
+from utils import cached_contour
 from utils import convert_png2gif
+from utils import cached_basemap
+from utils import RenderCache
 from utils import parse_command
 from utils import post
 import utils.common
 
 
 def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
-            output_filename):
+            output_filename, render="contour", profile="print"):
     """作図を行う
 
     Parameters:
@@ -43,11 +47,17 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
         タイトル
     output_filename: str
         出力ファイル名
+    render: str
+        陰影の描き方（contour：contourf、raster：imshow）
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
     # MapRegion Classの初期化
     region = MapRegion(sta)
+    # 陰影に使う作図範囲の格子
+    window = region.get_slices("GSM", "surf")
     if sta == "Japan":
         opt_c1 = False
         cstp = 1
@@ -76,11 +86,11 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_axes((0.1, 0.3, 0.8, 0.6))
     # 最初の4つのパラメータは描画する範囲の指定、最後は解像度
-    m = Basemap(llcrnrlon=lon_min,
-                urcrnrlon=lon_max,
-                llcrnrlat=lat_min,
-                urcrnrlat=lat_max,
-                resolution=mres)
+    m = cached_basemap(llcrnrlon=lon_min,
+                       urcrnrlon=lon_max,
+                       llcrnrlat=lat_min,
+                       urcrnrlat=lat_max,
+                       resolution=mres)
     #
     # 緯度線、経度線を引く
     m.drawmeridians(np.arange(0, 360, lon_step),
@@ -97,13 +107,14 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
         levels1 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 2)),
                         math.ceil(mslp.max()) + 1, 1)
         # 等圧線をひく
-        cr1 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels1,
-                        colors='k',
-                        linestyles=['-', ':'],
-                        linewidths=1.2)
+        cr1 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels1,
+                             colors='k',
+                             linestyles=['-', ':'],
+                             linewidths=1.2)
         # ラベルを付ける
         cr1.clabel(cr1.levels[::cstp], fontsize=12, fmt="%d")
     else:
@@ -111,12 +122,13 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
         levels2 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 2)),
                         math.ceil(mslp.max()) + 1, 2)
         # 等圧線をひく
-        cr2 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels2,
-                        colors='k',
-                        linewidths=1.2)
+        cr2 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels2,
+                             colors='k',
+                             linewidths=1.2)
         # ラベルを付ける
         cr2.clabel(cr2.levels[::cstp], fontsize=12, fmt="%d")
     #
@@ -127,11 +139,35 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
     cmapm = plt.get_cmap('Greens')  # 中層
     cmaph = plt.get_cmap('Blues')  # 上層
     # 陰影を描く（下層雲）
-    m.contourf(lons, lats, cfrl, levels=levelsc, cmap=cmapl, alpha=0.3)
+    shade(m,
+          lons,
+          lats,
+          cfrl,
+          levelsc,
+          cmapl,
+          alpha=0.3,
+          render=render,
+          window=window)
     # 陰影を描く（中層雲）
-    m.contourf(lons, lats, cfrm, levels=levelsc, cmap=cmapm, alpha=0.3)
+    shade(m,
+          lons,
+          lats,
+          cfrm,
+          levelsc,
+          cmapm,
+          alpha=0.3,
+          render=render,
+          window=window)
     # 陰影を描く（上層雲）
-    m.contourf(lons, lats, cfrh, levels=levelsc, cmap=cmaph, alpha=0.3)
+    shade(m,
+          lons,
+          lats,
+          cfrh,
+          levelsc,
+          cmaph,
+          alpha=0.3,
+          render=render,
+          window=window)
     #
     # 海岸線を描く
     m.drawcoastlines()
@@ -162,7 +198,7 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh, title,
                  text="Low cloud cover")
     #
     # 図を保存
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile)
     plt.close()
 
 
@@ -171,7 +207,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv)
     # 予報時刻, 作図する地域の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     # 予報時刻からの経過時間（１時間毎に指定可能）
     fcst_end = args.fcst_time
@@ -185,41 +221,85 @@ if __name__ == '__main__':
     #
     # ReadGSM初期化
     gsm = ReadGSM(tsel, file_dir, "surf")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("gsm_ccover")
     #
     # fcst_timeを変えてplotmapを実行
-    output_filenames = []
-    for fcst_time in np.arange(fcst_str, fcst_end + 1, fcst_step):
-        # fcst_timeを設定
-        gsm.set_fcst_time(fcst_time)
-        # fcst時刻
-        tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
-        tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = gsm.readnetcdf()
-        # 変数取り出し
+    output_filenames = {sta: [] for sta in stas}
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    # 作図だけの場合は、fcst_startより前の予報時間は扱わない
+    if args.frames_only:
+        fcst_times = fcst_times[fcst_times >= args.fcst_start]
+    lons_1d = None
+    # 予報時間の区分（ファイル）毎に、まとめて読み込んで作図
+    for times in gsm.split_times(fcst_times):
+        # 作図する予報時間 -> 地域、出力ファイル名、キャッシュのキーのリスト
+        plots = dict()
+        for fcst_time in times:
+            hh = "{d:02d}".format(d=fcst_time)
+            # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+            input_files = gsm.ret_input_files([fcst_time])
+            for sta in stas:
+                # 出力ファイル名の設定
+                output_filename = "map_gsm_ccover_" + sta + "_" + str(
+                    hh) + ".png"
+                # 入力が変わっていなければキャッシュを使う
+                key = rcache.ret_key(input_files,
+                                     sta=sta,
+                                     render=args.render,
+                                     profile=args.profile,
+                                     fcst_time=fcst_time)
+                if not rcache.restore(key, output_filename):
+                    # fcst_startより前の予報時間は作図し直さない（キャッシュに無い図は除く）
+                    if fcst_time < args.fcst_start:
+                        continue
+                    plots.setdefault(fcst_time, []).append(
+                        (sta, output_filename, key))
+                output_filenames[sta].append(output_filename)
+        # 全ての地域の図をキャッシュから復元した場合は読み込まない
+        if not plots:
+            continue
+        read_times = sorted(plots)
+        # 緯度・経度（最初に1回だけ読み込む）
+        if lons_1d is None:
+            gsm.set_fcst_time(read_times[0])
+            lons_1d, lats_1d, lons, lats = gsm.readnetcdf()
+            gsm.close_netcdf()
+        # 変数取り出し（区分毎に1回ずつ、予報時間, 緯度, 経度の3次元データ）
         # 海面更生気圧を二次元のndarrayで取り出す
-        mslp = gsm.ret_var("PRMSL_meansealevel", fact=0.01)  # (hPa)
+        mslp_all = gsm.ret_var_times("PRMSL_meansealevel", read_times,
+                                     fact=0.01)  # (hPa)
         # 下層雲量を二次元のndarrayで取り出す
-        cfrl = gsm.ret_var("LCDC_surface")  # ()
+        cfrl_all = gsm.ret_var_times("LCDC_surface", read_times)  # ()
         # 中層雲量を二次元のndarrayで取り出す
-        cfrm = gsm.ret_var("MCDC_surface")  # ()
+        cfrm_all = gsm.ret_var_times("MCDC_surface", read_times)  # ()
         # 上層雲量を二次元のndarrayで取り出す
-        cfrh = gsm.ret_var("HCDC_surface")  # ()
-        # ファイルを閉じる
-        gsm.close_netcdf()
-        #
-        # タイトルの設定
-        title = tlab + " GSM forecast, +" + str(
-            fcst_time) + "h (" + tlab_fcst + ")"
-        # 出力ファイル名の設定
-        hh = "{d:02d}".format(d=fcst_time)
-        output_filename = "map_gsm_ccover_" + sta + "_" + str(hh) + ".png"
-        plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm, cfrh,
-                title, output_filename)
-        output_filenames.append(output_filename)
-    # pngからgifアニメーションに変換
-    convert_png2gif(input_filenames=output_filenames,
-                    delay="80",
-                    output_filename="anim_gsm_ccover_" + sta + ".gif")
-    # 後処理
-    post(output_filenames)
+        cfrh_all = gsm.ret_var_times("HCDC_surface", read_times)  # ()
+        for k, fcst_time in enumerate(read_times):
+            # 予報時間fcst_timeの2次元データ
+            mslp = mslp_all[k]
+            cfrl = cfrl_all[k]
+            cfrm = cfrm_all[k]
+            cfrh = cfrh_all[k]
+            # fcst時刻
+            tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
+            tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
+            # タイトルの設定
+            title = tlab + " GSM forecast, +" + str(
+                fcst_time) + "h (" + tlab_fcst + ")"
+            # 地域毎に作図
+            for sta, output_filename, key in plots[fcst_time]:
+                plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, cfrl, cfrm,
+                        cfrh, title, output_filename,
+                        render=args.render,
+                        profile=args.profile)
+                rcache.store(key, output_filename)
+    for sta in stas:
+        # 作図だけの場合は、gifアニメーションは別に作る（--frames_only）
+        if not args.frames_only:
+            # pngからgifアニメーションに変換
+            convert_png2gif(input_filenames=output_filenames[sta],
+                            delay="80",
+                            output_filename="anim_gsm_ccover_" + sta + ".gif")
+        # 後処理
+        post(output_filenames[sta])
@@ -4,16 +4,20 @@ import numpy as np
 import math
 import sys
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from jmaloc import MapRegion
 from readgrib import ReadGSM
 from utils import ColUtils
+from utils import shade
+from utils import savefig
+from utils import cached_contour
+from utils import cached_basemap
+from utils import RenderCache
 from utils import parse_command
 import utils.common
 
 
 def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
-            output_filename):
+            output_filename, render="contour", profile="print"):
     """作図を行う
 
     Parameters:
@@ -36,11 +40,17 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
         タイトル
     output_filename: str
         出力ファイル名
+    render: str
+        陰影の描き方（contour：contourf、raster：imshow）
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
     # MapRegion Classの初期化
     region = MapRegion(sta)
+    # 陰影に使う作図範囲の格子
+    window = region.get_slices("GSM", "surf")
     if sta == "Japan":
         opt_c1 = False
         cstp = 1
@@ -68,11 +78,11 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
     # マップを作成
     fig = plt.figure(figsize=(10, 10))
     # 最初の4つのパラメータは描画する範囲の指定、最後は解像度
-    m = Basemap(llcrnrlon=lon_min,
-                urcrnrlon=lon_max,
-                llcrnrlat=lat_min,
-                urcrnrlat=lat_max,
-                resolution=mres)
+    m = cached_basemap(llcrnrlon=lon_min,
+                       urcrnrlon=lon_max,
+                       llcrnrlat=lat_min,
+                       urcrnrlat=lat_max,
+                       resolution=mres)
     #
     # 緯度線、経度線を引く
     m.drawmeridians(np.arange(0, 360, lon_step),
@@ -89,25 +99,27 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
         # 等圧線をひく間隔(1hPaごと)をlevelsにリストとして入れる
         levels1 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 1)),
                         math.ceil(mslp.max()) + 1, 2)
-        cr1 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels1,
-                        colors='k',
-                        linestyles=['-', ':'],
-                        linewidths=1.2)
+        cr1 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels1,
+                             colors='k',
+                             linestyles=['-', ':'],
+                             linewidths=1.2)
         # ラベルを付ける
         cr1.clabel(cr1.levels[::cstp], fontsize=12, fmt="%d")
     else:
         # 等圧線をひく間隔(2hPaごと)をlevelsにリストとして入れる
         levels2 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 2)),
                         math.ceil(mslp.max()) + 1, 2)
-        cr2 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels2,
-                        colors='k',
-                        linewidths=1.2)
+        cr2 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels2,
+                             colors='k',
+                             linewidths=1.2)
         # ラベルを付ける
         cr2.clabel(cr2.levels[::cstp], fontsize=12, fmt="%d")
     #
@@ -117,7 +129,15 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
     # 降水量の陰影を付ける値をlevelsrにリストとして入れる
     levelsr = [1, 5, 10, 20, 50, 80, 100, 200, 400, 600]
     # 陰影を描く
-    cs = m.contourf(lons, lats, rain, levels=levelsr, cmap=cmap, extend='both')
+    cs = shade(m,
+               lons,
+               lats,
+               rain,
+               levelsr,
+               cmap,
+               extend='both',
+               render=render,
+               window=window)
     # カラーバーを付ける
     cbar = m.colorbar(cs, location='bottom', pad="5%")
     cbar.set_label('precipitation (mm)')
@@ -128,7 +148,7 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
     # タイトルを付ける
     plt.title(title)
     # 図を保存
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile)
     plt.close()
 
 
@@ -137,7 +157,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv)
     # 予報時刻, 作図する地域の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     # 予報時刻からの経過時間
     fcst_time = args.fcst_time
@@ -149,6 +169,26 @@ if __name__ == '__main__':
     #
     # ReadGSM初期化
     gsm = ReadGSM(tsel, file_dir, "surf")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("gsm_rain_sum")
+    # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+    input_files = gsm.ret_input_files([fcst_time])
+    plots = []
+    for sta in stas:
+        # 出力ファイル名の設定
+        output_filename = "map_gsm_rain_sum" + "0-" + str(
+            fcst_time) + "_" + sta + ".png"
+        # 入力が変わっていなければキャッシュを使う
+        key = rcache.ret_key(input_files,
+                             sta=sta,
+                             render=args.render,
+                             profile=args.profile,
+                             fcst_time=fcst_time)
+        if not rcache.restore(key, output_filename):
+            plots.append((sta, output_filename, key))
+    # 全ての地域の図をキャッシュから復元した場合は読み込まない
+    if not plots:
+        sys.exit(0)
     #
     # fcst_timeを設定
     gsm.set_fcst_time(fcst_time)
@@ -165,9 +205,10 @@ if __name__ == '__main__':
     # タイトルの設定
     title = tlab + " GSM forecast, +" + "0-" + str(
         fcst_time) + "h rain & +" + str(fcst_time) + "h SLP"
-    # 出力ファイル名の設定
-    output_filename = "map_gsm_rain_sum" + "0-" + str(
-        fcst_time) + "_" + sta + ".png"
-    # 作図
-    plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
-            output_filename)
+    # 地域毎に作図
+    for sta, output_filename, key in plots:
+        plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
+                output_filename,
+                render=args.render,
+                profile=args.profile)
+        rcache.store(key, output_filename)
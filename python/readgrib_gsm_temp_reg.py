@@ -4,18 +4,21 @@ import numpy as np
 import sys
 from datetime import timedelta
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from jmaloc import MapRegion
 from readgrib import ReadGSM
 from utils import ColUtils
+from utils import shade
+from utils import savefig
 from utils import convert_png2gif
+from utils import cached_basemap
+from utils import RenderCache
 from utils import parse_command
 from utils import post
 import utils.common
 
 
 def plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp, rh, title,
-            output_filename):
+            output_filename, render="contour", profile="print"):
     """作図を行う
     
     Parameters:
@@ -42,11 +45,17 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp, rh, title,
         タイトル
     output_filename: str
         出力ファイル名
+    render: str
+        陰影の描き方（contour：contourf、raster：imshow）
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
     # MapRegion Classの初期化
     region = MapRegion(sta)
+    # 陰影に使う作図範囲の格子
+    window = region.get_slices("GSM", "plev")
     if sta == "Japan":
         opt_c1 = False  # 1度の等温線を描かない
         opt_barbs = True  # 矢羽を描く
@@ -78,11 +87,11 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp, rh, title,
     # マップを作成
     fig = plt.figure(figsize=(10, 10))
     # 最初の4つのパラメータは描画する範囲の指定、最後は解像度
-    m = Basemap(llcrnrlon=lon_min,
-                urcrnrlon=lon_max,
-                llcrnrlat=lat_min,
-                urcrnrlat=lat_max,
-                resolution=mres)
+    m = cached_basemap(llcrnrlon=lon_min,
+                       urcrnrlon=lon_max,
+                       llcrnrlat=lat_min,
+                       urcrnrlat=lat_max,
+                       resolution=mres)
     #
     # 緯度線、経度線を引く
     m.drawmeridians(np.arange(0, 360, lon_step),
@@ -129,7 +138,15 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp, rh, title,
     cutils = ColUtils('drywet')  # 色テーブルの選択
     cmap = cutils.get_ctable(under='w')  # 色テーブルの取得
     # 陰影を描く
-    cs = m.contourf(lons, lats, rh, levels=levels_r, cmap=cmap, extend='min')
+    cs = shade(m,
+               lons,
+               lats,
+               rh,
+               levels_r,
+               cmap,
+               extend='min',
+               render=render,
+               window=window)
     # カラーバーを付ける
     cbar = m.colorbar(cs, location='bottom', pad="5%")
     cbar.set_label('RH (%)')
@@ -152,7 +169,7 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp, rh, title,
     # タイトルを付ける
     plt.title(title)
     # 図を保存
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile)
     plt.close()
 
 
@@ -161,7 +178,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv, opt_lev=True)
     # 予報時刻、作図する地域、高度の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     level = args.level
     # 予報時刻からの経過時間（3時間毎に指定可能）
@@ -176,45 +193,89 @@ if __name__ == '__main__':
     #
     # ReadGSM初期化
     gsm = ReadGSM(tsel, file_dir, "plev")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("gsm_temp")
     #
     # fcst_timeを変えてplotmapを実行
-    output_filenames = []
-    for fcst_time in np.arange(fcst_str, fcst_end + 1, fcst_step):
-        # fcst_timeを設定
-        gsm.set_fcst_time(fcst_time)
-        # fcst時刻
-        tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
-        tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = gsm.readnetcdf()
-        # 変数取り出し
+    output_filenames = {sta: [] for sta in stas}
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    # 作図だけの場合は、fcst_startより前の予報時間は扱わない
+    if args.frames_only:
+        fcst_times = fcst_times[fcst_times >= args.fcst_start]
+    lons_1d = None
+    # 予報時間の区分（ファイル）毎に、まとめて読み込んで作図
+    for times in gsm.split_times(fcst_times):
+        # 作図する予報時間 -> 地域、出力ファイル名、キャッシュのキーのリスト
+        plots = dict()
+        for fcst_time in times:
+            hh = "{d:02d}".format(d=fcst_time)
+            # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+            input_files = gsm.ret_input_files([fcst_time])
+            for sta in stas:
+                # 出力ファイル名の設定
+                output_filename = "map_gsm_temp_" + str(
+                    level) + "hPa_" + sta + "_" + str(hh) + ".png"
+                # 入力が変わっていなければキャッシュを使う
+                key = rcache.ret_key(input_files,
+                                     sta=sta,
+                                     render=args.render,
+                                     profile=args.profile,
+                                     fcst_time=fcst_time,
+                                     level=level)
+                if not rcache.restore(key, output_filename):
+                    # fcst_startより前の予報時間は作図し直さない（キャッシュに無い図は除く）
+                    if fcst_time < args.fcst_start:
+                        continue
+                    plots.setdefault(fcst_time, []).append(
+                        (sta, output_filename, key))
+                output_filenames[sta].append(output_filename)
+        # 全ての地域の図をキャッシュから復元した場合は読み込まない
+        if not plots:
+            continue
+        read_times = sorted(plots)
+        # 緯度・経度（最初に1回だけ読み込む）
+        if lons_1d is None:
+            gsm.set_fcst_time(read_times[0])
+            lons_1d, lats_1d, lons, lats = gsm.readnetcdf()
+            gsm.close_netcdf()
+        # 変数取り出し（区分毎に1回ずつ、予報時間, 緯度, 経度の3次元データ）
         # 850 hPa 東西風、南北風データを二次元のndarrayで取り出す
-        uwnd = gsm.ret_var("UGRD_" + str(level) + "mb")  # (m/s)
-        vwnd = gsm.ret_var("VGRD_" + str(level) + "mb")  # (m/s)
+        uwnd_all = gsm.ret_var_times("UGRD_" + str(level) + "mb",
+                                     read_times)  # (m/s)
+        vwnd_all = gsm.ret_var_times("VGRD_" + str(level) + "mb",
+                                     read_times)  # (m/s)
         # 850 hPa 気温データを二次元のndarrayで取り出す (K->℃)
-        tmp = gsm.ret_var("TMP_" + str(level) + "mb", offset=-273.15)  # (℃)
-        #        tmp = gsm.ret_var("TMP_850mb", offset=-273.15) # (℃)
+        tmp_all = gsm.ret_var_times("TMP_" + str(level) + "mb", read_times,
+                                    offset=-273.15)  # (℃)
         # 850 hPa 相対湿度データを二次元のndarrayで取り出す ()
-        rh = gsm.ret_var("RH_" + str(level) + "mb")  # ()
-        # ファイルを閉じる
-        gsm.close_netcdf()
-        #
-        # タイトルの設定
-        title = str(level) + "hPa " + tlab + " GSM forecast, +" + str(
-            fcst_time) + "h (" + tlab_fcst + ")"
-        #        title = tlab + " forecast, +" + str(fcst_time) + "h"
-        # 出力ファイル名の設定
-        hh = "{d:02d}".format(d=fcst_time)
-        output_filename = "map_gsm_temp_" + str(
-            level) + "hPa_" + sta + "_" + str(hh) + ".png"
-        # 作図
-        plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp, rh, title,
-                output_filename)
-        output_filenames.append(output_filename)
-    # pngからgifアニメーションに変換
-    convert_png2gif(input_filenames=output_filenames,
-                    delay="80",
-                    output_filename="anim_gsm_temp_" + str(level) + "hPa_" +
-                    sta + ".gif")
-    # 後処理
-    post(output_filenames)
+        rh_all = gsm.ret_var_times("RH_" + str(level) + "mb", read_times)  # ()
+        for k, fcst_time in enumerate(read_times):
+            # 予報時間fcst_timeの2次元データ
+            uwnd = uwnd_all[k]
+            vwnd = vwnd_all[k]
+            tmp = tmp_all[k]
+            rh = rh_all[k]
+            # fcst時刻
+            tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
+            tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
+            # タイトルの設定
+            title = str(level) + "hPa " + tlab + " GSM forecast, +" + str(
+                fcst_time) + "h (" + tlab_fcst + ")"
+            #        title = tlab + " forecast, +" + str(fcst_time) + "h"
+            # 地域毎に作図
+            for sta, output_filename, key in plots[fcst_time]:
+                plotmap(sta, lons_1d, lats_1d, lons, lats, uwnd, vwnd, tmp,
+                        rh, title, output_filename,
+                        render=args.render,
+                        profile=args.profile)
+                rcache.store(key, output_filename)
+    for sta in stas:
+        # 作図だけの場合は、gifアニメーションは別に作る（--frames_only）
+        if not args.frames_only:
+            # pngからgifアニメーションに変換
+            convert_png2gif(input_filenames=output_filenames[sta],
+                            delay="80",
+                            output_filename="anim_gsm_temp_" + str(level) +
+                            "hPa_" + sta + ".gif")
+        # 後処理
+        post(output_filenames[sta])
@@ -4,19 +4,22 @@ import numpy as np
 import sys
 from datetime import timedelta
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from jmaloc import MapRegion
 from readgrib import ReadMSM
 from utils import ColUtils
+from utils import shade
+from utils import savefig
 from utils import mktheta
 from utils import convert_png2gif
+from utils import cached_basemap
+from utils import RenderCache
 from utils import parse_command
 from utils import post
 import utils.common
 
 
 def plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50, dthdz, title,
-            output_filename):
+            output_filename, render="contour", profile="print"):
     """作図を行う
 
     Parameters:
@@ -43,11 +46,17 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50, dthdz, title,
         タイトル
     output_filename: str
         出力ファイル名
+    render: str
+        陰影の描き方（contour：contourf、raster：imshow）
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
     # MapRegion Classの初期化
     region = MapRegion(sta)
+    # 陰影に使う作図範囲の格子
+    window = region.get_slices("MSM", "plev")
     if sta == "Japan":
         cstp = 5  # 等温位線ラベルを何個飛ばしに付けるか
         mres = "l"  # 地図の解像度
@@ -73,11 +82,11 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50, dthdz, title,
     # マップを作成
     fig = plt.figure(figsize=(10, 10))
     # 最初の4つのパラメータは描画する範囲の指定、最後は解像度
-    m = Basemap(llcrnrlon=lon_min,
-                urcrnrlon=lon_max,
-                llcrnrlat=lat_min,
-                urcrnrlat=lat_max,
-                resolution=mres)
+    m = cached_basemap(llcrnrlon=lon_min,
+                       urcrnrlon=lon_max,
+                       llcrnrlat=lat_min,
+                       urcrnrlat=lat_max,
+                       resolution=mres)
     #
     # 緯度線、経度線を引く
     m.drawmeridians(np.arange(0, 360, lon_step),
@@ -129,12 +138,15 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50, dthdz, title,
     cutils = ColUtils('haxby')  # 色テーブルの選択
     cmap = cutils.get_ctable(under='purple', over='w')  # 色テーブルの取得
     # 陰影を描く
-    cs = m.contourf(lons,
-                    lats,
-                    dthdz,
-                    levels=levels_r,
-                    cmap=cmap,
-                    extend='both')
+    cs = shade(m,
+               lons,
+               lats,
+               dthdz,
+               levels_r,
+               cmap,
+               extend='both',
+               render=render,
+               window=window)
     # カラーバーを付ける
     cbar = m.colorbar(cs, location='bottom', pad="5%")
     cbar.set_label(
@@ -146,7 +158,7 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50, dthdz, title,
     # タイトルを付ける
     plt.title(title)
     # 図を保存
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile)
     plt.close()
 
 
@@ -157,7 +169,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv)
     # 予報時刻, 作図する地域の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     # 予報時刻からの経過時間、３時間毎に指定可能
     fcst_end = args.fcst_time
@@ -171,52 +183,94 @@ if __name__ == '__main__':
     #
     # ReadMSM初期化
     msm = ReadMSM(tsel, file_dir, "plev")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("msm_ept")
     #
     # fcst_timeを変えてplotmapを実行
-    output_filenames = []
-    for fcst_time in np.arange(fcst_str, fcst_end + 1, fcst_step):
-        # fcst_timeを設定
-        msm.set_fcst_time(fcst_time)
-        # fcst時刻
-        tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
-        tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = msm.readnetcdf()
-        # 変数取り出し
+    output_filenames = {sta: [] for sta in stas}
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    # 作図だけの場合は、fcst_startより前の予報時間は扱わない
+    if args.frames_only:
+        fcst_times = fcst_times[fcst_times >= args.fcst_start]
+    lons_1d = None
+    # 予報時間の区分（ファイル）毎に、まとめて読み込んで作図
+    for times in msm.split_times(fcst_times):
+        # 作図する予報時間 -> 地域、出力ファイル名、キャッシュのキーのリスト
+        plots = dict()
+        for fcst_time in times:
+            hh = "{d:02d}".format(d=fcst_time)
+            # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+            input_files = msm.ret_input_files([fcst_time])
+            for sta in stas:
+                # 出力ファイル名の設定
+                output_filename = "map_msm_ept_" + sta + "_" + str(hh) + ".png"
+                # 入力が変わっていなければキャッシュを使う
+                key = rcache.ret_key(input_files,
+                                     sta=sta,
+                                     render=args.render,
+                                     profile=args.profile,
+                                     fcst_time=fcst_time)
+                if not rcache.restore(key, output_filename):
+                    # fcst_startより前の予報時間は作図し直さない（キャッシュに無い図は除く）
+                    if fcst_time < args.fcst_start:
+                        continue
+                    plots.setdefault(fcst_time, []).append(
+                        (sta, output_filename, key))
+                output_filenames[sta].append(output_filename)
+        # 全ての地域の図をキャッシュから復元した場合は読み込まない
+        if not plots:
+            continue
+        read_times = sorted(plots)
+        # 緯度・経度（最初に1回だけ読み込む）
+        if lons_1d is None:
+            msm.set_fcst_time(read_times[0])
+            lons_1d, lats_1d, lons, lats = msm.readnetcdf()
+            msm.close_netcdf()
+        # 変数取り出し（区分毎に1回ずつ、予報時間, 緯度, 経度の3次元データ）
         # 850 hPa 気温データを二次元のndarrayで取り出す
-        t85 = msm.ret_var("TMP_850mb")  # (K)
+        t85_all = msm.ret_var_times("TMP_850mb", read_times)  # (K)
         # 500 hPa 気温データを二次元のndarrayで取り出す
-        t50 = msm.ret_var("TMP_500mb")  # (K)
+        t50_all = msm.ret_var_times("TMP_500mb", read_times)  # (K)
         # 850 hPa 相対湿度データを二次元のndarrayで取り出す
-        rh85 = msm.ret_var("RH_850mb")  # ()
+        rh85_all = msm.ret_var_times("RH_850mb", read_times)  # ()
         # 500 hPa 相対湿度データを二次元のndarrayで取り出す
-        rh50 = msm.ret_var("RH_500mb")  # ()
+        rh50_all = msm.ret_var_times("RH_500mb", read_times)  # ()
         # 500 hPa ジオポテンシャル高度データを二次元のndarrayで取り出す
-        z50 = msm.ret_var("HGT_500mb")  # (m)
-        #
-        # 850 hPaの相当温位と飽和相当温位を求める
-        the85, thes85 = mktheta(pr85, t85, rh85)
-        #
-        # 500 hPaの相当温位と飽和相当温位を求める
-        the50, thes50 = mktheta(pr50, t50, rh50)
-        #
-        # 500 hPaの飽和相当温位から850 hPaの相当温位を引いて安定度を調べる
-        dthdz = the50 - the85
-        # ファイルを閉じる
-        msm.close_netcdf()
-        #
-        # タイトルの設定
-        title = tlab + " MSM forecast, +" + str(
-            fcst_time) + "h (" + tlab_fcst + ")"
-        # 出力ファイル名の設定
-        hh = "{d:02d}".format(d=fcst_time)
-        output_filename = "map_msm_ept_" + sta + "_" + str(hh) + ".png"
-        plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50, dthdz,
-                title, output_filename)
-        output_filenames.append(output_filename)
-    # pngからgifアニメーションに変換
-    convert_png2gif(input_filenames=output_filenames,
-                    delay="80",
-                    output_filename="anim_msm_ept_" + sta + ".gif")
-    # 後処理
-    post(output_filenames)
+        z50_all = msm.ret_var_times("HGT_500mb", read_times)  # (m)
+        for k, fcst_time in enumerate(read_times):
+            # 予報時間fcst_timeの2次元データ
+            t85 = t85_all[k]
+            t50 = t50_all[k]
+            rh85 = rh85_all[k]
+            rh50 = rh50_all[k]
+            z50 = z50_all[k]
+            # 850 hPaの相当温位と飽和相当温位を求める
+            the85, thes85 = mktheta(pr85, t85, rh85)
+            #
+            # 500 hPaの相当温位と飽和相当温位を求める
+            the50, thes50 = mktheta(pr50, t50, rh50)
+            #
+            # 500 hPaの飽和相当温位から850 hPaの相当温位を引いて安定度を調べる
+            dthdz = the50 - the85
+            # fcst時刻
+            tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
+            tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
+            # タイトルの設定
+            title = tlab + " MSM forecast, +" + str(
+                fcst_time) + "h (" + tlab_fcst + ")"
+            # 地域毎に作図
+            for sta, output_filename, key in plots[fcst_time]:
+                plotmap(sta, lons_1d, lats_1d, lons, lats, z50, the85, the50,
+                        dthdz, title, output_filename,
+                        render=args.render,
+                        profile=args.profile)
+                rcache.store(key, output_filename)
+    for sta in stas:
+        # 作図だけの場合は、gifアニメーションは別に作る（--frames_only）
+        if not args.frames_only:
+            # pngからgifアニメーションに変換
+            convert_png2gif(input_filenames=output_filenames[sta],
+                            delay="80",
+                            output_filename="anim_msm_ept_" + sta + ".gif")
+        # 後処理
+        post(output_filenames[sta])
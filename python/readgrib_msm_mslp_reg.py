@@ -5,11 +5,15 @@ import math
 import sys
 from datetime import timedelta
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from jmaloc import MapRegion
 from readgrib import ReadMSM
 from utils import ColUtils
+from utils import shade
+from utils import savefig
+from utils import cached_contour
 from utils import convert_png2gif
+from utils import cached_basemap
+from utils import RenderCache
 from utils import parse_command
 from utils import post
 import utils.common
@@ -18,7 +22,7 @@ opt_stmp = False  # 等温線を引く（-2、2℃）
 
 
 def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
-            title, output_filename):
+            title, output_filename, render="contour", profile="print"):
     """作図を行う
 
     Parameters:
@@ -43,11 +47,17 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
         タイトル
     output_filename: str
         出力ファイル名
+    render: str
+        陰影の描き方（contour：contourf、raster：imshow）
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
     # MapRegion Classの初期化
     region = MapRegion(sta)
+    # 陰影に使う作図範囲の格子
+    window = region.get_slices("MSM", "surf")
     if sta == "Japan":
         opt_c1 = False  # 1hPaの等圧線を描かない
         opt_barbs = False  # 矢羽を描かない
@@ -79,11 +89,11 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
     # マップを作成
     fig = plt.figure(figsize=(10, 10))
     # 最初の4つのパラメータは描画する範囲の指定、最後は解像度
-    m = Basemap(llcrnrlon=lon_min,
-                urcrnrlon=lon_max,
-                llcrnrlat=lat_min,
-                urcrnrlat=lat_max,
-                resolution=mres)
+    m = cached_basemap(llcrnrlon=lon_min,
+                       urcrnrlon=lon_max,
+                       llcrnrlat=lat_min,
+                       urcrnrlat=lat_max,
+                       resolution=mres)
     #
     # 緯度線、経度線を引く
     m.drawmeridians(np.arange(0, 360, lon_step),
@@ -100,13 +110,14 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
         levels1 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 2)),
                         math.ceil(mslp.max()) + 1, 1)
         # 等圧線をひく
-        cr1 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels1,
-                        colors='k',
-                        linestyles=['-', ':'],
-                        linewidths=1.2)
+        cr1 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels1,
+                             colors='k',
+                             linestyles=['-', ':'],
+                             linewidths=1.2)
         # ラベルを付ける
         cr1.clabel(cr1.levels[::cstp], fontsize=12, fmt="%d")
     else:
@@ -114,34 +125,37 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
         levels2 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 2)),
                         math.ceil(mslp.max()) + 1, 2)
         # 等圧線をひく
-        cr2 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels2,
-                        colors='k',
-                        linewidths=1.2)
+        cr2 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels2,
+                             colors='k',
+                             linewidths=1.2)
         # ラベルを付ける
         cr2.clabel(cr2.levels[::cstp], fontsize=12, fmt="%d")
     #
     if opt_stmp:
         # 等温線をひく
-        cr3 = m.contour(lons,
-                        lats,
-                        tmp,
-                        levels=[2],
-                        colors='cornflowerblue',
-                        linestyles='-',
-                        linewidths=0.8)
+        cr3 = cached_contour(m,
+                             lons,
+                             lats,
+                             tmp,
+                             levels=[2],
+                             colors='cornflowerblue',
+                             linestyles='-',
+                             linewidths=0.8)
         cr3.clabel(cr3.levels[::1], fontsize=12, fmt="%d")
         #
         # 等温線をひく
-        cr4 = m.contour(lons,
-                        lats,
-                        tmp,
-                        levels=[-2],
-                        colors='blue',
-                        linestyles='-',
-                        linewidths=0.8)
+        cr4 = cached_contour(m,
+                             lons,
+                             lats,
+                             tmp,
+                             levels=[-2],
+                             colors='blue',
+                             linestyles='-',
+                             linewidths=0.8)
         # ラベルを付ける
         cr4.clabel(cr4.levels[::1], fontsize=12, fmt="%d")
     #
@@ -151,7 +165,15 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
     # 降水量の陰影を付ける値をlevelsrにリストとして入れる
     levelsr = [0.2, 1, 5, 10, 20, 50, 80, 100]
     # 陰影を描く
-    cs = m.contourf(lons, lats, rain, levels=levelsr, cmap=cmap, extend='both')
+    cs = shade(m,
+               lons,
+               lats,
+               rain,
+               levelsr,
+               cmap,
+               extend='both',
+               render=render,
+               window=window)
     # カラーバーを付ける
     cbar = m.colorbar(cs, location='bottom', pad="5%")
     cbar.set_label('precipitation (mm/hr)')
@@ -172,7 +194,7 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
     # タイトルを付ける
     plt.title(title)
     # 図を保存
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile)
     plt.close()
 
 
@@ -181,7 +203,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv)
     # 予報時刻, 作図する地域の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     # 予報時刻からの経過時間（１時間毎に指定可能）
     fcst_end = args.fcst_time
@@ -195,44 +217,91 @@ if __name__ == '__main__':
     #
     # ReadMSM初期化
     msm = ReadMSM(tsel, file_dir, "surf")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("msm_mslp")
     #
     # fcst_timeを変えてplotmapを実行
-    output_filenames = []
-    for fcst_time in np.arange(fcst_str, fcst_end + 1, fcst_step):
-        # fcst_timeを設定
-        msm.set_fcst_time(fcst_time)
-        # fcst時刻
-        tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
-        tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = msm.readnetcdf()
-        # 変数取り出し
+    output_filenames = {sta: [] for sta in stas}
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    # 作図だけの場合は、fcst_startより前の予報時間は扱わない
+    if args.frames_only:
+        fcst_times = fcst_times[fcst_times >= args.fcst_start]
+    lons_1d = None
+    # 予報時間の区分（ファイル）毎に、まとめて読み込んで作図
+    for times in msm.split_times(fcst_times):
+        # 作図する予報時間 -> 地域、出力ファイル名、キャッシュのキーのリスト
+        plots = dict()
+        for fcst_time in times:
+            hh = "{d:02d}".format(d=fcst_time)
+            # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+            input_files = msm.ret_input_files([fcst_time])
+            for sta in stas:
+                # 出力ファイル名の設定
+                output_filename = "map_msm_mslp_" + sta + "_" + str(
+                    hh) + ".png"
+                # 入力が変わっていなければキャッシュを使う
+                key = rcache.ret_key(input_files,
+                                     sta=sta,
+                                     render=args.render,
+                                     profile=args.profile,
+                                     fcst_time=fcst_time)
+                if not rcache.restore(key, output_filename):
+                    # fcst_startより前の予報時間は作図し直さない（キャッシュに無い図は除く）
+                    if fcst_time < args.fcst_start:
+                        continue
+                    plots.setdefault(fcst_time, []).append(
+                        (sta, output_filename, key))
+                output_filenames[sta].append(output_filename)
+        # 全ての地域の図をキャッシュから復元した場合は読み込まない
+        if not plots:
+            continue
+        read_times = sorted(plots)
+        # 緯度・経度（最初に1回だけ読み込む）
+        if lons_1d is None:
+            msm.set_fcst_time(read_times[0])
+            lons_1d, lats_1d, lons, lats = msm.readnetcdf()
+            msm.close_netcdf()
+        # 変数取り出し（区分毎に1回ずつ、予報時間, 緯度, 経度の3次元データ）
         # 海面更生気圧を二次元のndarrayで取り出す
-        mslp = msm.ret_var("PRMSL_meansealevel", fact=0.01)  # (hPa)
+        mslp_all = msm.ret_var_times("PRMSL_meansealevel", read_times,
+                                     fact=0.01)  # (hPa)
         # 累積降水量を二次元のndarrayで取り出す
-        rain = msm.ret_var("APCP_surface")  # (mm/h)
+        rain_all = msm.ret_var_times("APCP_surface", read_times)  # (mm/h)
         # 気温を二次元のndarrayで取り出す (K->℃)
-        tmp = msm.ret_var("TMP_1D5maboveground", offset=-273.15)  # (℃)
+        tmp_all = msm.ret_var_times("TMP_1D5maboveground", read_times,
+                                    offset=-273.15)  # (℃)
         # 東西風を二次元のndarrayで取り出す
-        uwnd = msm.ret_var("UGRD_10maboveground")  # (m/s)
+        uwnd_all = msm.ret_var_times("UGRD_10maboveground",
+                                     read_times)  # (m/s)
         # 南北風を二次元のndarrayで取り出す
-        vwnd = msm.ret_var("VGRD_10maboveground")  # (m/s)
-        # ファイルを閉じる
-        msm.close_netcdf()
-        #
-        # タイトルの設定
-        title = tlab + " MSM forecast, +" + str(
-            fcst_time) + "h (" + tlab_fcst + ")"
-        # 出力ファイル名の設定
-        hh = "{d:02d}".format(d=fcst_time)
-        output_filename = "map_msm_mslp_" + sta + "_" + str(hh) + ".png"
-        # 作図
-        plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp, uwnd, vwnd,
-                title, output_filename)
-        output_filenames.append(output_filename)
-    # pngからgifアニメーションに変換
-    convert_png2gif(input_filenames=output_filenames,
-                    delay="80",
-                    output_filename="anim_msm_mslp_" + sta + ".gif")
-    # 後処理
-    post(output_filenames)
+        vwnd_all = msm.ret_var_times("VGRD_10maboveground",
+                                     read_times)  # (m/s)
+        for k, fcst_time in enumerate(read_times):
+            # 予報時間fcst_timeの2次元データ
+            mslp = mslp_all[k]
+            rain = rain_all[k]
+            tmp = tmp_all[k]
+            uwnd = uwnd_all[k]
+            vwnd = vwnd_all[k]
+            # fcst時刻
+            tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
+            tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
+            # タイトルの設定
+            title = tlab + " MSM forecast, +" + str(
+                fcst_time) + "h (" + tlab_fcst + ")"
+            # 地域毎に作図
+            for sta, output_filename, key in plots[fcst_time]:
+                plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, tmp,
+                        uwnd, vwnd, title, output_filename,
+                        render=args.render,
+                        profile=args.profile)
+                rcache.store(key, output_filename)
+    for sta in stas:
+        # 作図だけの場合は、gifアニメーションは別に作る（--frames_only）
+        if not args.frames_only:
+            # pngからgifアニメーションに変換
+            convert_png2gif(input_filenames=output_filenames[sta],
+                            delay="80",
+                            output_filename="anim_msm_mslp_" + sta + ".gif")
+        # 後処理
+        post(output_filenames[sta])
@@ -4,16 +4,20 @@ import numpy as np
 import math
 import sys
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 from jmaloc import MapRegion
 from readgrib import ReadMSM
 from utils import ColUtils
+from utils import shade
+from utils import savefig
+from utils import cached_contour
+from utils import cached_basemap
+from utils import RenderCache
 from utils import parse_command
 import utils.common
 
 
 def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
-            output_filename):
+            output_filename, render="contour", profile="print"):
     """作図を行う
 
     Parameters:
@@ -36,11 +40,17 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
         タイトル
     output_filename: str
         出力ファイル名
+    render: str
+        陰影の描き方（contour：contourf、raster：imshow）
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
     # MapRegion Classの初期化
     region = MapRegion(sta)
+    # 陰影に使う作図範囲の格子
+    window = region.get_slices("MSM", "surf")
     if sta == "Japan":
         opt_c1 = False
         cstp = 1
@@ -68,11 +78,11 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
     # マップを作成
     fig = plt.figure(figsize=(10, 10))
     # 最初の4つのパラメータは描画する範囲の指定、最後は解像度
-    m = Basemap(llcrnrlon=lon_min,
-                urcrnrlon=lon_max,
-                llcrnrlat=lat_min,
-                urcrnrlat=lat_max,
-                resolution=mres)
+    m = cached_basemap(llcrnrlon=lon_min,
+                       urcrnrlon=lon_max,
+                       llcrnrlat=lat_min,
+                       urcrnrlat=lat_max,
+                       resolution=mres)
     #
     # 緯度線、経度線を引く
     m.drawmeridians(np.arange(0, 360, lon_step),
@@ -89,25 +99,27 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
         # 等圧線をひく間隔(1hPaごと)をlevelsにリストとして入れる
         levels1 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 1)),
                         math.ceil(mslp.max()) + 1, 2)
-        cr1 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels1,
-                        colors='k',
-                        linestyles=['-', ':'],
-                        linewidths=1.2)
+        cr1 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels1,
+                             colors='k',
+                             linestyles=['-', ':'],
+                             linewidths=1.2)
         # ラベルを付ける
         cr1.clabel(cr1.levels[::cstp], fontsize=12, fmt="%d")
     else:
         # 等圧線をひく間隔(2hPaごと)をlevelsにリストとして入れる
         levels2 = range(math.floor(mslp.min() - math.fmod(mslp.min(), 2)),
                         math.ceil(mslp.max()) + 1, 2)
-        cr2 = m.contour(lons,
-                        lats,
-                        mslp,
-                        levels=levels2,
-                        colors='k',
-                        linewidths=1.2)
+        cr2 = cached_contour(m,
+                             lons,
+                             lats,
+                             mslp,
+                             levels=levels2,
+                             colors='k',
+                             linewidths=1.2)
         # ラベルを付ける
         cr2.clabel(cr2.levels[::cstp], fontsize=12, fmt="%d")
     #
@@ -117,7 +129,15 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
     # 降水量の陰影を付ける値をlevelsrにリストとして入れる
     levelsr = [1, 5, 10, 20, 50, 80, 100, 200, 400, 600]
     # 陰影を描く
-    cs = m.contourf(lons, lats, rain, levels=levelsr, cmap=cmap, extend='both')
+    cs = shade(m,
+               lons,
+               lats,
+               rain,
+               levelsr,
+               cmap,
+               extend='both',
+               render=render,
+               window=window)
     # カラーバーを付ける
     cbar = m.colorbar(cs, location='bottom', pad="5%")
     cbar.set_label('precipitation (mm)')
@@ -128,7 +148,7 @@ def plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
     # タイトルを付ける
     plt.title(title)
     # 図を保存
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile)
     plt.close()
 
 
@@ -139,7 +159,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv)
     # 予報時刻, 作図する地域の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     # 予報時刻からの経過時間
     fcst_end = args.fcst_time
@@ -151,34 +171,49 @@ if __name__ == '__main__':
     #
     # ReadMSM初期化
     msm = ReadMSM(tsel, file_dir, "surf")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("msm_rain_sum")
+    # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+    input_files = msm.ret_input_files(np.arange(0, fcst_end + 1, 1))
+    plots = []
+    for sta in stas:
+        # 出力ファイル名の設定
+        output_filename = "map_msm_rain_sum" + "0-" + str(
+            fcst_end) + "_" + sta + ".png"
+        # 入力が変わっていなければキャッシュを使う
+        key = rcache.ret_key(input_files,
+                             sta=sta,
+                             render=args.render,
+                             profile=args.profile,
+                             fcst_time=fcst_end)
+        if not rcache.restore(key, output_filename):
+            plots.append((sta, output_filename, key))
+    # 全ての地域の図をキャッシュから復元した場合は読み込まない
+    if not plots:
+        sys.exit(0)
     #
-    # fcst_timeを変えてplotmapを実行
-    rain_add = []
-    output_filenames = []
-    for fcst_time in np.arange(0, fcst_end + 1, 1):
-        # fcst_timeを設定
-        msm.set_fcst_time(fcst_time)
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = msm.readnetcdf()
-        # 変数取り出し
-        # 海面更生気圧を二次元のndarrayで取り出す
-        mslp = msm.ret_var("PRMSL_meansealevel", fact=0.01)  # (hPa)
-        # 降水量を二次元のndarrayで取り出す
-        rain = msm.ret_var("APCP_surface")  # (mm/h)
-        rain_add.append(rain)
-        # ファイルを閉じる
-        msm.close_netcdf()
+    # 最後の予報時間のデータ
+    msm.set_fcst_time(fcst_end)
+    # NetCDFデータ読み込み
+    lons_1d, lats_1d, lons, lats = msm.readnetcdf()
+    # 変数取り出し
+    # 海面更生気圧を二次元のndarrayで取り出す
+    mslp = msm.ret_var("PRMSL_meansealevel", fact=0.01)  # (hPa)
+    # ファイルを閉じる
+    msm.close_netcdf()
     #
-    nt = len(rain_add)
-    rain_add = np.vstack(rain_add).reshape(nt, lons.shape[0], lons.shape[1])
+    # 全ての予報時間の降水量を区分毎にまとめて読み込み、足し合わせる
+    rain_add = msm.ret_var_times("APCP_surface",
+                                 np.arange(0, fcst_end + 1, 1))  # (mm/h)
     print(rain_add.shape)
     rain = rain_add.sum(axis=0)
     # タイトルの設定
     title = tlab + " MSM forecast, +" + "0-" + str(
         fcst_end) + "h rain & +" + str(fcst_end) + "h SLP"
-    # 出力ファイル名の設定
-    output_filename = "map_msm_rain_sum" + "0-" + str(
-        fcst_end) + "_" + sta + ".png"
-    # 作図
-    plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
-            output_filename)
+    # 地域毎に作図
+    for sta, output_filename, key in plots:
+        plotmap(sta, lons_1d, lats_1d, lons, lats, mslp, rain, title,
+                output_filename,
+                render=args.render,
+                profile=args.profile)
+        rcache.store(key, output_filename)
@@ -0,0 +1,153 @@
+#!/opt/local/bin/python3
+#
+#  MSMの地上データのプロダクト（mslp、stemp、ccover）をまとめて作図する
+#
+#  予報時間毎に、プロダクトが使う変数をまとめて1回だけ読み込み、
+#  地域毎の地図（utils.cached_basemap）、等圧線（utils.cached_contour）を
+#  全てのプロダクトで共有する。出力ファイルは個別の作図プログラムと同じ
+#
+import pandas as pd
+import numpy as np
+import sys
+from datetime import timedelta
+from readgrib import ReadMSM
+from utils import convert_png2gif
+from utils import RenderCache
+from utils import parse_command
+from utils import post
+import utils.common
+import readgrib_msm_mslp_reg
+import readgrib_msm_stemp_reg
+import readgrib_msm_ccover_reg
+
+# 読み込む変数
+#   名前: (NetCDFの変数名, fact, offset)
+surf_vars = {
+    "mslp": ("PRMSL_meansealevel", 0.01, 0.0),  # (hPa)
+    "rain": ("APCP_surface", 1.0, 0.0),  # (mm/h)
+    "tmp": ("TMP_1D5maboveground", 1.0, -273.15),  # (℃)
+    "uwnd": ("UGRD_10maboveground", 1.0, 0.0),  # (m/s)
+    "vwnd": ("VGRD_10maboveground", 1.0, 0.0),  # (m/s)
+    "cfrl": ("LCDC_surface", 1.0, 0.0),  # 下層雲量
+    "cfrm": ("MCDC_surface", 1.0, 0.0),  # 中層雲量
+    "cfrh": ("HCDC_surface", 1.0, 0.0),  # 上層雲量
+}
+
+# 作図するプロダクト
+#   プロダクト名: (作図プログラム, plotmapに渡す変数の名前)
+surf_products = {
+    "mslp": (readgrib_msm_mslp_reg, ["mslp", "rain", "tmp", "uwnd", "vwnd"]),
+    "stemp": (readgrib_msm_stemp_reg, ["tmp", "rain"]),
+    "ccover": (readgrib_msm_ccover_reg, ["mslp", "cfrl", "cfrm", "cfrh"]),
+}
+
+if __name__ == '__main__':
+    # オプションの読み込み
+    args = parse_command(sys.argv)
+    # 予報時刻, 作図する地域の指定
+    fcst_date = args.fcst_date
+    stas = args.stas
+    file_dir = args.input_dir
+    # 予報時刻からの経過時間（１時間毎に指定可能）
+    fcst_end = args.fcst_time
+    fcst_str = 0  # 開始時刻
+    fcst_step = 1  # 作図する間隔
+    # datetimeに変換
+    tinfo = pd.to_datetime(fcst_date)
+    #
+    tsel = tinfo.strftime("%Y%m%d%H%M%S")
+    tlab = tinfo.strftime("%m/%d %H UTC")
+    #
+    # ReadMSM初期化
+    msm = ReadMSM(tsel, file_dir, "surf")
+    # 作図結果のキャッシュ（プロダクト毎）
+    rcaches = {prod: RenderCache("msm_" + prod) for prod in surf_products}
+    #
+    # fcst_timeを変えて各プロダクトのplotmapを実行
+    output_filenames = {
+        prod: {sta: [] for sta in stas}
+        for prod in surf_products
+    }
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    # 作図だけの場合は、fcst_startより前の予報時間は扱わない
+    if args.frames_only:
+        fcst_times = fcst_times[fcst_times >= args.fcst_start]
+    lons_1d = None
+    # 予報時間の区分（ファイル）毎に、まとめて読み込んで作図
+    for times in msm.split_times(fcst_times):
+        # 作図する予報時間 -> 地域、プロダクト、出力ファイル名、キーのリスト
+        plots = dict()
+        for fcst_time in times:
+            hh = "{d:02d}".format(d=fcst_time)
+            # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+            input_files = msm.ret_input_files([fcst_time])
+            for sta in stas:
+                for prod in surf_products:
+                    # 出力ファイル名の設定
+                    output_filename = "map_msm_{}_{}_{}.png".format(
+                        prod, sta, hh)
+                    # 入力が変わっていなければキャッシュを使う
+                    key = rcaches[prod].ret_key(input_files,
+                                                sta=sta,
+                                                render=args.render,
+                                                profile=args.profile,
+                                                fcst_time=fcst_time)
+                    if not rcaches[prod].restore(key, output_filename):
+                        # fcst_startより前の予報時間は作図し直さない（キャッシュに無い図は除く）
+                        if fcst_time < args.fcst_start:
+                            continue
+                        plots.setdefault(fcst_time, []).append(
+                            (sta, prod, output_filename, key))
+                    output_filenames[prod][sta].append(output_filename)
+        # 全ての図をキャッシュから復元した場合は読み込まない
+        if not plots:
+            continue
+        read_times = sorted(plots)
+        # 緯度・経度（最初に1回だけ読み込む）
+        if lons_1d is None:
+            msm.set_fcst_time(read_times[0])
+            lons_1d, lats_1d, lons, lats = msm.readnetcdf()
+            msm.close_netcdf()
+        # 変数取り出し（作図するプロダクトの変数を区分毎に1回ずつ、
+        # 予報時間, 緯度, 経度の3次元データ）
+        names = set(name for prod_plots in plots.values()
+                    for _, prod, _, _ in prod_plots
+                    for name in surf_products[prod][1])
+        fields_all = {
+            name: msm.ret_var_times(var_name,
+                                    read_times,
+                                    fact=fact,
+                                    offset=offset)
+            for name, (var_name, fact, offset) in surf_vars.items()
+            if name in names
+        }
+        for k, fcst_time in enumerate(read_times):
+            # 予報時間fcst_timeの2次元データ
+            fields = {name: d[k] for name, d in fields_all.items()}
+            # fcst時刻
+            tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
+            tlab_fcst = tinfo_fcst.strftime("%m/%d %H UTC")
+            # タイトルの設定
+            title = tlab + " MSM forecast, +" + str(
+                fcst_time) + "h (" + tlab_fcst + ")"
+            # 地域毎に、作図するプロダクトを作図
+            for sta, prod, output_filename, key in plots[fcst_time]:
+                prog, names = surf_products[prod]
+                prog.plotmap(sta, lons_1d, lats_1d, lons, lats,
+                             *[fields[name] for name in names],
+                             title,
+                             output_filename,
+                             render=args.render,
+                             profile=args.profile)
+                rcaches[prod].store(key, output_filename)
+    for prod in surf_products:
+        for sta in stas:
+            # 作図だけの場合は、gifアニメーションは別に作る（--frames_only）
+            if not args.frames_only:
+                # pngからgifアニメーションに変換
+                convert_png2gif(input_filenames=output_filenames[prod][sta],
+                                delay="80",
+                                output_filename="anim_msm_" + prod +
+                                "_" + sta + ".gif")
+            # 後処理
+            post(output_filenames[prod][sta])
@@ -9,6 +9,8 @@ import matplotlib.ticker as mticker
 from jmaloc import AmedasStation
 from readgrib import ReadMSM
 from datetime import timedelta
+from utils import savefig
+from utils import RenderCache
 from utils import parse_command
 from utils import get_gridloc
 import utils.common
@@ -29,7 +31,7 @@ barbs_kt = True  # true: kt, false: m/s
 
 
 def plotmap(index, mslp, prep, temp, uwnd, vwnd, relh, cfrl, cfrm, cfrh, cfrt,
-            title, output_filename):
+            title, output_filename, profile="print"):
     """時系列データの作図を行う
 
     Parameters:
@@ -58,6 +60,8 @@ def plotmap(index, mslp, prep, temp, uwnd, vwnd, relh, cfrl, cfrm, cfrh, cfrt,
         タイトル
     output_filename: str
         出力ファイル名
+    profile: str
+        出力の設定（print、web、thumb、utils.output_profilesを参照）
     ----------
     """
     #
@@ -187,7 +191,7 @@ def plotmap(index, mslp, prep, temp, uwnd, vwnd, relh, cfrl, cfrm, cfrh, cfrt,
     plt.subplots_adjust(top=None, bottom=0.15, wspace=0.25, hspace=0.15)
 
     # (4) ファイルへの書き出し
-    plt.savefig(output_filename, dpi=300, bbox_inches='tight')
+    savefig(output_filename, profile=profile, opt_margins=False)
     plt.close()
 
 
@@ -196,7 +200,7 @@ if __name__ == '__main__':
     args = parse_command(sys.argv)
     # 予報時刻, 作図する地域の指定
     fcst_date = args.fcst_date
-    sta = args.sta
+    stas = args.stas
     file_dir = args.input_dir
     # 予報時刻からの経過時間（１時間毎に指定可能）
     fcst_end = args.fcst_time
@@ -210,96 +214,89 @@ if __name__ == '__main__':
     #
     # ReadMSM初期化
     msm = ReadMSM(tsel, file_dir, "surf")
+    # 作図結果のキャッシュ
+    rcache = RenderCache("msm_tvar")
+    # 作図結果のキャッシュのキー（入力ファイルは読み込まずに求める）
+    fcst_times = np.arange(fcst_str, fcst_end + 1, fcst_step)
+    input_files = msm.ret_input_files(fcst_times)
+    plots = []
+    for n, sta in enumerate(stas):
+        # 出力ファイル名の設定
+        output_filename = "map_tvar_msm_" + str(fcst_str) + "-" + str(
+            fcst_end) + "_" + sta + ".png"
+        # 入力が変わっていなければキャッシュを使う
+        key = rcache.ret_key(input_files,
+                             sta=sta,
+                             profile=args.profile,
+                             fcst_time=fcst_end)
+        if not rcache.restore(key, output_filename):
+            plots.append((n, sta, output_filename, key))
+    # 全ての地点の図をキャッシュから復元した場合は読み込まない
+    if not plots:
+        sys.exit(0)
     #
     # アメダス地点の位置を取得
     amedas = AmedasStation()
-    rlon, rlat = amedas.get_staloc(en_name=sta)
-    print(sta, ": lon, lat = ", rlon, rlat)
+    rlons = []
+    rlats = []
+    for sta in stas:
+        rlon, rlat = amedas.get_staloc(en_name=sta)
+        print(sta, ": lon, lat = ", rlon, rlat)
+        rlons.append(rlon)
+        rlats.append(rlat)
     #
     #
+    # 緯度・経度（最初の予報時間のファイルから読み込む）
+    msm.set_fcst_time(fcst_str)
+    lons_1d, lats_1d, lons, lats = msm.readnetcdf()
+    msm.close_netcdf()
+    # グリッド番号の取得
+    ilon = np.array([get_gridloc(lons_1d, rlon) for rlon in rlons])
+    ilat = np.array([get_gridloc(lats_1d, rlat) for rlat in rlats])
+    print("lon grid, lat grid, lon, lat = ", ilon, ilat,
+          np.array(lons_1d)[ilon],
+          np.array(lats_1d)[ilat])
+    #
     # 時系列データの準備
-    index_add = []
-    mslp_add = []
-    rain_add = []
-    temp_add = []
-    uwnd_add = []
-    vwnd_add = []
-    relh_add = []
-    cfrl_add = []
-    cfrm_add = []
-    cfrh_add = []
-    cfrt_add = []
-    # fcst_timeを変えてplotmapを実行
-    for fcst_time in np.arange(fcst_str, fcst_end + 1, fcst_step):
-        index_add.append(tinfo + timedelta(hours=int(1 * fcst_time)))
-        # fcst_timeを設定
-        msm.set_fcst_time(fcst_time)
-        # NetCDFデータ読み込み
-        lons_1d, lats_1d, lons, lats = msm.readnetcdf()
-        # グリッド番号の取得
-        if fcst_time == fcst_str:
-            ilon = get_gridloc(lons_1d, rlon)
-            ilat = get_gridloc(lats_1d, rlat)
-            print("lon grid, lat grid, lon, lat = ", ilon, ilat,
-                  np.array(lons_1d)[ilon],
-                  np.array(lats_1d)[ilat])
-        #
-        # 変数取り出し
-        # 海面更生気圧を二次元のndarrayで取り出す
-        mslp = msm.ret_var("PRMSL_meansealevel", fact=0.01)  # (hPa)
-        mslp_add.append(mslp[ilat, ilon])
-        # 降水量を二次元のndarrayで取り出す
-        rain = msm.ret_var("APCP_surface")  # (mm/h)
-        rain_add.append(rain[ilat, ilon])
-        # 気温を二次元のndarrayで取り出す (K->℃)
-        temp = msm.ret_var("TMP_1D5maboveground", offset=-273.15)  # (℃)
-        temp_add.append(temp[ilat, ilon])
-        # 東西風を二次元のndarrayで取り出す
-        uwnd = msm.ret_var("UGRD_10maboveground")  # (m/s)
-        uwnd_add.append(uwnd[ilat, ilon])
-        # 南北風を二次元のndarrayで取り出す
-        vwnd = msm.ret_var("VGRD_10maboveground")  # (m/s)
-        vwnd_add.append(vwnd[ilat, ilon])
-        # 相対湿度を二次元のndarrayで取り出す
-        relh = msm.ret_var("RH_1D5maboveground")  # ()
-        relh_add.append(relh[ilat, ilon])
-        # 下層雲量を二次元のndarrayで取り出す
-        cfrl = msm.ret_var("LCDC_surface")  # ()
-        cfrl_add.append(cfrl[ilat, ilon])
-        # 中層雲量を二次元のndarrayで取り出す
-        cfrm = msm.ret_var("MCDC_surface")  # ()
-        cfrm_add.append(cfrm[ilat, ilon])
-        # 上層雲量を二次元のndarrayで取り出す
-        cfrh = msm.ret_var("HCDC_surface")  # ()
-        cfrh_add.append(cfrh[ilat, ilon])
-        # 全雲量を二次元のndarrayで取り出す
-        cfrt = msm.ret_var("TCDC_surface")  # ()
-        cfrt_add.append(cfrt[ilat, ilon])
-        # ファイルを閉じる
-        msm.close_netcdf()
-        #
+    index = np.array(
+        [tinfo + timedelta(hours=int(fcst_time)) for fcst_time in fcst_times])
+    # 変数取り出し（変数毎に全ての予報時間を区分毎にまとめて読み込み、
+    # 予報時間, 地点の2次元データにする）
+    # 海面更生気圧の地点の値を取り出す
+    mslp = msm.ret_var_times("PRMSL_meansealevel", fcst_times,
+                             fact=0.01)[:, ilat, ilon]  # (hPa)
+    # 降水量の地点の値を取り出す
+    rain = msm.ret_var_times("APCP_surface",
+                             fcst_times)[:, ilat, ilon]  # (mm/h)
+    # 気温の地点の値を取り出す (K->℃)
+    temp = msm.ret_var_times("TMP_1D5maboveground", fcst_times,
+                             offset=-273.15)[:, ilat, ilon]  # (℃)
+    # 東西風の地点の値を取り出す
+    uwnd = msm.ret_var_times("UGRD_10maboveground",
+                             fcst_times)[:, ilat, ilon]  # (m/s)
+    # 南北風の地点の値を取り出す
+    vwnd = msm.ret_var_times("VGRD_10maboveground",
+                             fcst_times)[:, ilat, ilon]  # (m/s)
+    # 相対湿度の地点の値を取り出す
+    relh = msm.ret_var_times("RH_1D5maboveground",
+                             fcst_times)[:, ilat, ilon]  # ()
+    # 下層雲量の地点の値を取り出す
+    cfrl = msm.ret_var_times("LCDC_surface", fcst_times)[:, ilat, ilon]  # ()
+    # 中層雲量の地点の値を取り出す
+    cfrm = msm.ret_var_times("MCDC_surface", fcst_times)[:, ilat, ilon]  # ()
+    # 上層雲量の地点の値を取り出す
+    cfrh = msm.ret_var_times("HCDC_surface", fcst_times)[:, ilat, ilon]  # ()
+    # 全雲量の地点の値を取り出す
+    cfrt = msm.ret_var_times("TCDC_surface", fcst_times)[:, ilat, ilon]  # ()
     #
     # タイトルの設定
     title = tlab + " MSM forecast, +" + str(fcst_str) + "-" + str(fcst_end)
-    #
-    # 出力ファイル名の設定
-    output_filename = "map_tvar_msm_" + str(fcst_str) + "-" + str(
-        fcst_end) + "_" + sta + ".png"
-    nt = len(index_add)
-
-    index = np.vstack(index_add).reshape(nt)
-    mslp = np.vstack(mslp_add).reshape(nt)
-    rain = np.vstack(rain_add).reshape(nt)
-    temp = np.vstack(temp_add).reshape(nt)
-    uwnd = np.vstack(uwnd_add).reshape(nt)
-    vwnd = np.vstack(vwnd_add).reshape(nt)
-    relh = np.vstack(relh_add).reshape(nt)
-    cfrl = np.vstack(cfrl_add).reshape(nt)
-    cfrm = np.vstack(cfrm_add).reshape(nt)
-    cfrh = np.vstack(cfrh_add).reshape(nt)
-    cfrt = np.vstack(cfrt_add).reshape(nt)
     print(rain.shape)
     #
-    # 作図
-    plotmap(index, mslp, rain, temp, uwnd, vwnd, relh, cfrl, cfrm, cfrh, cfrt,
-            title, output_filename)
+    # 地点毎に作図
+    for n, sta, output_filename, key in plots:
+        plotmap(index, mslp[:, n], rain[:, n], temp[:, n], uwnd[:, n],
+                vwnd[:, n], relh[:, n], cfrl[:, n], cfrm[:, n],
+                cfrh[:, n], cfrt[:, n], title, output_filename,
+                profile=args.profile)
+        rcache.store(key, output_filename)
@@ -0,0 +1,65 @@
+#
+#  python/のモジュール（readgrib、writenc、utilsなど）をimportできるようにする
+#
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 合成データの初期時刻
+tsel_test = "20220515000000"
+
+
+@pytest.fixture
+def make_segments(tmp_path):
+    """合成データのNetCDFファイル（区分毎）を作る関数を返す
+
+    変数の値は予報時間の関数の値に、格子毎に異なる値（0〜5）を足したもの
+    （3格子 x 2格子）にする。作る関数は、ファイルを置いたディレクトリを返す
+    """
+    import netCDF4
+    from readgrib import ret_file_names
+    from readgrib import segment_table
+    from readgrib import lead_time_index
+
+    def make(dset, lev, fields):
+        """区分毎のファイルを作る
+
+        Parameters:
+        ----------
+        dset: str
+            GSMかMSMを指定する
+        lev: str
+            <surf/plev>：surfなら表面データ、plevなら気圧面データ
+        fields: dict
+            変数名: 予報時間を受け取り値を返す関数
+        ----------
+        """
+        index = lead_time_index[(dset, lev)]
+        base = np.arange(6, dtype=np.float64).reshape(3, 2)
+        for fcst_flag, _, _ in segment_table[(dset, lev)]:
+            times = [
+                t for t, rec in zip(index.times, index.recs)
+                if rec[0] == fcst_flag
+            ]
+            _, file_name_nc = ret_file_names(tsel_test, dset, lev, fcst_flag)
+            with netCDF4.Dataset(os.path.join(str(tmp_path), file_name_nc),
+                                 'w') as nc:
+                nc.createDimension("time", None)
+                nc.createDimension("latitude", 3)
+                nc.createDimension("longitude", 2)
+                nc.createVariable("time", "f8", ("time", ))[:] = np.array(
+                    times) * 3600.0
+                nc.createVariable("latitude", "f8",
+                                  ("latitude", ))[:] = [30.0, 30.1, 30.2]
+                nc.createVariable("longitude", "f8",
+                                  ("longitude", ))[:] = [135.0, 135.125]
+                for var_name, func in fields.items():
+                    v = nc.createVariable(var_name, "f4",
+                                          ("time", "latitude", "longitude"))
+                    v[:] = [func(t) + base for t in times]
+        return str(tmp_path)
+
+    return make
@@ -0,0 +1,126 @@
+#
+#  ダウンロード・変換したファイルのキャッシュ（readgrib.gcache.GribCache）の
+#  テスト
+#
+import os
+import json
+import importlib
+import threading
+import pytest
+
+# readgrib.gcacheはGribCacheのインスタンスのため、モジュールはimportlibで取り出す
+gcache = importlib.import_module("readgrib.gcache")
+GribCache = gcache.GribCache
+
+# ファイルの大きさ（バイト）
+size = 1000
+
+
+def _put(cache, tsel, name="MSM_GPV_Rjp_Lsurf_FH00-15_grib2.nc"):
+    """キャッシュディレクトリにファイルを置き、ファイル名を返す"""
+    file_name = "Z__C_RJTD_" + tsel + "_" + name
+    with open(cache.path(file_name), 'wb') as fout:
+        fout.write(b"x" * size)
+    return file_name
+
+
+def _index(cache):
+    """index.jsonを読み込む"""
+    with open(cache.index_file, 'rt') as fin:
+        return json.load(fin)
+
+
+def test_evict_oldest(tmp_path):
+    """上限を超えたら最終利用時刻の古いものから削除する（最新の初期時刻は残す）"""
+    cache = GribCache(str(tmp_path), max_size=2 * size)
+    names = [
+        _put(cache, tsel)
+        for tsel in ["20220515000000", "20220515030000", "20220515060000"]
+    ]
+    for name in names:
+        cache.add(name)
+    assert not os.path.isfile(cache.path(names[0]))
+    assert os.path.isfile(cache.path(names[1]))
+    assert os.path.isfile(cache.path(names[2]))
+    assert sorted(_index(cache)["files"]) == sorted(names[1:])
+
+
+def test_pinned(tmp_path):
+    """固定した初期時刻のファイルは削除しない、解除したら削除対象になる"""
+    cache = GribCache(str(tmp_path), max_size=2 * size)
+    name0 = _put(cache, "20220515000000")
+    cache.add(name0)
+    with cache.pinned("20220515000000"):
+        for tsel in ["20220515030000", "20220515060000"]:
+            cache.add(_put(cache, tsel))
+        assert os.path.isfile(cache.path(name0))
+        assert _index(cache)["pinned"] == [["20220515000000", os.getpid()]]
+    assert _index(cache)["pinned"] == []
+    cache.add(_put(cache, "20220515090000"))
+    assert not os.path.isfile(cache.path(name0))
+
+
+def test_pinned_dead_process(tmp_path, monkeypatch):
+    """終了したプロセスの固定は無効になる"""
+    cache = GribCache(str(tmp_path), max_size=size)
+    name0 = _put(cache, "20220515000000")
+    cache.add(name0)
+    cache.pin("20220515000000")
+    monkeypatch.setattr(gcache, "_is_alive", lambda pid: False)
+    cache.add(_put(cache, "20220515030000"))
+    assert not os.path.isfile(cache.path(name0))
+    assert _index(cache)["pinned"] == []
+
+
+def test_touch_does_not_register(tmp_path):
+    """addで登録していないファイル（利用者のファイル）は登録も削除もしない"""
+    cache = GribCache(str(tmp_path), max_size=size)
+    user = _put(cache, "20220514000000")
+    cache.touch(user)
+    name = _put(cache, "20220515000000")
+    cache.add(name)
+    cache.add(_put(cache, "20220515030000"))
+    assert os.path.isfile(cache.path(user))
+    assert user not in _index(cache)["files"]
+    assert not os.path.isfile(cache.path(name))
+
+
+def test_lock_files_bounded(tmp_path):
+    """取得・変換のロックファイルはファイル毎に作らない"""
+    cache = GribCache(str(tmp_path))
+    for i in range(gcache.lock_slots * 4):
+        with cache.lock(cache.path("file{:d}.nc".format(i))):
+            pass
+    locks = os.listdir(cache.lock_dir)
+    assert 0 < len(locks) <= gcache.lock_slots
+    assert not [n for n in os.listdir(str(tmp_path)) if n.startswith(".")]
+
+
+def test_lock_exclusive(tmp_path):
+    """同じファイルのロックは同時に1つだけ取れる（スレッド間でも）"""
+    cache = GribCache(str(tmp_path))
+    path = cache.path("a.nc")
+    entered = threading.Event()
+    with cache.lock(path):
+        t = threading.Thread(target=lambda: _enter(cache, path, entered))
+        t.start()
+        assert not entered.wait(0.2)
+    t.join(5)
+    assert entered.is_set()
+
+
+def _enter(cache, path, entered):
+    """ロックを取れたらenteredを設定する"""
+    with cache.lock(path):
+        entered.set()
+
+
+@pytest.mark.parametrize("s, n", [
+    ("20G", 20 * 1024**3),
+    ("500M", 500 * 1024**2),
+    ("1000000", 1000000),
+    (None, gcache.cache_size_default),
+])
+def test_parse_size(s, n):
+    """上限サイズの文字列の変換"""
+    assert gcache._parse_size(s) == n
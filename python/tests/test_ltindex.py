@@ -0,0 +1,124 @@
+#
+#  予報時間の索引（readgrib.ltindex.LeadTimeIndex）のテスト
+#
+#  segment_table、record_step_tableの区分の境界で、区分名・データ番号、
+#  1つ前のデータ、内挿の重み、区分毎のまとめを確認する
+#
+import numpy as np
+import pytest
+from readgrib import lead_time_index
+from readgrib.ltindex import LeadTimeIndex
+
+# 区分の境界の前後のデータ
+#   (データセット, 面, 前の区分の最後の予報時間, (区分名, データ番号),
+#    次の区分の最初の予報時間, (区分名, データ番号))
+boundaries = [
+    ("MSM", "surf", 15, ("00-15", 15), 16, ("16-33", 0)),
+    ("MSM", "surf", 33, ("16-33", 17), 34, ("34-39", 0)),
+    ("MSM", "plev", 15, ("00-15", 5), 18, ("18-33", 0)),
+    ("MSM", "plev", 33, ("18-33", 5), 36, ("36-39", 0)),
+    ("GSM", "surf", 84, ("0000-0312", 84), 87, ("0315-0512", 0)),
+    ("GSM", "surf", 132, ("0315-0512", 15), 135, ("0515-1100", 0)),
+    ("GSM", "plev", 84, ("0000-0312", 28), 90, ("0318-0512", 0)),
+    ("GSM", "plev", 132, ("0318-0512", 7), 138, ("0518-1100", 0)),
+]
+
+
+@pytest.mark.parametrize("dset, lev, t0, rec0, t1, rec1", boundaries)
+def test_lookup(dset, lev, t0, rec0, t1, rec1):
+    """データのある予報時間の区分名、データ番号"""
+    index = lead_time_index[(dset, lev)]
+    assert index.lookup(t0) == rec0
+    assert index.lookup(t1) == rec1
+    assert t0 in index and t1 in index
+
+
+@pytest.mark.parametrize("dset, lev, t0, rec0, t1, rec1", boundaries)
+def test_missing_hours(dset, lev, t0, rec0, t1, rec1):
+    """区分の間のデータの無い予報時間はlookupできず、floorは前のデータ"""
+    index = lead_time_index[(dset, lev)]
+    for t in range(t0 + 1, t1):
+        assert t not in index
+        with pytest.raises(ValueError):
+            index.lookup(t)
+        assert index.floor(t) == rec0
+    assert index.floor(t0) == rec0
+    assert index.floor(t1) == rec1
+
+
+@pytest.mark.parametrize("dset, lev, t0, rec0, t1, rec1", boundaries)
+def test_previous(dset, lev, t0, rec0, t1, rec1):
+    """区分の最初のデータの1つ前は、前の区分の最後のデータ"""
+    index = lead_time_index[(dset, lev)]
+    assert index.previous(t1) == (t0, ) + rec0
+    # データの無い予報時間は、その前のデータの1つ前
+    for t in range(t0 + 1, t1):
+        assert index.previous(t) == index.previous(t0)
+    assert index.previous(t0)[0] < t0
+
+
+@pytest.mark.parametrize("dset, lev, t0, rec0, t1, rec1", boundaries)
+def test_weights(dset, lev, t0, rec0, t1, rec1):
+    """区分の間の予報時間は、前後の区分のデータから線形内挿する"""
+    index = lead_time_index[(dset, lev)]
+    fcst_times = np.arange(t0, t1 + 1)
+    i0, i1, w = index.weights(fcst_times)
+    np.testing.assert_array_equal(index.times[i0[:-1]], t0)
+    np.testing.assert_array_equal(index.times[i1[1:]], t1)
+    np.testing.assert_allclose(w[:-1], (fcst_times[:-1] - t0) / (t1 - t0))
+    # データのある予報時間は前後とも同じデータ、重みは0
+    assert i0[0] == i1[0] and w[0] == 0.0
+    assert i0[-1] == i1[-1] and w[-1] == 0.0
+    assert index.recs[i0[-1]] == rec1
+
+
+@pytest.mark.parametrize("dset, lev, t0, rec0, t1, rec1", boundaries)
+def test_group(dset, lev, t0, rec0, t1, rec1):
+    """区分を跨ぐ予報時間は区分毎にまとめる"""
+    index = lead_time_index[(dset, lev)]
+    groups = index.group([t1, t0, t0])
+    assert groups == [(rec0[0], _ret_fcst_str(index, rec0[0]), [rec0[1]],
+                       [t0]), (rec1[0], t1, [rec1[1]], [t1])]
+    # データの無い予報時間
+    with pytest.raises(ValueError):
+        index.group([t0, t0 + 1] if t0 + 1 < t1 else [t0, -1])
+
+
+def _ret_fcst_str(index, fcst_flag):
+    """区分の開始時間"""
+    return [s[1] for s in index.segments if s[0] == fcst_flag][0]
+
+
+@pytest.mark.parametrize("key", list(lead_time_index))
+def test_out_of_range(key):
+    """範囲外・整数でない予報時間"""
+    index = lead_time_index[key]
+    last = int(index.times[-1])
+    assert index.previous(0) is None
+    for t in (-1, last + 1, 1.5):
+        with pytest.raises(ValueError):
+            index.floor(t)
+        with pytest.raises(ValueError):
+            index.previous(t)
+    with pytest.raises(ValueError):
+        index.weights([last + 1])
+    with pytest.raises(ValueError):
+        index.lookup(last + 1)
+
+
+def test_invalid_table():
+    """時間間隔が合わない区分、重なる区分"""
+    with pytest.raises(ValueError):
+        LeadTimeIndex([("a", 0, 10)], [3])
+    with pytest.raises(ValueError):
+        LeadTimeIndex([("a", 0, 9), ("b", 9, 18)], [3, 3])
+    with pytest.raises(ValueError):
+        LeadTimeIndex([("a", 0, 9)], [3, 3])
+
+
+@pytest.mark.parametrize("dset, lev, t0, rec0, t1, rec1", boundaries)
+def test_split(dset, lev, t0, rec0, t1, rec1):
+    """データの無い予報時間は、その前のデータの区分に入れる"""
+    index = lead_time_index[(dset, lev)]
+    fcst_times = list(range(t1, t0 - 2, -1))
+    assert index.split(fcst_times) == [list(range(t0 - 1, t1)), [t1]]
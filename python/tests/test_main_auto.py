@@ -0,0 +1,52 @@
+#
+#  main_auto.pyの実行の確認
+#
+#  先読みの起動、作図の実行は置き換え、初期時刻を固定して作図を実行するまでを
+#  確認する
+#
+import os
+import runpy
+import subprocess
+from contextlib import contextmanager
+import readgrib
+import products
+
+main_auto = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), "main_auto.py")
+
+
+def test_main_auto(monkeypatch, tmp_path):
+    """先読みを起動し、初期時刻を固定している間に作図を実行する"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RENDER_CACHE_DIR", str(tmp_path / "render_cache"))
+    calls = []
+
+    def popen(args, **kwargs):
+        calls.append(("prefetch", args[0]))
+
+    @contextmanager
+    def pinned(tsel):
+        calls.append(("pin", tsel))
+        yield
+        calls.append(("unpin", tsel))
+
+    def run(sched):
+        calls.append(("run", len(sched.nodes)))
+        return dict()
+
+    monkeypatch.setattr(subprocess, "Popen", popen)
+    monkeypatch.setattr(readgrib.gcache, "pinned", pinned)
+    monkeypatch.setattr(products.Scheduler, "run", run)
+    # 作図するプロダクトは初期時刻（実行した時刻）によらず固定する
+    monkeypatch.setattr(products, "select_products",
+                        lambda tsel, dsets: ["msm_surf"])
+    runpy.run_path(main_auto, run_name="__main__")
+    assert [c[0] for c in calls] == ["prefetch", "pin", "run", "unpin"]
+    assert calls[0][1] == "python/prefetch_gpv.py"
+    # 作図の処理が登録されている
+    assert calls[2][1] > 0
+    # 固定した初期時刻（形式：20210819120000）
+    tsel = calls[1][1]
+    assert len(tsel) == 14 and tsel.endswith("0000")
+    assert calls[3][1] == tsel
@@ -0,0 +1,88 @@
+#
+#  main_watch.pyの確認
+#
+#  DATADIR_GPVのファイルも揃っている区分として扱うこと、作図済みの予報時間より
+#  後の区分だけを作図するコマンド（--fcst_start）を実行することを確認する
+#
+import os
+import importlib.util
+from datetime import datetime
+from contextlib import contextmanager
+import pytest
+import readgrib
+from readgrib import ret_file_names
+from readgrib import segment_table
+from conftest import tsel_test
+
+main_watch_file = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), "main_watch.py")
+
+
+@pytest.fixture
+def main_watch(monkeypatch, tmp_path):
+    """キャッシュディレクトリとDATADIR_GPVを一時ディレクトリにしたmain_watch"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(readgrib, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(readgrib, "sys_file_dir", str(tmp_path / "data"))
+    os.makedirs(readgrib.cache_dir)
+    os.makedirs(readgrib.sys_file_dir)
+    spec = importlib.util.spec_from_file_location("main_watch",
+                                                  main_watch_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # 公開済みのファイルは無い（ネットワークに接続しない）
+    monkeypatch.setattr(module, "check_available", lambda *args: False)
+    return module
+
+
+def test_ret_ready(main_watch, monkeypatch):
+    """DATADIR_GPVの変換済み・変換前のファイルも揃っている区分とする"""
+    segments = segment_table[("MSM", "surf")]
+    file_names = [
+        ret_file_names(tsel_test, "MSM", "surf", fcst_flag)
+        for fcst_flag, _, _ in segments
+    ]
+    # 先頭の区分は変換済み、次の区分は変換前のファイル
+    open(os.path.join(readgrib.sys_file_dir, file_names[0][1]), "w").close()
+    open(os.path.join(readgrib.sys_file_dir, file_names[1][0]), "w").close()
+    fetched = []
+    monkeypatch.setattr(main_watch, "fetch_segment",
+                        lambda *args: fetched.append(args[3]))
+    assert main_watch.ret_ready(tsel_test, "MSM", "surf") == segments[1][2]
+    assert fetched == [segments[1][0]]
+    assert main_watch.ret_ready(tsel_test, "MSM", "surf",
+                                opt_fetch=False) == segments[0][2]
+    # 先頭の区分がDATADIR_GPVにある初期時刻
+    now = datetime.strptime(tsel_test, "%Y%m%d%H%M%S")
+    assert main_watch.ret_latest_cycle("MSM", now, 0) == tsel_test
+
+
+def test_watch_fcst_start(main_watch, monkeypatch):
+    """作図済みの予報時間より後だけを作図するコマンドを実行する"""
+    tasks = dict()
+
+    class Scheduler:
+
+        def __init__(self, jobs):
+            pass
+
+        def add(self, key, func, args):
+            tasks[key] = args[0]
+
+        def run(self):
+            return {key: 0 for key in tasks}
+
+    monkeypatch.setattr(main_watch, "Scheduler", Scheduler)
+    monkeypatch.setattr(main_watch, "ret_ready", lambda tsel, dset, lev: 33)
+    monkeypatch.setattr(readgrib.gcache, "pinned",
+                        contextmanager(lambda tsel: (yield)))
+    state = {tsel_test + ":msm_surf": 15}
+    main_watch.watch(["MSM"], 0, state, 1, fcst_date=tsel_test)
+    args = tasks[tsel_test + ":msm_surf"]
+    assert args[args.index("--fcst_time") + 1] == "33"
+    assert args[args.index("--fcst_start") + 1] == "16"
+    # 初めて作図するプロダクトは先頭から作図する
+    args = tasks[tsel_test + ":msm_temp"]
+    assert "--fcst_start" not in args
+    assert state[tsel_test + ":msm_surf"] == 33
@@ -0,0 +1,84 @@
+#
+#  point_server.pyの確認
+#
+#  メモリマップ（FIELDSTORE_GPV）から取り出した時系列がNetCDFファイルから
+#  読み込んだ時系列と同じこと、入れ替えた古いファイルは問い合わせが終わってから
+#  閉じること、想定外のエラーは500を返すことを確認する
+#
+import json
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer
+import pytest
+import readgrib
+from readgrib import FieldStore
+from point_server import PointStore
+from point_server import PointService
+from point_server import PointHandler
+from conftest import tsel_test
+
+
+@pytest.fixture
+def in_dir(make_segments):
+    """合成データ（GSMの気温と累積降水量）を置いたディレクトリ"""
+    return make_segments("GSM", "surf", {
+        "TMP_2maboveground": lambda t: 280.0 + t,
+        "APCP_surface": lambda t: t * (t + 1)
+    })
+
+
+def test_memory_mapped(in_dir, tmp_path, monkeypatch):
+    """メモリマップから取り出した時系列はNetCDFファイルからの時系列と同じ"""
+    var_names = ["TMP_2maboveground", "APCP_surface"]
+    store = PointStore(tsel_test, "GSM", in_dir)
+    expected = store.query(135.1, 30.1, var_names)
+    store.close()
+    monkeypatch.setattr(readgrib, "fstore",
+                        FieldStore(str(tmp_path / "fstore")))
+    store = PointStore(tsel_test, "GSM", in_dir)
+    assert store.query(135.1, 30.1, var_names) == expected
+    assert sorted(store.fields) == sorted(var_names)
+    store.close()
+
+
+def test_retire(in_dir):
+    """入れ替えた古いファイルは、問い合わせが終わってから閉じる"""
+    store = PointStore(tsel_test, "GSM", in_dir)
+    assert store.acquire()
+    store.retire()
+    # 問い合わせ中は読み出せる
+    assert store.ncs
+    store.query(135.0, 30.0, ["TMP_2maboveground"])
+    store.release()
+    assert not store.ncs
+    # 入れ替え後は使えない
+    assert not store.acquire()
+
+
+def test_internal_error(monkeypatch):
+    """想定外のエラーは500を返し、サーバは動き続ける"""
+
+    def get_store(dset):
+        raise RuntimeError("broken")
+
+    service = PointService()
+    monkeypatch.setattr(service, "get_store", get_store)
+    monkeypatch.setattr(PointHandler, "service", service)
+    monkeypatch.setattr(PointHandler, "log_message", lambda *args: None)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PointHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:{}/vars".format(server.server_address[1])
+        for _ in range(2):
+            with pytest.raises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(url)
+            assert e.value.code == 500
+            assert json.loads(e.value.read()) == {
+                "error": "internal server error"
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
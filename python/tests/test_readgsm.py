@@ -0,0 +1,156 @@
+#
+#  GSMの降水量（readgrib.ReadGSM.ret_var("APCP_surface")）のテスト
+#
+#  合成データの累積降水量は予報時間tの関数cum(t)にする（区分の境界の差、
+#  データの無い予報時間の内挿を値で確認できるように、tの2次式にする）
+#
+import numpy as np
+import pytest
+import readgrib
+from readgrib import ReadGSM
+from readgrib import lead_time_index
+from conftest import tsel_test
+
+var_name = "APCP_surface"
+
+# 格子毎に足す値（conftest.make_segmentsと同じ）
+base = np.arange(6, dtype=np.float64).reshape(3, 2)
+
+
+def cum(t):
+    """予報時間tの累積降水量（格子毎の値は除く）"""
+    return t * (t + 1) / 2.0
+
+
+def _cum_interp(t):
+    """データの無い予報時間の累積降水量（前後のデータから線形内挿）"""
+    times = lead_time_index[("GSM", "surf")].times
+    t0 = times[times <= t][-1]
+    t1 = times[times >= t][0]
+    if t0 == t1:
+        return cum(t)
+    return cum(t0) + (cum(t1) - cum(t0)) * (t - t0) / (t1 - t0)
+
+
+@pytest.fixture
+def gsm(make_segments):
+    """合成データを読み込むReadGSM"""
+    return ReadGSM(tsel_test, make_segments("GSM", "surf", {var_name: cum}),
+                   "surf")
+
+
+def _ret_rain(gsm, fcst_time, **kwargs):
+    """予報時間fcst_timeの降水量を返す"""
+    gsm.set_fcst_time(fcst_time)
+    gsm.readnetcdf()
+    d = np.ma.filled(gsm.ret_var(var_name, **kwargs), np.nan)
+    gsm.close_netcdf()
+    return d
+
+
+@pytest.mark.parametrize("t0, t1", [(83, 84), (84, 87), (132, 135),
+                                    (135, 138), (1, 2)])
+def test_rain_previous_record(gsm, t0, t1):
+    """前のデータとの差（区分の最初のデータは前の区分の最後のデータとの差）"""
+    np.testing.assert_allclose(_ret_rain(gsm, t1), cum(t1) - cum(t0))
+
+
+def test_rain_first_hours(gsm):
+    """+0hは0、+1hはそのままの値"""
+    np.testing.assert_array_equal(_ret_rain(gsm, 0), 0.0)
+    np.testing.assert_allclose(_ret_rain(gsm, 1), cum(1) + base)
+
+
+@pytest.mark.parametrize("fcst_time", [85, 86, 88, 134, 263])
+def test_rain_between_records(gsm, fcst_time):
+    """データの無い予報時間は、内挿した累積降水量とその1時間前との差"""
+    np.testing.assert_allclose(
+        _ret_rain(gsm, fcst_time),
+        _cum_interp(fcst_time) - _cum_interp(fcst_time - 1))
+    d = _ret_rain(gsm, fcst_time, cum_rain=True)
+    np.testing.assert_allclose(d, _cum_interp(fcst_time) + base)
+    # ret_var_timesと同じ値
+    np.testing.assert_allclose(d, gsm.ret_var_times(var_name, [fcst_time])[0])
+
+
+@pytest.mark.parametrize("fcst_time", [2, 84, 87, 135])
+def test_cum_rain(gsm, fcst_time):
+    """データのある予報時間の累積降水量、factとoffset"""
+    np.testing.assert_allclose(_ret_rain(gsm, fcst_time, cum_rain=True),
+                               cum(fcst_time) + base)
+    np.testing.assert_allclose(
+        _ret_rain(gsm, fcst_time, cum_rain=True, fact=2.0, offset=1.0),
+        (cum(fcst_time) + base) * 2.0 + 1.0)
+
+
+def test_rain_read_once(gsm, monkeypatch):
+    """予報時間の順に読むと、各レコードの読み込みは1回になる"""
+    reads = []
+    ret_field = readgrib._ret_field
+    ret_recs = readgrib._ret_recs
+
+    def counted_field(nc, file_dir_name, var_name, rec_num):
+        reads.append((file_dir_name, rec_num))
+        return ret_field(nc, file_dir_name, var_name, rec_num)
+
+    def counted_recs(file_dir_name, var_name, rec_nums):
+        reads.extend((file_dir_name, rec_num) for rec_num in rec_nums)
+        return ret_recs(file_dir_name, var_name, rec_nums)
+
+    monkeypatch.setattr(readgrib, "_ret_field", counted_field)
+    monkeypatch.setattr(readgrib, "_ret_recs", counted_recs)
+    times = lead_time_index[("GSM", "surf")].times
+    for t in times[1:]:
+        _ret_rain(gsm, t)
+    assert len(reads) == len(times) - 1
+    assert len(set(reads)) == len(reads)
+
+
+def test_rain_not_cached_array(gsm):
+    """返した配列を変更しても、次の予報時間の降水量は変わらない"""
+    for kwargs in [dict(), dict(cum_rain=True)]:
+        gsm.set_fcst_time(1)
+        gsm.readnetcdf()
+        d = gsm.ret_var(var_name, **kwargs)
+        assert d is not gsm._cum_rec[1]
+        d[:] = -999.0
+        gsm.close_netcdf()
+        np.testing.assert_allclose(_ret_rain(gsm, 2), cum(2) - cum(1))
+
+
+def test_cum_cache_var_name(make_segments):
+    """保持しているレコードは変数毎に区別する"""
+    gsm = ReadGSM(
+        tsel_test,
+        make_segments("GSM", "surf", {
+            var_name: cum,
+            "APCP_other": lambda t: -cum(t)
+        }), "surf")
+    gsm.set_fcst_time(2)
+    gsm.readnetcdf()
+    np.testing.assert_allclose(gsm.ret_var(var_name), cum(2) - cum(1))
+    np.testing.assert_allclose(gsm._ret_cum("APCP_other", gsm.file_dir_name,
+                                            2),
+                               -cum(2) + base)
+    gsm.close_netcdf()
+
+
+@pytest.mark.parametrize("fcst_time, flags, flags_rain", [
+    (0, ["0000-0312"], ["0000-0312"]),
+    (84, ["0000-0312"], ["0000-0312"]),
+    (85, ["0000-0312", "0315-0512"], ["0000-0312", "0315-0512"]),
+    (87, ["0315-0512"], ["0000-0312", "0315-0512"]),
+    (88, ["0315-0512"], ["0315-0512"]),
+    (135, ["0515-1100"], ["0315-0512", "0515-1100"]),
+])
+def test_input_files(gsm, fcst_time, flags, flags_rain):
+    """降水量は差を取る前のデータのファイル（前の区分）も入力に含める"""
+
+    def ret_flags(var_names):
+        return [
+            f.split("_FD")[-1].replace("_grib2.nc", "")
+            for f in gsm.ret_input_files([fcst_time], var_names)
+        ]
+
+    assert ret_flags([]) == flags
+    assert ret_flags([var_name]) == flags_rain
@@ -0,0 +1,68 @@
+#
+#  作図の処理の依存関係（products.add_products）の確認
+#
+#  作図結果のキャッシュを使う場合は、アニメーションのプロダクトを区分毎の
+#  作図とアニメーションの作成に分けることを確認する
+#
+import pytest
+from products import Scheduler
+from products import add_products
+from conftest import tsel_test
+
+
+def _ret_nodes(sched, kind):
+    """種類毎の処理のキーと依存する処理のキー"""
+    return {
+        key: set(deps)
+        for key, (_, _, deps) in sched.nodes.items() if key[0] == kind
+    }
+
+
+def _fetch(fcst_flag):
+    """MSMの気圧面データの取得・変換の処理のキー"""
+    return ("fetch", tsel_test, "MSM", "plev", fcst_flag)
+
+
+def test_frames(monkeypatch, tmp_path):
+    """区分毎に作図し、全ての作図が終わってからアニメーションを作る"""
+    monkeypatch.setenv("RENDER_CACHE_DIR", str(tmp_path))
+    sched = Scheduler()
+    keys = add_products(sched, tsel_test, ["msm_temp"])
+    renders = _ret_nodes(sched, "render")
+    # データの無い予報時間は、次の区分のデータから内挿する
+    assert renders == {
+        ("render", tsel_test, "msm_temp", 0, 17):
+        {_fetch("00-15"), _fetch("18-33")},
+        ("render", tsel_test, "msm_temp", 18, 35):
+        {_fetch("00-15"), _fetch("18-33"),
+         _fetch("36-39")},
+        ("render", tsel_test, "msm_temp", 36, 36):
+        {_fetch("18-33"), _fetch("36-39")},
+    }
+    assert keys == [("animate", tsel_test, "msm_temp", 36)]
+    assert _ret_nodes(sched, "animate") == {keys[0]: set(renders)}
+    # 区分毎の作図はその区分の予報時間だけを作図し、アニメーションを作らない
+    args = sched.nodes[("render", tsel_test, "msm_temp", 18, 35)][1][0]
+    assert args[args.index("--fcst_start") + 1] == "18"
+    assert args[args.index("--fcst_time") + 1] == "35"
+    assert "--frames_only" in args
+    # アニメーションの作成は、全ての図をキャッシュから復元する
+    args = sched.nodes[keys[0]][1][0]
+    assert args[args.index("--fcst_start") + 1] == "37"
+    assert "--frames_only" not in args
+
+
+@pytest.mark.parametrize("name", ["msm_temp", "msm_rain_sum"])
+def test_single_render(monkeypatch, name):
+    """キャッシュを使わない場合と積算降水量は、1つの作図プログラムで作図する"""
+    if name == "msm_temp":
+        monkeypatch.delenv("RENDER_CACHE_DIR", raising=False)
+    else:
+        monkeypatch.setenv("RENDER_CACHE_DIR", "render_cache")
+    sched = Scheduler()
+    keys = add_products(sched, tsel_test, [name])
+    assert keys == [("render", tsel_test, name, 36)]
+    assert list(_ret_nodes(sched, "render")) == keys
+    assert not _ret_nodes(sched, "animate")
+    args = sched.nodes[keys[0]][1][0]
+    assert "--fcst_start" not in args and "--frames_only" not in args
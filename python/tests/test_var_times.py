@@ -0,0 +1,110 @@
+#
+#  複数の予報時間のデータの読み込み（ret_var_times）のテスト
+#
+#  データの無い予報時間の内挿の重み、等間隔のレコードの読み込み（スライス）、
+#  GSMの前1時間降水量がret_varと同じ値になることを確認する
+#
+import numpy as np
+import pytest
+import readgrib
+from readgrib import ReadMSM
+from readgrib import ReadGSM
+from readgrib import lead_time_index
+from conftest import tsel_test
+
+# 格子毎に足す値（conftest.make_segmentsと同じ）
+base = np.arange(6, dtype=np.float64).reshape(3, 2)
+
+
+def square(t):
+    """予報時間tの値（内挿した値と区別できるように、tの2次式にする）"""
+    return t * t
+
+
+@pytest.fixture
+def msm(make_segments):
+    """合成データ（3時間毎の気圧面データ）を読み込むReadMSM"""
+    return ReadMSM(tsel_test, make_segments("MSM", "plev",
+                                            {"TMP_850mb": square}), "plev")
+
+
+def test_interpolation_weights(msm):
+    """データの無い予報時間は前後のデータから線形内挿する（区分の境界を含む）"""
+    fcst_times = np.arange(0, 40)
+    d = msm.ret_var_times("TMP_850mb", fcst_times, fact=2.0, offset=1.0)
+    assert d.shape == (len(fcst_times), 3, 2)
+    t0 = fcst_times // 3 * 3
+    t1 = np.minimum(t0 + 3, 39)
+    w = (fcst_times - t0) / 3.0
+    expected = square(t0) * (1.0 - w) + square(t1) * w
+    np.testing.assert_allclose(
+        d, (expected[:, np.newaxis, np.newaxis] + base) * 2.0 + 1.0)
+
+
+def test_same_as_ret_var(msm):
+    """1時間毎のret_varと同じ値（データの無い予報時間を含む区分）"""
+    fcst_times = [15, 16, 17, 18]
+    d = msm.ret_var_times("TMP_850mb", fcst_times)
+    for k, t in enumerate(fcst_times):
+        msm.set_fcst_time(t)
+        msm.readnetcdf()
+        d1 = msm.ret_var("TMP_850mb")
+        np.testing.assert_array_equal(d[k], d1)
+        # データのある予報時間はファイルの型のまま（内挿で型が変わらない）
+        assert d[k].dtype == d1.dtype == np.float32
+        msm.close_netcdf()
+
+
+@pytest.mark.parametrize("rec_nums, sel", [
+    ([0, 6, 12], slice(0, 13, 6)),
+    ([3, 4, 5], slice(3, 6, 1)),
+    ([7], slice(7, 8, 1)),
+    ([0, 1, 3], [0, 1, 3]),
+])
+def test_rec_sel(rec_nums, sel):
+    """等間隔のレコードはスライスで読み込む"""
+    assert readgrib._ret_rec_sel(rec_nums) == sel
+
+
+def test_strided_read(make_segments, monkeypatch):
+    """6時間毎の予報時間は、区分毎に1回のスライスで読み込む"""
+    gsm = ReadGSM(tsel_test, make_segments("GSM", "surf",
+                                           {"TMP_2maboveground": square}),
+                  "surf")
+    sels = []
+    ret_rec_sel = readgrib._ret_rec_sel
+
+    def recorded_sel(rec_nums):
+        sels.append(ret_rec_sel(rec_nums))
+        return sels[-1]
+
+    monkeypatch.setattr(readgrib, "_ret_rec_sel", recorded_sel)
+    fcst_times = np.arange(0, 265, 6)
+    d = gsm.ret_var_times("TMP_2maboveground", fcst_times)
+    np.testing.assert_allclose(
+        d, square(fcst_times)[:, np.newaxis, np.newaxis] + base)
+    assert sels == [slice(0, 85, 6), slice(1, 16, 2), slice(1, 44, 2)]
+
+
+@pytest.fixture
+def gsm(make_segments):
+    """合成データ（累積降水量）を読み込むReadGSM"""
+    return ReadGSM(
+        tsel_test,
+        make_segments("GSM", "surf", {"APCP_surface": lambda t: t * (t + 1)}),
+        "surf")
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(fact=0.5, offset=1.0)])
+def test_gsm_rain(gsm, kwargs):
+    """cum_rain=Falseの場合は、ret_varと同じ前1時間降水量"""
+    fcst_times = np.arange(lead_time_index[("GSM", "surf")].times[-1] + 1)
+    d = gsm.ret_var_times("APCP_surface", fcst_times, cum_rain=False,
+                          **kwargs)
+    for k, t in enumerate(fcst_times):
+        gsm.set_fcst_time(t)
+        gsm.readnetcdf()
+        np.testing.assert_allclose(d[k],
+                                   gsm.ret_var("APCP_surface", **kwargs),
+                                   rtol=1e-6)
+        gsm.close_netcdf()
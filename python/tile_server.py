@@ -0,0 +1,399 @@
+#!/opt/local/bin/python3
+#
+#  MSM/GSMの降水量、海面更正気圧をXYZタイル（Web メルカトル）で返すHTTPサーバ
+#
+#  例：http://localhost:8081/tiles/rain/MSM/6/7/113/50.png
+#      （/tiles/<プロダクト>/<データセット>/<予報時間>/<z>/<x>/<y>.png）
+#
+import io
+import os
+import re
+import sys
+import math
+import shutil
+import argparse
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from readgrib import ReadMSM
+from readgrib import ReadGSM
+from readgrib import ret_latest
+from readgrib import fetch_segment
+from readgrib import lead_time_index
+from utils import ColUtils
+
+# タイルを置くディレクトリ（環境変数TILE_CACHE_DIR）
+tile_cache_dir = os.environ.get('TILE_CACHE_DIR', 'tile_cache')
+
+# タイルの大きさ（ピクセル）
+tile_size = 256
+
+# 作図できる最大のズームレベル
+zoom_max = 12
+
+# 1hPa毎の等圧線を引くズームレベル（それより小さい場合は2hPa毎）
+zoom_c1 = 7
+
+# 降水量の陰影を付ける値（readgrib_*_mslp_reg.pyと同じ）
+levelsr = [0.2, 1, 5, 10, 20, 50, 80, 100]
+
+# 予報時間の上限
+fcst_max = {"MSM": 39, "GSM": 264}
+
+# 読み込んだデータを保持する数
+field_cache_size = 16
+
+# 地球の半径（m、Web メルカトル）
+earth_radius = 6378137.0
+
+# URLの形式
+_re_path = re.compile(
+    r"^/tiles/(rain|mslp)/(MSM|GSM)/(\d+)/(\d+)/(\d+)/(\d+)\.png$")
+
+# netCDF4、Basemapのcmは複数のスレッドから同時に使えないため、読み込みを排他する
+_read_lock = threading.Lock()
+
+
+def tile_bounds(z, x, y):
+    """タイルの経度・緯度範囲を返す
+
+    Parameters:
+    ----------
+    z, x, y: int
+        ズームレベル、タイル番号
+    ----------
+    Returns:
+    ----------
+    lon_min, lon_max, lat_min, lat_max: float
+        タイルの経度・緯度範囲
+    ----------
+    """
+    n = 2**z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(
+        math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lon_min, lon_max, lat_min, lat_max
+
+
+def merc(lons, lats):
+    """経度・緯度をWeb メルカトルの座標（m）に変換する"""
+    x = earth_radius * np.radians(lons)
+    y = earth_radius * np.log(np.tan(np.pi / 4 + np.radians(lats) / 2))
+    return x, y
+
+
+def _fetch_segments(dset, tsel, in_dir, fcst_time):
+    """ret_fieldで読み込む区分のファイルを取得・変換しておく
+
+    ダウンロード・変換は時間がかかるため、_read_lockの外で呼ぶ
+    （同じファイルの取得・変換はfetch_segmentのファイルロックで排他される）
+
+    Parameters:
+    ----------
+    dset: str
+        GSMかMSMを指定する
+    tsel: str
+        初期時刻（形式：20210819120000）
+    in_dir: str
+        入力ディレクトリ、またはretrieve、force_retrieve
+    fcst_time: int
+        予報時間
+    ----------
+    Returns:
+    ----------
+    str
+        読み込みに使う入力ディレクトリ（取得した場合はretrieve）
+    ----------
+    """
+    if in_dir not in ("retrieve", "force_retrieve"):
+        return in_dir
+    index = lead_time_index[(dset, "surf")]
+    # 前後のデータ（データの無い予報時間は内挿する）の区分
+    i0, i1, _ = index.weights([fcst_time])
+    fcst_flags = {index.recs[i0[0]][0], index.recs[i1[0]][0]}
+    # GSMの降水量は1つ前のデータとの差を取る
+    prev = index.previous(fcst_time)
+    if dset == "GSM" and prev is not None:
+        fcst_flags.add(prev[1])
+    for fcst_flag in sorted(fcst_flags):
+        fetch_segment(tsel,
+                      dset,
+                      "surf",
+                      fcst_flag,
+                      force=(in_dir == "force_retrieve"))
+    return "retrieve"
+
+
+@functools.lru_cache(maxsize=field_cache_size)
+def ret_field(dset, tsel, in_dir, fcst_time):
+    """降水量、海面更正気圧の2次元データを読み込む
+
+    Parameters:
+    ----------
+    dset: str
+        GSMかMSMを指定する
+    tsel: str
+        初期時刻（形式：20210819120000）
+    in_dir: str
+        入力ディレクトリ、またはretrieve、force_retrieve
+    fcst_time: int
+        予報時間
+    ----------
+    Returns:
+    ----------
+    lons_1d, lats_1d, rain, mslp: ndarray
+        経度、緯度（1次元）、降水量（mm/h）、海面更正気圧（hPa）
+    ----------
+    """
+    in_dir = _fetch_segments(dset, tsel, in_dir, fcst_time)
+    with _read_lock:
+        if dset == "MSM":
+            reader = ReadMSM(tsel, in_dir, "surf")
+        else:
+            reader = ReadGSM(tsel, in_dir, "surf")
+        reader.set_fcst_time(fcst_time)
+        lons_1d, lats_1d, _, _ = reader.readnetcdf()
+        rain = reader.ret_var("APCP_surface")  # (mm/h)
+        mslp = reader.ret_var("PRMSL_meansealevel", fact=0.01)  # (hPa)
+        reader.close_netcdf()
+    return (np.array(lons_1d), np.array(lats_1d), np.ma.filled(rain, np.nan),
+            np.ma.filled(mslp, np.nan))
+
+
+@functools.lru_cache(maxsize=1)
+def _empty_tile():
+    """透明なタイルを返す"""
+    fig = Figure(figsize=(1, 1), dpi=tile_size)
+    fig.patch.set_alpha(0.0)
+    buf = io.BytesIO()
+    FigureCanvasAgg(fig).print_png(buf)
+    return buf.getvalue()
+
+
+def render_tile(product, lons_1d, lats_1d, rain, mslp, z, x, y):
+    """タイルを作図してPNGのバイト列を返す
+
+    等圧線のラベルはタイルの境界で重複するため付けない
+
+    Parameters:
+    ----------
+    product: str
+        rain（降水量の陰影）かmslp（等圧線）を指定する
+    lons_1d, lats_1d: ndarray
+        経度、緯度（1次元）
+    rain, mslp: ndarray
+        降水量（mm/h）、海面更正気圧（hPa）
+    z, x, y: int
+        ズームレベル、タイル番号
+    ----------
+    Returns:
+    ----------
+    bytes
+        PNGのバイト列
+    ----------
+    """
+    lon_min, lon_max, lat_min, lat_max = tile_bounds(z, x, y)
+    # タイルの範囲のデータのみ使う（1格子分の余白を付ける）
+    i0 = max(np.searchsorted(lons_1d, lon_min) - 2, 0)
+    i1 = min(np.searchsorted(lons_1d, lon_max) + 2, len(lons_1d))
+    j0 = max(np.searchsorted(lats_1d, lat_min) - 2, 0)
+    j1 = min(np.searchsorted(lats_1d, lat_max) + 2, len(lats_1d))
+    if i1 - i0 < 2 or j1 - j0 < 2:
+        return _empty_tile()
+    d = (rain if product == "rain" else mslp)[j0:j1, i0:i1]
+    # 欠損値だけの範囲は描かない
+    if np.isnan(d).all():
+        return _empty_tile()
+    xs, ys = merc(*np.meshgrid(lons_1d[i0:i1], lats_1d[j0:j1]))
+    x_min, y_min = merc(lon_min, lat_min)
+    x_max, y_max = merc(lon_max, lat_max)
+    #
+    fig = Figure(figsize=(1, 1), dpi=tile_size)
+    fig.patch.set_alpha(0.0)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+    if product == "rain":
+        # 色テーブルの設定（下限未満は透明にする）
+        with _read_lock:
+            cmap = ColUtils('s3pcpn_l').get_ctable(over='brown')
+        if np.nanmax(d) < levelsr[0]:
+            return _empty_tile()
+        ax.contourf(xs, ys, d, levels=levelsr, cmap=cmap, extend='max')
+    else:
+        step = 1 if z >= zoom_c1 else 2
+        levels = np.arange(
+            math.floor(np.nanmin(d) - math.fmod(np.nanmin(d), 2)),
+            math.ceil(np.nanmax(d)) + 1, step)
+        ax.contour(xs,
+                   ys,
+                   d,
+                   levels=levels,
+                   colors='k',
+                   linewidths=1.0 if step == 2 else 0.8)
+    buf = io.BytesIO()
+    FigureCanvasAgg(fig).print_png(buf)
+    return buf.getvalue()
+
+
+class TileService():
+    """タイルの作図とディスクキャッシュ"""
+
+    def __init__(self, in_dir="retrieve", tsel=None, cache_dir=None):
+        """設定
+
+        Parameters:
+        ----------
+        in_dir: str
+            入力ディレクトリ、またはretrieve
+        tsel: str
+            初期時刻（Noneの場合はキャッシュディレクトリにある最新の初期時刻）
+        cache_dir: str
+            タイルを置くディレクトリ（Noneの場合は環境変数TILE_CACHE_DIR）
+        ----------
+        """
+        self.in_dir = in_dir
+        self.tsel = tsel
+        self.cache_dir = tile_cache_dir if cache_dir is None else cache_dir
+        self.lock = threading.Lock()
+
+    def ret_tsel(self, dset):
+        """初期時刻を返し、それより古い初期時刻のタイルを削除する"""
+        tsel = self.tsel if self.tsel is not None else ret_latest(
+            dset, in_dir=self.in_dir)
+        if tsel is None:
+            raise FileNotFoundError("no " + dset + " data found")
+        self._invalidate(dset, tsel)
+        return tsel
+
+    def _invalidate(self, dset, tsel):
+        """古い初期時刻のタイルを削除する"""
+        top = os.path.join(self.cache_dir, dset)
+        if not os.path.isdir(top):
+            return
+        with self.lock:
+            for d in os.listdir(top):
+                if d < tsel:
+                    print("remove tiles:", dset, d)
+                    shutil.rmtree(os.path.join(top, d), ignore_errors=True)
+
+    def get_tile(self, product, dset, fcst_time, z, x, y):
+        """タイルのPNGを返す（キャッシュが無ければ作図する）
+
+        Parameters:
+        ----------
+        product: str
+            rainかmslpを指定する
+        dset: str
+            GSMかMSMを指定する
+        fcst_time: int
+            予報時間
+        z, x, y: int
+            ズームレベル、タイル番号
+        ----------
+        Returns:
+        ----------
+        bytes
+            PNGのバイト列
+        ----------
+        """
+        tsel = self.ret_tsel(dset)
+        tile_file = os.path.join(self.cache_dir, dset, tsel, product,
+                                 str(fcst_time), str(z), str(x),
+                                 str(y) + ".png")
+        if os.path.isfile(tile_file):
+            with open(tile_file, 'rb') as fin:
+                return fin.read()
+        lons_1d, lats_1d, rain, mslp = ret_field(dset, tsel, self.in_dir,
+                                                 fcst_time)
+        png = render_tile(product, lons_1d, lats_1d, rain, mslp, z, x, y)
+        # 書き込み途中のタイルを返さないように、一時ファイルから置き換える
+        os.makedirs(os.path.dirname(tile_file), exist_ok=True)
+        tmp_file = tile_file + "." + str(threading.get_ident()) + ".tmp"
+        with open(tmp_file, 'wb') as fout:
+            fout.write(png)
+        os.replace(tmp_file, tile_file)
+        return png
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    """/tiles/へのGETリクエストを処理する"""
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        m = _re_path.match(url.path)
+        if m is None:
+            self._send(404, b"not found", "text/plain")
+            return
+        product, dset = m.group(1), m.group(2)
+        fcst_time, z, x, y = [int(v) for v in m.groups()[2:]]
+        if (z > zoom_max or x >= 2**z or y >= 2**z
+                or fcst_time > fcst_max[dset]):
+            self._send(400, b"invalid tile", "text/plain")
+            return
+        try:
+            png = self.service.get_tile(product, dset, fcst_time, z, x, y)
+        except ValueError as e:
+            self._send(400, str(e).encode("utf-8"), "text/plain")
+            return
+        except OSError as e:
+            self._send(503, str(e).encode("utf-8"), "text/plain")
+            return
+        self._send(200, png, "image/png")
+
+    def _send(self, code, body, content_type):
+        """レスポンスを返す"""
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _construct_parser():
+    """オプションの読み込み"""
+    parser = argparse.ArgumentParser(
+        description='XYZ tile server for MSM/GSM data')
+    parser.add_argument('--fcst_date',
+                        type=str,
+                        help=('forecast date; yyyymmddhhMMss; if not given, '
+                              'the latest cycle in the cache is used'),
+                        metavar='<fcstdate>')
+    parser.add_argument('--input_dir',
+                        type=str,
+                        default="retrieve",
+                        help=('input directory or retrieve (default)'),
+                        metavar='<input_dir>')
+    parser.add_argument('--host',
+                        type=str,
+                        default="127.0.0.1",
+                        help=('host name (default: 127.0.0.1)'),
+                        metavar='<host>')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8081,
+                        help=('port number (default: 8081)'),
+                        metavar='<port>')
+    return parser
+
+
+if __name__ == '__main__':
+    # オプションの読み込み
+    args = _construct_parser().parse_args(sys.argv[1:])
+    TileHandler.service = TileService(args.input_dir, args.fcst_date)
+    server = ThreadingHTTPServer((args.host, args.port), TileHandler)
+    print("serving on", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
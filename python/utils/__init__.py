@@ -2,11 +2,13 @@
 #  2021/06/01 Yamashita
 #
 import os
+import re
 import subprocess
 import argparse
+import importlib
+from datetime import datetime
 import numpy as np
-from .cutil import ColUtils
-from .cbar import val2col
+from .rcache import RenderCache
 
 # ファイルが保存された入力ディレクトリのデフォルト（webから新規取得：retrieve）
 input_dir_default = "retrieve"
@@ -17,7 +19,79 @@ fcst_time_default = 36
 # 最後に変換前のpngファイルを消すかどうか
 opt_remove_png = True
 
-__all__ = ["ColUtils", "val2col"]
+# 陰影の描き方のデフォルト（contour：contourf、raster：imshow）
+render_default = os.environ.get('RENDER_MODE', 'contour')
+
+# 図の出力の設定
+#   dpi: 解像度
+#   tight: bbox_inches='tight'で余白を切り詰めるかどうか（余白を求めるため、
+#          保存時に描画が1回増える）
+#   margins: tight=Falseの場合の図の余白（fig.subplots_adjustの引数、固定）
+output_profiles = {
+    "print": {
+        "dpi": 300,
+        "tight": True
+    },
+    "web": {
+        "dpi": 100,
+        "tight": False,
+        "margins": dict(left=0.07, right=0.94, bottom=0.06, top=0.96)
+    },
+    "thumb": {
+        "dpi": 40,
+        "tight": False,
+        "margins": dict(left=0.07, right=0.94, bottom=0.06, top=0.96)
+    }
+}
+
+# 図の出力の設定のデフォルト
+profile_default = os.environ.get('OUTPUT_PROFILE', 'print')
+
+__all__ = [
+    "ColUtils", "val2col", "shade", "cached_contour", "cached_basemap",
+    "savefig", "RenderCache"
+]
+
+# 作図用のクラスは使う時に読み込む（matplotlib、Basemapの読み込みに時間がかかるため）
+_lazy_imports = {
+    "ColUtils": ".cutil",
+    "val2col": ".cbar",
+    "shade": ".raster",
+    "cached_contour": ".isoline",
+    "cached_basemap": ".mapcache",
+    "savefig": ".output"
+}
+
+
+def __getattr__(name):
+    """作図用のクラスを初めて参照した時にモジュールを読み込む"""
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name], __name__),
+                        name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
+
+
+def parse_fcst_date(fcst_date):
+    """予報時刻の文字列をdatetimeに変換する（pandas.to_datetimeの代わり）
+
+    Parameters:
+    ----------
+    fcst_date: str
+        予報時刻（形式：yyyymmddhhMMss、yyyymmddhh、2021-08-19 12:00:00など）
+    ----------
+    Returns:
+    ----------
+    datetime.datetime
+        予報時刻
+    ----------
+    """
+    digits = re.sub(r"[^0-9]", "", str(fcst_date))
+    if len(digits) < 8 or len(digits) > 14 or len(digits) % 2 != 0:
+        raise ValueError("invalid fcst_date: " + str(fcst_date))
+    return datetime.strptime(digits + "000000"[len(digits) - 8:],
+                             "%Y%m%d%H%M%S")
 
 
 def get_gridloc(loc_list, loc):
@@ -46,6 +120,28 @@ def get_gridloc(loc_list, loc):
     return iloc
 
 
+def get_gridlocs(loc_list, locs):
+    """複数の点について近傍のデータ点をまとめて取り出す
+
+    Parameters:
+    ----------
+    loc_list: list(float, float, ...) or numpy.ndarray
+        データ点のリスト
+    locs: list(float, float, ...) or numpy.ndarray
+        取り出す点のリスト
+    ----------
+    Returns:
+    ----------
+    ilocs: numpy.ndarray
+        近傍データ点のグリッド番号（get_gridlocと同じく、等距離なら前の点）
+    ----------
+    """
+    loc_list = np.asarray(loc_list, dtype=np.float64)
+    locs = np.atleast_1d(np.asarray(locs, dtype=np.float64))
+    return np.absolute(loc_list[np.newaxis, :] -
+                       locs[:, np.newaxis]).argmin(axis=1)
+
+
 #
 def mktheta(pres, tem, rh):
     """気圧、気温、相対湿度の入力から相当温位、飽和相当温位を求める
@@ -178,11 +274,24 @@ def _construct_parser(opt_sta, opt_lev, opt_dset):
         type=int,
         help=('forecast time; hour (starting from forecast date)'),
         metavar='<fcsttime>')
+    parser.add_argument(
+        '--fcst_start',
+        type=int,
+        default=0,
+        help=('first forecast hour to render; earlier frames are only '
+              'restored from RENDER_CACHE_DIR for the animation (default: 0)'),
+        metavar='<fcststart>')
+    parser.add_argument(
+        '--frames_only',
+        action='store_true',
+        help=('render frames into RENDER_CACHE_DIR without making '
+              'the animation'))
     if opt_sta:
-        parser.add_argument('--sta',
-                            type=str,
-                            help=('Station name; e.g. Japan, Tokyo,,,'),
-                            metavar='<sta>')
+        parser.add_argument(
+            '--sta',
+            type=str,
+            help=('Station name(s), comma separated; e.g. Japan,Tokyo,,,'),
+            metavar='<sta>')
     if opt_lev:
         parser.add_argument('--level',
                             type=str,
@@ -201,6 +310,20 @@ def _construct_parser(opt_sta, opt_lev, opt_dset):
          'if --input_dir force_retrieve, download original data from RISH server'
          'if --input_dir retrieve, check avilable download (default)'),
         metavar='<input_dir>')
+    parser.add_argument(
+        '--render',
+        type=str,
+        choices=['contour', 'raster'],
+        help=('shading method; contour (contourf) or raster (imshow, fast); '
+              'default: RENDER_MODE or contour'),
+        metavar='<render>')
+    parser.add_argument(
+        '--profile',
+        type=str,
+        choices=list(output_profiles),
+        help=('output profile; print (300 dpi), web (100 dpi) or '
+              'thumb (40 dpi); default: OUTPUT_PROFILE or print'),
+        metavar='<profile>')
 
     return parser
 
@@ -220,14 +343,26 @@ def parse_command(args, opt_sta=True, opt_lev=False, opt_dset=False):
     ----------
     parsed_args: argparse.ArgumentParse
         読み込んだオプションのparser
+        （opt_sta=Trueの場合、stasに地域・地点名のリストを格納）
     ----------
     """
     parser = _construct_parser(opt_sta, opt_lev, opt_dset)
     parsed_args = parser.parse_args(args[1:])
+    if opt_sta:
+        if parsed_args.sta is None:
+            parser.error("--sta is needed")
+        # カンマ区切りで複数の地域・地点を指定可能
+        parsed_args.stas = [
+            sta.strip() for sta in parsed_args.sta.split(",") if sta.strip()
+        ]
     if parsed_args.input_dir is None:
         parsed_args.input_dir = input_dir_default
     if parsed_args.fcst_time is None:
         parsed_args.fcst_time = fcst_time_default
+    if parsed_args.render is None:
+        parsed_args.render = render_default
+    if parsed_args.profile is None:
+        parsed_args.profile = profile_default
     if opt_lev:
         if parsed_args.level is None:
             parsed_args.level = 850
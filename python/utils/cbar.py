@@ -6,6 +6,10 @@ import matplotlib.ticker as ticker
 import numpy as np
 from .cutil import ColUtils
 
+# カラーバーの画像（RGBA）と目盛り線の位置・ラベルのキャッシュ
+#   (cmap, tmin, tmax, tstep, fmt, label): (画像, 目盛り線の位置, ラベル)
+_colorbar_cache = dict()
+
 
 class val2col():
     """カラーマップの設定"""
@@ -29,30 +33,40 @@ class val2col():
         self.tmax = tmax
         self.tstep = tstep
         self.cmap = cmap
-        self.cm = plt.get_cmap(self.cmap)
         try:
             self.cm = plt.get_cmap(self.cmap)
-        except:
+        except ValueError:
             cutils = ColUtils(cmap)  # 色テーブルの選択
             self.cm = cutils.get_ctable()  # 色テーブルの取得
+        # 色のテーブル（0〜N-1：色テーブルの色、N：上限を超えた場合の色、
+        # N+1：欠損値の色）
+        self.lut = np.vstack([
+            self.cm(np.arange(self.cm.N + 1)),
+            self.cm(np.nan)
+        ])
 
     def conv(self, val):
         """データをカラーに変換
 
         Parameters:
         ----------
-        val: float
+        val: float or numpy.ndarray
             データ
         ----------
         Returns:
         ----------
-        cmap
-            カラーマップ
+        tuple(float, float, float, float) or numpy.ndarray
+            RGBA（valが配列の場合は、valの形に4を付けた配列）
         ----------
         """
-        n = (val - self.tmin) / (self.tmax - self.tmin) * self.cm.N
-        n = max(min(n, self.cm.N), 0)
-        return self.cm(int(n))
+        n = (np.asarray(val, dtype=np.float64) -
+             self.tmin) / (self.tmax - self.tmin) * self.cm.N
+        idx = np.clip(np.nan_to_num(n, nan=0.), 0, self.cm.N).astype(int)
+        idx = np.where(np.isnan(n), self.cm.N + 1, idx)
+        rgba = self.lut[idx]
+        if np.ndim(val) == 0:
+            return tuple(rgba.tolist())
+        return rgba
 
     def colorbar(self,
                  fig=None,
@@ -79,17 +93,9 @@ class val2col():
         if fig is None:
             raise Exception('fig is needed')
         ax = fig.add_axes(anchor + size)
-        gradient = np.linspace(0, 1, self.cm.N)
-        gradient_array = np.vstack((gradient, gradient))
-        ticks = list()
-        labels = list()
-        ll = np.arange(self.tmin, self.tmax, self.tstep)
-        for t in ll:
-            ticks.append((t - self.tmin) / (self.tmax - self.tmin) * self.cm.N)
-            if label:
-                labels.append(fmt.format(f=t))
-        # カラーバーを描く
-        ax.imshow(gradient_array, aspect='auto', cmap=self.cm)
+        gradient_array, ticks, labels = self._ret_colorbar(fmt, label)
+        # カラーバーを描く（色を付けた画像をそのまま描く）
+        ax.imshow(gradient_array, aspect='auto')
         ax.yaxis.set_major_locator(ticker.NullLocator())
         ax.yaxis.set_minor_locator(ticker.NullLocator())
         ax.set_xticks(ticks)
@@ -100,6 +106,19 @@ class val2col():
             ax.xaxis.set_minor_formatter(ticker.NullFormatter())
         #ax.set_axis_off()
 
+    def _ret_colorbar(self, fmt, label):
+        """カラーバーの画像と目盛り線の位置・ラベルを返す（キャッシュする）"""
+        key = (self.cmap, self.tmin, self.tmax, self.tstep, fmt, label)
+        if key not in _colorbar_cache:
+            gradient = self.cm(np.linspace(0, 1, self.cm.N))
+            gradient_array = np.stack((gradient, gradient))
+            ll = np.arange(self.tmin, self.tmax, self.tstep)
+            ticks = list((ll - self.tmin) / (self.tmax - self.tmin) *
+                         self.cm.N)
+            labels = [fmt.format(f=t) for t in ll] if label else []
+            _colorbar_cache[key] = (gradient_array, ticks, labels)
+        return _colorbar_cache[key]
+
     def clabel(self,
                fig=None,
                anchor=(0.34, 0.24),
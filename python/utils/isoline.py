@@ -0,0 +1,199 @@
+#
+#  等値線の形状（等値線の値毎の線分）を1回だけ計算し、地域毎の作図で使い回す
+#
+import numpy as np
+import contourpy
+import matplotlib as mpl
+import matplotlib.contour as mcontour
+
+
+class ContourCache():
+    """データ（2次元）と等値線の値毎に、全領域の等値線の線分を保持する
+
+    同じデータで複数の地域を作図する場合、等値線の計算は最初の1回だけ行い、
+    地域毎には保持した線分を地図の範囲で切り出して描く。
+    データは同じオブジェクトかどうか（is）で区別するため、予報時間毎に
+    ret_varで取り出し直したデータは別のデータとして扱う
+    """
+
+    def __init__(self, maxsize=4):
+        """設定
+
+        Parameters:
+        ----------
+        maxsize: int
+            保持するデータの数（古いものから捨てる）
+        ----------
+        """
+        self.maxsize = maxsize
+        # [(データ, 等値線の計算器, 格子の間隔, {等値線の値: 線分のリスト}), ...]
+        self._fields = []
+
+    def _ret_entry(self, lons, lats, d):
+        """データdの保持している情報を返す（無ければ等値線の計算器を作る）"""
+        for entry in self._fields:
+            if entry[0] is d:
+                return entry
+        gen = contourpy.contour_generator(
+            lons,
+            lats,
+            np.ma.masked_invalid(d),
+            name=mpl.rcParams['contour.algorithm'],
+            corner_mask=True,
+            line_type=contourpy.LineType.SeparateCode)
+        # 格子の間隔（切り出す時の余白）
+        margin = (float(np.abs(lons[0, -1] - lons[0, 0])) /
+                  max(lons.shape[1] - 1, 1),
+                  float(np.abs(lats[-1, 0] - lats[0, 0])) /
+                  max(lats.shape[0] - 1, 1))
+        entry = (d, gen, margin, dict())
+        self._fields.insert(0, entry)
+        del self._fields[self.maxsize:]
+        return entry
+
+    def ret_segs(self, lons, lats, d, levels):
+        """等値線の値毎の全領域の線分を返す
+
+        Parameters:
+        ----------
+        lons: ndarray
+            経度データ（2次元、度）
+        lats: ndarray
+            緯度データ（2次元、度）
+        d: ndarray
+            データ（2次元）
+        levels: list(float, ...)
+            等値線の値
+        ----------
+        Returns:
+        ----------
+        list((list(ndarray, ...), list(ndarray, ...)), ...)
+            等値線の値毎の線分（経度、緯度の(N, 2)配列）と、パスのコードの
+            リスト
+        ----------
+        """
+        _, gen, _, segs = self._ret_entry(lons, lats, d)
+        for level in levels:
+            if level not in segs:
+                segs[level] = gen.lines(level)
+        return [segs[level] for level in levels]
+
+    def contour(self, m, lons, lats, d, levels, **kwargs):
+        """等値線を描く（m.contourの代わり）
+
+        保持した全領域の線分のうち、地図の範囲（格子1つ分の余白を付ける）の
+        部分だけを切り出して描く
+
+        Parameters:
+        ----------
+        m: mpl_toolkits.basemap.Basemap
+            地図
+        lons: ndarray
+            経度データ（2次元、度）
+        lats: ndarray
+            緯度データ（2次元、度）
+        d: ndarray
+            データ（2次元）
+        levels: list(float, ...)
+            等値線の値
+        kwargs: dict
+            colors、linestyles、linewidthsなど（m.contourと同じ）
+        ----------
+        Returns:
+        ----------
+        matplotlib.contour.ContourSet
+            ラベルを付けるためのオブジェクト
+        ----------
+        """
+        levels = list(levels)
+        allsegs = self.ret_segs(lons, lats, d, levels)
+        _, _, (dx, dy), _ = self._ret_entry(lons, lats, d)
+        bbox = (min(m.llcrnrlon, m.urcrnrlon) - dx,
+                max(m.llcrnrlon, m.urcrnrlon) + dx,
+                min(m.llcrnrlat, m.urcrnrlat) - dy,
+                max(m.llcrnrlat, m.urcrnrlat) + dy)
+        allsegs_clip = []
+        allkinds_clip = []
+        for segs, kinds in allsegs:
+            segs_clip = []
+            kinds_clip = []
+            for seg, kind in zip(segs, kinds):
+                parts = clip_seg(seg, bbox)
+                # 切り出した線分はコード無し（MOVETO、LINETO）にする
+                if len(parts) != 1 or len(parts[0]) != len(seg):
+                    kind = None
+                for part in parts:
+                    segs_clip.append(np.column_stack(m(part[:, 0],
+                                                       part[:, 1])))
+                    kinds_clip.append(kind)
+            allsegs_clip.append(segs_clip)
+            allkinds_clip.append(kinds_clip)
+        if not any(allsegs_clip):
+            # 地図の範囲に等値線が無い
+            return m.contour(lons, lats, d, levels=levels, **kwargs)
+        ax = m._check_ax()
+        cs = mcontour.ContourSet(ax, levels, allsegs_clip, allkinds_clip,
+                                 **kwargs)
+        m.set_axes_limits(ax=ax)
+        return cs
+
+
+def clip_seg(seg, bbox):
+    """線分segのうち、範囲bboxの中の部分を返す
+
+    Parameters:
+    ----------
+    seg: ndarray
+        線分（経度、緯度の(N, 2)配列）
+    bbox: tuple(float, float, float, float)
+        経度の最小値、最大値、緯度の最小値、最大値
+    ----------
+    Returns:
+    ----------
+    list(ndarray, ...)
+        範囲の中で連続する部分の線分（2点以上）のリスト
+    ----------
+    """
+    x_min, x_max, y_min, y_max = bbox
+    inside = ((seg[:, 0] >= x_min) & (seg[:, 0] <= x_max) &
+              (seg[:, 1] >= y_min) & (seg[:, 1] <= y_max))
+    if inside.all():
+        return [seg]
+    if not inside.any():
+        return []
+    # 範囲の中で連続する部分の始点、終点
+    edges = np.diff(np.concatenate([[0], inside.astype(np.int8), [0]]))
+    strs = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    return [seg[s:e] for s, e in zip(strs, ends) if e - s >= 2]
+
+
+# 作図スクリプトで共有するキャッシュ
+_contour_cache = ContourCache()
+
+
+def cached_contour(m, lons, lats, d, levels, **kwargs):
+    """等値線を描く（全領域の線分は、データと等値線の値毎に1回だけ計算する）
+
+    Parameters:
+    ----------
+    m: mpl_toolkits.basemap.Basemap
+        地図
+    lons: ndarray
+        経度データ（2次元、度）
+    lats: ndarray
+        緯度データ（2次元、度）
+    d: ndarray
+        データ（2次元）
+    levels: list(float, ...)
+        等値線の値
+    kwargs: dict
+        colors、linestyles、linewidthsなど（m.contourと同じ）
+    ----------
+    Returns:
+    ----------
+    matplotlib.contour.ContourSet
+        ラベルを付けるためのオブジェクト
+    ----------
+    """
+    return _contour_cache.contour(m, lons, lats, d, levels, **kwargs)
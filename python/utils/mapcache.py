@@ -0,0 +1,36 @@
+#
+#  地図（Basemap）を範囲・解像度毎に1回だけ作り、作図で使い回す
+#
+from mpl_toolkits.basemap import Basemap
+
+# Basemapの引数: Basemap
+_basemaps = dict()
+
+
+def cached_basemap(**kwargs):
+    """地図を返す（同じ引数の地図は、最初に作ったものを返す）
+
+    Basemapの作成（特に高解像度の海岸線の読み込み）には時間がかかるため、
+    予報時間・プロダクトが変わっても同じ範囲・解像度の地図は作り直さない。
+    Basemapは描画先を持たない（ax=Noneの）まま使い、図はその都度作る
+
+    Parameters:
+    ----------
+    kwargs: dict
+        Basemapの引数（llcrnrlon、urcrnrlon、llcrnrlat、urcrnrlat、
+        resolution、projectionなど）
+    ----------
+    Returns:
+    ----------
+    mpl_toolkits.basemap.Basemap
+        地図
+    ----------
+    """
+    if kwargs.get("ax") is not None:
+        raise ValueError("cached_basemap does not take ax")
+    key = tuple(sorted(kwargs.items()))
+    m = _basemaps.get(key)
+    if m is None:
+        m = Basemap(**kwargs)
+        _basemaps[key] = m
+    return m
@@ -0,0 +1,36 @@
+#
+#  出力の設定（utils.output_profiles）に従って図を保存する
+#
+import matplotlib.pyplot as plt
+from . import output_profiles
+
+
+def savefig(output_filename, profile="print", fig=None, opt_margins=True):
+    """図を保存する
+
+    tight=Falseの設定では余白を固定の値にして、余白を求めるための描画を省く
+
+    Parameters:
+    ----------
+    output_filename: str
+        出力ファイル名
+    profile: str
+        出力の設定（print、web、thumb）
+    fig: matplotlib.figure.Figure
+        保存する図（Noneの場合は現在の図）
+    opt_margins: bool
+        tight=Falseの設定で、余白を設定の値にするかどうか
+        （Falseの場合は作図プログラムで設定した余白のまま）
+    ----------
+    """
+    if profile not in output_profiles:
+        raise ValueError("unknown output profile: " + str(profile))
+    prof = output_profiles[profile]
+    if fig is None:
+        fig = plt.gcf()
+    if prof["tight"]:
+        fig.savefig(output_filename, dpi=prof["dpi"], bbox_inches='tight')
+    else:
+        if opt_margins:
+            fig.subplots_adjust(**prof["margins"])
+        fig.savefig(output_filename, dpi=prof["dpi"])
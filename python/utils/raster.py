@@ -0,0 +1,161 @@
+#
+#  陰影をcontourfの代わりに、格子毎の色の画像（imshow）で描く
+#
+import numpy as np
+import matplotlib.colors as mcolors
+import matplotlib.cm as mcm
+
+
+def ret_lut(levels, cmap, extend='neither', alpha=None):
+    """contourfと同じ色になる、階級毎の色のテーブルを返す
+
+    contourfは階級の中央の値の色で塗るため、同じ値をcmapで色に変換する。
+    extendで延長しない側の範囲外は透明にする
+
+    Parameters:
+    ----------
+    levels: list(float, ...)
+        陰影を付ける値（昇順）
+    cmap: matplotlib.colors.Colormap
+        色テーブル
+    extend: str
+        neither、both、min、max（contourfのextend）
+    alpha: float
+        透明度
+    ----------
+    Returns:
+    ----------
+    lut: ndarray
+        np.digitize(d, levels)の階級毎のRGBA（len(levels) + 1, 4）
+    ----------
+    """
+    levels = np.asarray(levels, dtype=np.float64)
+    norm = mcolors.Normalize(vmin=levels.min(), vmax=levels.max())
+    lut = np.zeros((len(levels) + 1, 4))
+    lut[1:-1] = cmap(norm(0.5 * (levels[:-1] + levels[1:])))
+    if extend in ('both', 'min'):
+        lut[0] = cmap(-np.inf)
+    if extend in ('both', 'max'):
+        lut[-1] = cmap(np.inf)
+    if alpha is not None:
+        lut[lut[:, 3] > 0, 3] *= alpha
+    return lut
+
+
+def digitize(d, levels):
+    """データを陰影の階級の番号に変換する（contourfと同じ境界の扱い）
+
+    levels[i - 1] < d <= levels[i]がi、levels[0]と等しい値は1、
+    levels[0]未満は0、levels[-1]を超える値はlen(levels)、
+    欠損値は-1（lut[-1]の後に透明の色を足して引く）
+    """
+    mask = np.ma.getmaskarray(d)
+    d = np.ma.getdata(d)
+    bins = np.digitize(d, levels, right=True)
+    bins[d == levels[0]] = 1
+    bins[mask | np.isnan(d)] = -1
+    return bins
+
+
+def _ret_window(x, x_min, x_max):
+    """格子点xのうち、範囲x_min〜x_maxを覆う部分のスライスを返す（両端に1点足す）"""
+    i = np.nonzero((x >= min(x_min, x_max)) & (x <= max(x_min, x_max)))[0]
+    if len(i) == 0:
+        return slice(0, len(x))
+    return slice(max(i[0] - 1, 0), min(i[-1] + 2, len(x)))
+
+
+def _covers(m, lons, lats):
+    """格子の四隅が地図の範囲を覆っているかを返す（緯度は南から北の順）"""
+    return (lons[0, 0] <= min(m.llcrnrlon, m.urcrnrlon)
+            and lons[-1, -1] >= max(m.llcrnrlon, m.urcrnrlon)
+            and lats[0, 0] <= min(m.llcrnrlat, m.urcrnrlat)
+            and lats[-1, -1] >= max(m.llcrnrlat, m.urcrnrlat))
+
+
+def shade(m, lons, lats, d, levels, cmap, extend='neither', alpha=None,
+          render="contour", window=None):
+    """陰影を描く
+
+    render="contour"の場合はm.contourfで、"raster"の場合は格子毎に
+    階級の色を付けた画像を1回のimshowで描く（等値線の多角形を作らないため速い）。
+    rasterは等間隔の緯度・経度格子で、正距円筒図法のBasemapの場合のみ使う
+
+    Parameters:
+    ----------
+    m: mpl_toolkits.basemap.Basemap
+        地図
+    lons: ndarray
+        経度データ（2次元、度）
+    lats: ndarray
+        緯度データ（2次元、度）
+    d: ndarray
+        データ（2次元）
+    levels: list(float, ...)
+        陰影を付ける値
+    cmap: matplotlib.colors.Colormap
+        色テーブル
+    extend: str
+        neither、both、min、max（contourfのextend）
+    alpha: float
+        透明度
+    render: str
+        contour、raster
+    window: tuple(slice, slice)
+        作図範囲の格子のスライス（緯度、経度の順、MapRegion.get_slicesの値）、
+        Noneの場合は格子全体を使う（rasterでは地図の範囲から求める）
+    ----------
+    Returns:
+    ----------
+    matplotlib.contour.QuadContourSet or matplotlib.cm.ScalarMappable
+        カラーバーを付けるためのオブジェクト
+    ----------
+    """
+    use_window = False
+    if window is not None:
+        js, is_ = window
+        if _covers(m, lons[js, is_], lats[js, is_]):
+            # 作図範囲のデータだけを使う（コピーしない）
+            lons, lats, d = lons[js, is_], lats[js, is_], d[js, is_]
+            use_window = True
+    if render == "contour":
+        return m.contourf(lons,
+                          lats,
+                          d,
+                          levels=levels,
+                          cmap=cmap,
+                          extend=extend,
+                          alpha=alpha)
+    if render != "raster":
+        raise ValueError("render must be contour or raster, not " + render)
+    lut = ret_lut(levels, cmap, extend=extend, alpha=alpha)
+    # 地図の範囲の格子だけを使う（画像の拡大・縮小の計算を減らす）
+    lons_1d = lons[0, :]
+    lats_1d = lats[:, 0]
+    if use_window:
+        ix = iy = slice(None)
+    else:
+        ix = _ret_window(lons_1d, m.llcrnrlon, m.urcrnrlon)
+        iy = _ret_window(lats_1d, m.llcrnrlat, m.urcrnrlat)
+    lons_1d = lons_1d[ix]
+    lats_1d = lats_1d[iy]
+    bins = digitize(d[iy, ix], levels)
+    # RGBAは8bitにする（imshowの計算が速い）、欠損値は透明
+    lut8 = np.vstack([np.round(lut * 255), np.zeros(4)]).astype(np.uint8)
+    rgba = lut8[bins]
+    # 格子の中心が格子点になるように画像の範囲を決める
+    dx = (lons_1d[-1] - lons_1d[0]) / max(len(lons_1d) - 1, 1) * 0.5
+    dy = (lats_1d[-1] - lats_1d[0]) / max(len(lats_1d) - 1, 1) * 0.5
+    m.imshow(rgba,
+             extent=(lons_1d[0] - dx, lons_1d[-1] + dx, lats_1d[0] - dy,
+                     lats_1d[-1] + dy),
+             origin='lower',
+             interpolation='nearest')
+    # カラーバー用（contourfと同じ階級・色）
+    cmap_bar = mcolors.ListedColormap(lut[1:-1])
+    cmap_bar.set_under(lut[0])
+    cmap_bar.set_over(lut[-1])
+    cmap_bar.colorbar_extend = extend
+    return mcm.ScalarMappable(norm=mcolors.BoundaryNorm(levels,
+                                                        len(levels) - 1),
+                              cmap=cmap_bar)
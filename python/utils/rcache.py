@@ -0,0 +1,175 @@
+#
+#  作図結果のキャッシュ
+#
+import os
+import sys
+import json
+import shutil
+import hashlib
+from datetime import datetime
+
+# キャッシュを置くディレクトリ（未設定の場合はキャッシュを使わない）
+render_cache_dir = os.environ.get('RENDER_CACHE_DIR')
+
+# キャッシュの形式を変えた場合に更新する
+cache_version = "1"
+
+
+def _file_sign(file_name, opt_hash=False):
+    """入力ファイルの識別情報（ファイル名、サイズ、更新時刻またはハッシュ値）を返す"""
+    st = os.stat(file_name)
+    if opt_hash:
+        h = hashlib.sha1()
+        with open(file_name, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                h.update(chunk)
+        return [os.path.basename(file_name), st.st_size, h.hexdigest()]
+    return [os.path.basename(file_name), st.st_size, st.st_mtime_ns]
+
+
+def _code_version():
+    """作図プログラムと、同じディレクトリから読み込んだモジュールのハッシュ値を返す"""
+    h = hashlib.sha1(cache_version.encode())
+    main_file = getattr(sys.modules.get('__main__'), '__file__', None)
+    if main_file is None:
+        return h.hexdigest()
+    top = os.path.dirname(os.path.abspath(main_file))
+    files = set([os.path.abspath(main_file)])
+    for mod in list(sys.modules.values()):
+        f = getattr(mod, '__file__', None)
+        if f is not None and os.path.abspath(f).startswith(top + os.sep):
+            files.add(os.path.abspath(f))
+    for f in sorted(files):
+        if f.endswith(".py") and os.path.isfile(f):
+            with open(f, 'rb') as fin:
+                h.update(fin.read())
+    return h.hexdigest()
+
+
+class RenderCache():
+    """作図結果のキャッシュ
+
+    入力ファイル、作図プログラム、地域、気圧面、予報時間が同じ場合には
+    作図をせずにキャッシュした画像を再利用する
+    """
+
+    def __init__(self, product, cache_dir=None, opt_hash=False):
+        """キャッシュの設定
+
+        Parameters:
+        ----------
+        product: str
+            作図プログラムの種類（例：msm_mslp）
+        cache_dir: str
+            キャッシュを置くディレクトリ
+            （Noneの場合は環境変数RENDER_CACHE_DIR、未設定ならキャッシュを使わない）
+        opt_hash: bool
+            入力ファイルをハッシュ値で識別するかどうか（Falseの場合はサイズと更新時刻）
+        ----------
+        """
+        if cache_dir is None:
+            cache_dir = render_cache_dir
+        self.product = product
+        self.cache_dir = cache_dir
+        self.opt_hash = opt_hash
+        self.enabled = cache_dir is not None
+        self.code_version = None
+        self._signs = dict()
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.code_version = _code_version()
+
+    def ret_key(self, input_files, **kwargs):
+        """キャッシュのキーを返す
+
+        Parameters:
+        ----------
+        input_files: list(str, str, ...)
+            入力ファイルのリスト
+        **kwargs: dict
+            地域（sta）、気圧面（level）、予報時間（fcst_time）など
+        ----------
+        Returns:
+        ----------
+        key: str
+            キャッシュのキー（キャッシュを使わない場合はNone）
+        ----------
+        """
+        if not self.enabled:
+            return None
+        signs = []
+        for f in input_files:
+            if f not in self._signs:
+                self._signs[f] = _file_sign(f, opt_hash=self.opt_hash)
+            signs.append(self._signs[f])
+        info = {
+            "product": self.product,
+            "code_version": self.code_version,
+            "input": signs,
+            "option": {k: str(v)
+                       for k, v in kwargs.items()},
+        }
+        info = json.dumps(info, sort_keys=True)
+        return hashlib.sha1(info.encode()).hexdigest()
+
+    def _cache_file(self, key, output_filename):
+        """キャッシュファイル名を返す"""
+        ext = os.path.splitext(output_filename)[1]
+        return os.path.join(self.cache_dir, key[0:2], key + ext)
+
+    def restore(self, key, output_filename):
+        """キャッシュがあれば出力ファイルとして復元する
+
+        Parameters:
+        ----------
+        key: str
+            キャッシュのキー
+        output_filename: str
+            出力ファイル名
+        ----------
+        Returns:
+        ----------
+        bool
+            キャッシュから復元した場合はTrue
+        ----------
+        """
+        if key is None:
+            return False
+        cache_file = self._cache_file(key, output_filename)
+        if not os.path.isfile(cache_file):
+            return False
+        shutil.copyfile(cache_file, output_filename)
+        self._record(key, output_filename, "reused")
+        return True
+
+    def store(self, key, output_filename):
+        """作図した出力ファイルをキャッシュに保存する
+
+        Parameters:
+        ----------
+        key: str
+            キャッシュのキー
+        output_filename: str
+            出力ファイル名
+        ----------
+        """
+        if key is None:
+            return
+        cache_file = self._cache_file(key, output_filename)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + "." + str(os.getpid()) + ".tmp"
+        shutil.copyfile(output_filename, tmp_file)
+        os.replace(tmp_file, cache_file)
+        self._record(key, output_filename, "rebuilt")
+
+    def _record(self, key, output_filename, status):
+        """作り直したか再利用したかをmanifest.jsonlに追記する"""
+        entry = {
+            "date": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "product": self.product,
+            "output": output_filename,
+            "key": key,
+            "status": status,
+        }
+        with open(os.path.join(self.cache_dir, "manifest.jsonl"), 'a') as fout:
+            fout.write(json.dumps(entry) + "\n")
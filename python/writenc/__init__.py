@@ -9,6 +9,8 @@ import uuid
 import array
 import os
 import sys
+from .schema import _str2bool
+from .schema import AxisSchema, VarSchema, OutputSchema, load_schema
 
 
 def _get_creation_date():
@@ -26,54 +28,17 @@ def _get_data_range(d):
     return np.min(d), np.max(d)
 
 
-def _str2bool(s):
-    """文字列からboolへの変換"""
-    return s.lower() in ["true", "t", "yes", "1"]
-
-
-def _dim2tuple(s):
-    """次元表記からtupleへの変換"""
-    return tuple(s.split(' '))
-
-
-def _npconvert(v, dtype='double'):
-    """データ型の変換"""
-    if dtype == "char" or dtype == "int8" or dtype == "i1":
-        return np.int8(v)
-    elif dtype == "short" or dtype == "int16" or dtype == "i2":
-        return np.int16(v)
-    elif dtype == "int" or dtype == "int32" or dtype == "i4":
-        return np.int32(v)
-    elif dtype == "long" or dtype == "int64" or dtype == "i8":
-        return np.int64(v)
-    elif dtype == "uint8" or dtype == "u1":
-        return np.uint8(v)
-    elif dtype == "uint16" or dtype == "u2":
-        return np.uint16(v)
-    elif dtype == "uint32" or dtype == "u4":
-        return np.uint32(v)
-    elif dtype == "uint64" or dtype == "u8":
-        return np.uint64(v)
-    elif dtype == "float16" or dtype == "f2":
-        return np.float16(v)
-    elif dtype == "float" or dtype == "float32" or dtype == "f4":
-        return np.float32(v)
-    elif dtype == "double" or dtype == "float64" or dtype == "f8":
-        return np.float64(v)
-    elif dtype == "long double" or dtype == "float128" or dtype == "f16":
-        return np.float128(v)
-    elif dtype == "complex" or dtype == "complex64" or dtype == "c8":
-        return np.complex64(v)
-    elif dtype == "complex128" or dtype == "c16":
-        return np.complex128(v)
-    elif dtype == "complex256" or dtype == "c32":
-        return np.complex256(v)
-    elif dtype == "bool" or dtype == "?":
-        return np.bool(v)
-    elif dtype == "unicode" or dtype == "U":
-        return np.unicode(v)
+def _set_actual_range(st):
+    """書き出したデータの範囲をactual_rangeに設定する
+
+    有効なデータが無い場合は、add_varで入れておいた値を消す
+    """
+    if st["range"] is None:
+        return
+    if st["range"][0] <= st["range"][1]:
+        st["var"].actual_range = np.array(st["range"], dtype=st["dtype"])
     else:
-        return v
+        st["var"].delncattr("actual_range")
 
 
 def count_dind(start_year=1860,
@@ -88,6 +53,35 @@ def count_dind(start_year=1860,
     return (de - ds).days
 
 
+def ret_tind(tinfo, fcst_times):
+    """予報時間の時刻(seconds from 1970-01-01)のリストを返す
+
+    Parameters:
+    ----------
+    tinfo: datetime.datetime
+        予報時刻
+    fcst_times: list(int, ...)
+        予報時刻からの時間（h）
+    ----------
+    Returns:
+    ----------
+    list(int, ...)
+        時刻(seconds from 1970-01-01)
+    ----------
+    """
+    tind = []
+    for fcst_time in fcst_times:
+        tinfo_fcst = tinfo + timedelta(hours=int(fcst_time))
+        days = count_dind(start_year=1970,
+                          start_month=1,
+                          start_day=1,
+                          end_year=tinfo_fcst.year,
+                          end_month=tinfo_fcst.month,
+                          end_day=tinfo_fcst.day)
+        tind.append(days * 86400 + tinfo_fcst.hour * 3600)
+    return tind
+
+
 class WriteNC():
     """ NetCDFファイルを書き出す"""
 
@@ -109,6 +103,9 @@ class WriteNC():
         nc = netCDF4.Dataset(output_filedir, 'w', format='NETCDF3_CLASSIC')
         self.output_filedir = output_filedir
         self.nc = nc
+        # define_varで定義し、write_recで書き出す変数
+        #   出力変数の名前: 変数、型、欠損値、データの範囲、作業配列
+        self._recs = dict()
 
     def create_axis(self,
                     dat,
@@ -158,31 +155,228 @@ class WriteNC():
         \**kwards: dict
             追加のキー、値（エラー抑止のためのダミー）
         """
+        self.add_axis(
+            dat,
+            AxisSchema(axis=axis,
+                       standard_name=standard_name,
+                       long_name=long_name,
+                       dimensions=dimensions,
+                       units=units,
+                       out_name=out_name,
+                       valid_min=valid_min,
+                       valid_max=valid_max,
+                       dtype=dtype,
+                       positive=positive,
+                       calendar=calendar,
+                       actual_range=actual_range))
+
+    def add_axis(self, dat, spec):
+        """軸情報を書き出す（設定はAxisSchemaで与える）
+
+        Parameters:
+        ----------
+        dat: ndarray
+            変数の配列
+        spec: AxisSchema
+            軸の設定
+        ----------
+        """
         nc = self.nc
         # 次元の設定
-        nc.createDimension(out_name, len(dat))
+        nc.createDimension(spec.out_name, len(dat))
         # 変数の設定
-        if dtype == "float":  # np defalut: float64
-            dtype = "float32"
-        var = nc.createVariable(out_name,
-                                np.dtype(dtype).char, _dim2tuple(dimensions))
-        var.axis = axis
-        var.standard_name = standard_name
-        var.long_name = long_name
-        var.units = units
-        if valid_min != "NaN":
-            var.valid_min = _npconvert(valid_min, dtype=dtype)
-        if valid_max != "NaN":
-            var.valid_max = _npconvert(valid_max, dtype=dtype)
-        if positive != "NaN":
-            var.positive = positive
-        if calendar != "NaN":
-            var.calendar = calendar
-        if _str2bool(actual_range):
+        var = nc.createVariable(spec.out_name,
+                                np.dtype(spec.dtype).char, spec.dimensions)
+        var.axis = spec.axis
+        var.standard_name = spec.standard_name
+        var.long_name = spec.long_name
+        var.units = spec.units
+        if spec.valid_min is not None:
+            var.valid_min = spec.valid_min
+        if spec.valid_max is not None:
+            var.valid_max = spec.valid_max
+        if spec.positive is not None:
+            var.positive = spec.positive
+        if spec.calendar is not None:
+            var.calendar = spec.calendar
+        if spec.actual_range:
             var.actual_range = _get_data_range(dat)
         # 変数の書き出し
         var[:] = dat
 
+    def define_var(self,
+                   standard_name='N/A',
+                   long_name='N/A',
+                   dimensions='',
+                   description='',
+                   units='',
+                   out_name='var',
+                   valid_min='NaN',
+                   valid_max='NaN',
+                   scale_factor=1.0,
+                   add_offset=0.0,
+                   missing_value=1e20,
+                   missing_input=1e20,
+                   dtype='double',
+                   actual_range='f',
+                   **kwargs):
+        """変数を定義する（データは書き出さない）
+
+        データはwrite_recで先頭の次元（時間）のレコード毎に書き出す。
+        actual_rangeは書き出したデータの範囲をclose_netcdfで設定する
+    
+        Parameters:
+        ----------
+        standard_name: str
+            変数のstandard name
+        long_name: str
+            変数のlong name
+        dimensions: str
+            変数の次元
+        description: str
+            変数の説明
+        units: str
+            変数の単位
+        out_name: str
+            出力変数の名前
+        valid_min: str or float
+            想定される最小値
+        valid_max: str or float
+            想定される最大値
+        scale_factor: str or float
+            格納するデータのスケールファクター
+        add_offset: str or float
+            格納するデータのオフセット値
+        missing_value: float
+            格納するデータの欠損値
+        missing_input: float
+            入力するデータの欠損値
+        dtype: str
+            出力変数のデータ型
+        actual_range: str
+            実際のデータ範囲を出力する場合はtrue
+        \**kwards: dict
+            追加のキー、値（エラー抑止のためのダミー）
+        Returns
+        ----------
+        var: netCDF4.Variable
+            定義した変数
+        ----------
+        """
+        return self.add_var(
+            VarSchema(standard_name=standard_name,
+                      long_name=long_name,
+                      dimensions=dimensions,
+                      description=description,
+                      units=units,
+                      out_name=out_name,
+                      valid_min=valid_min,
+                      valid_max=valid_max,
+                      scale_factor=scale_factor,
+                      add_offset=add_offset,
+                      missing_value=missing_value,
+                      missing_input=missing_input,
+                      dtype=dtype,
+                      actual_range=actual_range))
+
+    def add_var(self, spec):
+        """変数を定義する（設定はVarSchemaで与える、データは書き出さない）
+
+        Parameters:
+        ----------
+        spec: VarSchema
+            変数の設定
+        ----------
+        Returns
+        ----------
+        var: netCDF4.Variable
+            定義した変数
+        ----------
+        """
+        nc = self.nc
+        var = nc.createVariable(spec.out_name,
+                                np.dtype(spec.dtype).char,
+                                spec.dimensions,
+                                fill_value=spec.missing_value)
+        var.scale_factor = spec.scale_factor
+        var.add_offset = spec.add_offset
+        var.standard_name = spec.standard_name
+        var.long_name = spec.long_name
+        var.description = spec.description
+        var.units = spec.units
+        var.valid_min = spec.valid_min
+        var.valid_max = spec.valid_max
+        var.missing_value = spec.missing_value
+        data_range = None
+        if spec.actual_range:
+            # ヘッダの大きさが変わらないように、同じ型・長さの値を入れておく
+            var.actual_range = np.zeros(2, dtype=spec.dtype)
+            data_range = [np.inf, -np.inf]
+        self._recs[spec.out_name] = {
+            "var": var,
+            "dtype": spec.dtype,
+            "missing_value": spec.missing_value,
+            "missing_input": spec.missing_input,
+            "range": data_range,
+            "buf": None
+        }
+        return var
+
+    def write_rec(self, out_name, rec, dat):
+        """define_varで定義した変数に、1レコード分のデータを書き出す
+
+        入力データは変更しない（欠損値の置き換え、型の変換は1レコード分の
+        作業配列で行い、作業配列は次のレコードでも使う）。マスクされた格子は
+        欠損値にする
+
+        Parameters:
+        ----------
+        out_name: str
+            出力変数の名前
+        rec: int
+            レコード番号（先頭の次元の位置）
+        dat: ndarray
+            1レコード分のデータ（先頭の次元を除いた形）
+        ----------
+        """
+        self._write_block(self._recs[out_name], rec, dat)
+
+    def _write_block(self, st, key, dat):
+        """変数のvar[key]の部分に、データdatを書き出す
+
+        欠損値の置き換え、型の変換は、datと同じ形の作業配列（同じ形の間は
+        使い回す）で行い、datは変更しない。データの範囲も更新する
+
+        Parameters:
+        ----------
+        st: dict
+            define_varで登録した変数の情報（self._recsの値）
+        key: int or tuple(int, ...)
+            書き出す位置（先頭の次元の番号）
+        dat: ndarray
+            書き出すデータ
+        ----------
+        """
+        missing_input = st["missing_input"]
+        if np.ma.isMaskedArray(dat):
+            dat = dat.filled(missing_input)
+        if st["buf"] is None or st["buf"][0].shape != np.shape(dat):
+            st["buf"] = (np.empty(np.shape(dat), dtype=st["dtype"]),
+                         np.empty(np.shape(dat), dtype=bool),
+                         np.empty(np.shape(dat), dtype=bool))
+        buf, valid, invalid = st["buf"]
+        np.not_equal(dat, missing_input, out=valid)
+        if st["range"] is not None and valid.any():
+            st["range"][0] = min(st["range"][0],
+                                 np.min(dat, where=valid, initial=np.inf))
+            st["range"][1] = max(st["range"][1],
+                                 np.max(dat, where=valid, initial=-np.inf))
+        np.copyto(buf, dat, casting='unsafe')
+        np.copyto(buf,
+                  st["missing_value"],
+                  where=np.logical_not(valid, out=invalid))
+        st["var"][key] = buf
+
     def create_var(self,
                    dat,
                    standard_name='N/A',
@@ -200,7 +394,7 @@ class WriteNC():
                    dtype='double',
                    actual_range='f',
                    **kwargs):
-        """軸情報を書き出す
+        """変数を書き出す（入力データは変更しない、write_varを参照）
     
         Parameters:
         ----------
@@ -237,36 +431,48 @@ class WriteNC():
         \**kwards: dict
             追加のキー、値（エラー抑止のためのダミー）
         """
-        nc = self.nc
-        if dtype == "float":  # np defalut: float64
-            dtype = "float32"
-        var = nc.createVariable(out_name,
-                                np.dtype(dtype).char,
-                                _dim2tuple(dimensions),
-                                fill_value=_npconvert(missing_value,
-                                                      dtype=dtype))
-        var.scale_factor = _npconvert(scale_factor)
-        var.add_offset = _npconvert(add_offset)
-        var.standard_name = standard_name
-        var.long_name = long_name
-        var.description = description
-        var.units = units
-        var.valid_min = _npconvert(valid_min, dtype=dtype)
-        var.valid_max = _npconvert(valid_max, dtype=dtype)
-        var.missing_value = _npconvert(missing_value, dtype=dtype)
-        if _str2bool(actual_range):
-            var.actual_range = _get_data_range(dat)
-        # 欠損処理
-        dat[dat == missing_input] = _npconvert(missing_value, dtype=dtype)
-        # 変数の書き出し
-        if len(_dim2tuple(dimensions)) == 4:
-            var[:, :, :, :] = _npconvert(dat, dtype=dtype)
-        elif len(_dim2tuple(dimensions)) == 3:
-            var[:, :, :] = _npconvert(dat, dtype=dtype)
-        elif len(_dim2tuple(dimensions)) == 2:
-            var[:, :] = _npconvert(dat, dtype=dtype)
-        elif len(_dim2tuple(dimensions)) == 1:
-            var[:] = _npconvert(dat, dtype=dtype)
+        spec = VarSchema(standard_name=standard_name,
+                         long_name=long_name,
+                         dimensions=dimensions,
+                         description=description,
+                         units=units,
+                         out_name=out_name,
+                         valid_min=valid_min,
+                         valid_max=valid_max,
+                         scale_factor=scale_factor,
+                         add_offset=add_offset,
+                         missing_value=missing_value,
+                         missing_input=missing_input,
+                         dtype=dtype,
+                         actual_range=actual_range)
+        self.write_var(dat, spec)
+
+    def write_var(self, dat, spec):
+        """変数を定義し、全てのデータを書き出す（設定はVarSchemaで与える）
+
+        入力データは変更しない。欠損値の置き換え、型の変換はレコード毎に
+        作業配列で行うため、全体の大きさの一時配列は作らない。
+        actual_rangeは欠損値を除いたデータの範囲にする
+
+        Parameters:
+        ----------
+        dat: ndarray
+            変数の配列
+        spec: VarSchema
+            変数の設定
+        ----------
+        """
+        var = self.add_var(spec)
+        st = self._recs.pop(spec.out_name)
+        # 3次元以上の場合は先頭の次元（時間）のレコード毎に書き出す
+        dat = np.asanyarray(dat)
+        if dat.ndim >= 3:
+            keys = range(dat.shape[0])
+        else:
+            keys = [slice(None)]
+        for key in keys:
+            self._write_block(st, key, dat[key])
+        _set_actual_range(st)
 
     def set_gattr(self,
                   data_specs_version='',
@@ -331,6 +537,12 @@ class WriteNC():
         nc.created = created
 
     def close_netcdf(self):
-        """NetCDFファイルを閉じる"""
+        """NetCDFファイルを閉じる
+
+        write_recで書き出した変数のactual_rangeを設定してから閉じる
+        """
         nc = self.nc
+        for st in self._recs.values():
+            _set_actual_range(st)
+        self._recs.clear()
         nc.close()
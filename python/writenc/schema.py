@@ -0,0 +1,225 @@
+#
+#  書き出すデータの情報（output.json、output_sur.json）を読み込み、
+#  軸・変数毎の設定に変換しておく
+#
+import json
+import os
+import numpy as np
+
+
+def _str2bool(s):
+    """文字列からboolへの変換"""
+    return s.lower() in ["true", "t", "yes", "1"]
+
+
+def _dim2tuple(s):
+    """次元表記からtupleへの変換"""
+    return tuple(s.split(' '))
+
+
+def _npconvert(v, dtype='double'):
+    """データ型の変換"""
+    if dtype == "char" or dtype == "int8" or dtype == "i1":
+        return np.int8(v)
+    elif dtype == "short" or dtype == "int16" or dtype == "i2":
+        return np.int16(v)
+    elif dtype == "int" or dtype == "int32" or dtype == "i4":
+        return np.int32(v)
+    elif dtype == "long" or dtype == "int64" or dtype == "i8":
+        return np.int64(v)
+    elif dtype == "uint8" or dtype == "u1":
+        return np.uint8(v)
+    elif dtype == "uint16" or dtype == "u2":
+        return np.uint16(v)
+    elif dtype == "uint32" or dtype == "u4":
+        return np.uint32(v)
+    elif dtype == "uint64" or dtype == "u8":
+        return np.uint64(v)
+    elif dtype == "float16" or dtype == "f2":
+        return np.float16(v)
+    elif dtype == "float" or dtype == "float32" or dtype == "f4":
+        return np.float32(v)
+    elif dtype == "double" or dtype == "float64" or dtype == "f8":
+        return np.float64(v)
+    elif dtype == "long double" or dtype == "float128" or dtype == "f16":
+        return np.float128(v)
+    elif dtype == "complex" or dtype == "complex64" or dtype == "c8":
+        return np.complex64(v)
+    elif dtype == "complex128" or dtype == "c16":
+        return np.complex128(v)
+    elif dtype == "complex256" or dtype == "c32":
+        return np.complex256(v)
+    elif dtype == "bool" or dtype == "?":
+        return np.bool(v)
+    elif dtype == "unicode" or dtype == "U":
+        return np.unicode(v)
+    else:
+        return v
+
+
+def _ret_dtype(dtype):
+    """出力変数のデータ型の名前を返す（floatはfloat32にする）"""
+    if dtype == "float":  # np defalut: float64
+        dtype = "float32"
+    try:
+        np.dtype(dtype)
+    except TypeError:
+        raise ValueError("invalid dtype: " + str(dtype))
+    return dtype
+
+
+def _ret_opt(v, dtype):
+    """値がNaN（未設定）の場合はNone、それ以外はdtypeに変換して返す"""
+    if v is None or v == "NaN":
+        return None
+    return _npconvert(v, dtype=dtype)
+
+
+class AxisSchema():
+    """軸の設定（axis_entryの1つ）
+
+    文字列の値は作成時に変換しておく（未設定の値はNone）
+    """
+
+    def __init__(self,
+                 axis='none',
+                 standard_name='N/A',
+                 long_name='N/A',
+                 dimensions='',
+                 units='',
+                 out_name='var',
+                 valid_min='NaN',
+                 valid_max='NaN',
+                 dtype='double',
+                 positive="NaN",
+                 calendar="NaN",
+                 actual_range='f'):
+        """設定の変換（引数はWriteNC.create_axisと同じ）"""
+        self.axis = axis
+        self.standard_name = standard_name
+        self.long_name = long_name
+        self.units = units
+        self.out_name = out_name
+        self.dimensions = _dim2tuple(dimensions)
+        self.dtype = _ret_dtype(dtype)
+        self.valid_min = _ret_opt(valid_min, self.dtype)
+        self.valid_max = _ret_opt(valid_max, self.dtype)
+        self.positive = None if positive == "NaN" else positive
+        self.calendar = None if calendar == "NaN" else calendar
+        self.actual_range = _str2bool(actual_range)
+
+
+class VarSchema():
+    """変数の設定（variable_entryの1つ）
+
+    文字列の値は作成時に変換しておく
+    """
+
+    def __init__(self,
+                 standard_name='N/A',
+                 long_name='N/A',
+                 dimensions='',
+                 description='',
+                 units='',
+                 out_name='var',
+                 valid_min='NaN',
+                 valid_max='NaN',
+                 scale_factor=1.0,
+                 add_offset=0.0,
+                 missing_value=1e20,
+                 missing_input=1e20,
+                 dtype='double',
+                 actual_range='f'):
+        """設定の変換（引数はWriteNC.create_varと同じ）"""
+        self.standard_name = standard_name
+        self.long_name = long_name
+        self.description = description
+        self.units = units
+        self.out_name = out_name
+        self.dimensions = _dim2tuple(dimensions)
+        self.dtype = _ret_dtype(dtype)
+        self.valid_min = _npconvert(valid_min, dtype=self.dtype)
+        self.valid_max = _npconvert(valid_max, dtype=self.dtype)
+        self.scale_factor = _npconvert(scale_factor)
+        self.add_offset = _npconvert(add_offset)
+        self.missing_value = _npconvert(missing_value, dtype=self.dtype)
+        self.missing_input = float(missing_input)
+        self.actual_range = _str2bool(actual_range)
+
+
+class OutputSchema():
+    """書き出すデータの情報（Header、axis_entry、variable_entry）"""
+
+    def __init__(self, info, name="schema"):
+        """設定の変換と確認
+
+        Parameters:
+        ----------
+        info: dict
+            JSONファイルの内容
+        name: str
+            エラーメッセージに使う名前（ファイルのパスなど）
+        ----------
+        """
+        for sec in ["Header", "axis_entry", "variable_entry"]:
+            if sec not in info:
+                raise ValueError("no " + sec + " in " + name)
+        # Global Attributes（WriteNC.set_gattrの引数）
+        self.header = dict(info["Header"])
+        # キー: AxisSchema、VarSchema（JSONファイルの順）
+        self.axes = dict()
+        self.variables = dict()
+        for sec, cls, entries in [("axis_entry", AxisSchema, self.axes),
+                                  ("variable_entry", VarSchema,
+                                   self.variables)]:
+            for k, entry in info[sec].items():
+                try:
+                    entries[k] = cls(**entry)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(name + ": " + sec + " " + k + ": " +
+                                     str(e))
+        # 出力変数の名前の重複、次元の確認
+        out_names = [e.out_name for e in self.axes.values()]
+        out_names += [e.out_name for e in self.variables.values()]
+        if len(set(out_names)) != len(out_names):
+            raise ValueError("duplicate out_name in " + name)
+        dims = set(e.out_name for e in self.axes.values())
+        for k, e in list(self.axes.items()) + list(self.variables.items()):
+            for dim in e.dimensions:
+                if dim not in dims:
+                    raise ValueError(name + ": " + k + ": unknown dimension " +
+                                     dim)
+
+
+# 読み込んだJSONファイル
+#   パス: (更新時刻, OutputSchema)
+_schemas = dict()
+
+
+def load_schema(info_json_path):
+    """JSONファイルを読み込み、OutputSchemaを返す
+
+    同じプロセスでは、ファイルが更新されていなければ前回のOutputSchemaを
+    返す（同じオブジェクトを共有するため、値は変更しない）
+
+    Parameters:
+    ----------
+    info_json_path: str
+        書き出すデータの情報を記述したJSONファイルのパス
+    ----------
+    Returns:
+    ----------
+    OutputSchema
+        書き出すデータの情報
+    ----------
+    """
+    path = os.path.abspath(info_json_path)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _schemas.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rt') as fin:
+        info = json.load(fin)
+    schema = OutputSchema(info, name=info_json_path)
+    _schemas[path] = (mtime, schema)
+    return schema